@@ -12,6 +12,8 @@ from db.models.log import *
 from db.models.qas import *
 from db.models.emby import *
 from db.models.ai_config import *
+from db.models.resource import *
+from db.models.quark import *
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
@@ -0,0 +1,40 @@
+"""emby_library_sync
+
+Revision ID: 5d92c0e8a7f1
+Revises: e41c7a9f0d3b
+Create Date: 2026-10-18 11:37:12.405391+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d92c0e8a7f1'
+down_revision: Union[str, Sequence[str], None] = 'e41c7a9f0d3b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('emby_library_sync',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('host', sa.String(length=256), nullable=False),
+    sa.Column('last_date_created', sa.DateTime(), nullable=True),
+    sa.Column('last_item_ids', sa.JSON(), nullable=True),
+    sa.Column('synced_at', sa.DateTime(), nullable=False),
+    sa.Column('failures', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('next_poll_at', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('emby_library_sync')
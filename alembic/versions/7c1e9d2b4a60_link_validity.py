@@ -0,0 +1,37 @@
+"""link_validity
+
+Revision ID: 7c1e9d2b4a60
+Revises: 5a0957edd67c
+Create Date: 2026-10-18 08:12:40.512317+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c1e9d2b4a60'
+down_revision: Union[str, Sequence[str], None] = '5a0957edd67c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('link_validity',
+    sa.Column('url', sa.String(length=512), nullable=False),
+    sa.Column('state', sa.String(length=16), nullable=False),
+    sa.Column('status', sa.String(length=256), nullable=False),
+    sa.Column('checked_at', sa.DateTime(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('url')
+    )
+    op.create_index('ix_link_validity_expires_at', 'link_validity', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_link_validity_expires_at', table_name='link_validity')
+    op.drop_table('link_validity')
@@ -0,0 +1,39 @@
+"""hot_query_indexes
+
+Revision ID: b3f8a61d2c45
+Revises: 7c1e9d2b4a60
+Create Date: 2026-10-18 09:05:17.204518+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3f8a61d2c45'
+down_revision: Union[str, Sequence[str], None] = '7c1e9d2b4a60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_user_apscheduler_jobs_user_id_active', 'user_apscheduler_jobs', ['user_id', 'id'],
+                    unique=False, sqlite_where=sa.text('deleted_at IS NULL'))
+    op.create_index('ix_user_apscheduler_jobs_job_id_active', 'user_apscheduler_jobs', ['apscheduler_job_id'],
+                    unique=False, sqlite_where=sa.text('deleted_at IS NULL'))
+    op.create_index('ix_operation_log_user_id_created_at', 'operation_log', ['user_id', 'created_at'], unique=False)
+    op.create_index('ix_ai_provider_config_user_id_provider_name', 'ai_provider_config', ['user_id', 'provider_name'],
+                    unique=False)
+    # qas_config.user_id、emby_config.user_id 已有唯一约束（自带索引），无需再建
+    op.execute('ANALYZE')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_ai_provider_config_user_id_provider_name', table_name='ai_provider_config')
+    op.drop_index('ix_operation_log_user_id_created_at', table_name='operation_log')
+    op.drop_index('ix_user_apscheduler_jobs_job_id_active', table_name='user_apscheduler_jobs')
+    op.drop_index('ix_user_apscheduler_jobs_user_id_active', table_name='user_apscheduler_jobs')
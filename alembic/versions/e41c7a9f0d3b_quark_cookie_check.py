@@ -0,0 +1,40 @@
+"""quark_cookie_check
+
+Revision ID: e41c7a9f0d3b
+Revises: b3f8a61d2c45
+Create Date: 2026-10-18 10:21:46.718203+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e41c7a9f0d3b'
+down_revision: Union[str, Sequence[str], None] = 'b3f8a61d2c45'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('quark_cookie_check',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('cookies_digest', sa.String(length=40), nullable=False),
+    sa.Column('state', sa.String(length=16), nullable=False),
+    sa.Column('failures', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('checked_at', sa.DateTime(), nullable=False),
+    sa.Column('next_check_at', sa.DateTime(), nullable=True),
+    sa.Column('notified_at', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('quark_cookie_check')
@@ -11,7 +11,7 @@ from api.common import cancel_conversation_callback
 from config.config import get_allow_roles_command_map
 from db.models.ai_config import AIProviderConfig
 from db.models.user import User
-from utils.crypto import encrypt_sensitive_data, decrypt_sensitive_data
+from utils.crypto import encrypt_sensitive_data, decrypt_sensitive_data, forget_decrypted
 
 logger = logging.getLogger(__name__)
 
@@ -139,6 +139,7 @@ async def handle_api_key_input(update: Update, context: ContextTypes.DEFAULT_TYP
         )
         session.add(config)
     else:
+        forget_decrypted(config.api_key)
         config.api_key = encrypt_sensitive_data(api_key)
 
     session.commit()
@@ -234,6 +235,7 @@ async def delete_config(update: Update, context: ContextTypes.DEFAULT_TYPE, sess
     ).first()
 
     if config:
+        forget_decrypted(config.api_key)
         session.delete(config)
         session.commit()
         await update.effective_message.reply_text(f"✅ {provider.upper()} 配置已删除")
@@ -7,7 +7,8 @@ from utils.command_middleware import depends
 
 commands = []
 
-def command(name: str, description: str, args: str= ""):
+def command(name: str, description: str, args: str= "", async_session: bool = False):
+    """注册命令；async_session 为 True 时 handler 收到的是 AsyncSession"""
     def decorator(func: Callable):
         command_name_role_map = get_allow_roles_command_map()
         allow_roles = command_name_role_map.get(name, None)
@@ -15,7 +16,7 @@ def command(name: str, description: str, args: str= ""):
             'name': name,
             'description': description,
             'args': args,
-            'handler': CommandHandler(name, depends(allowed_roles=allow_roles)(func)),
+            'handler': CommandHandler(name, depends(allowed_roles=allow_roles, async_session=async_session)(func)),
             'func': func,
         })
         return func
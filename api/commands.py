@@ -1,35 +1,115 @@
+import hashlib
 import logging
-from typing import List, Optional
+from typing import List, Optional, Union
 
 import telegram
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
 from telegram import Update, BotCommand, BotCommandScopeDefault
 from telegram.ext import ContextTypes
 
 from api.base import get_bot_commands
-from config.config import ROLE_COMMANDS
+from config.config import ROLE_COMMANDS, DEFAULT_COMMANDS
 from db.models.user import User
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_SCOPE_KEY = 'default'
 
-async def set_commands(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, users: Optional[List[User]]=None):
+
+class CommandMenuSync:
+    """
+    命令菜单同步：记录每个作用域最近一次推送的命令列表摘要，只有期望的菜单变化时才调用 set_my_commands
+
+    进程重启后记录为空，启动时的全量同步会重新推送一遍
+    """
+
+    def __init__(self):
+        # 作用域（'default' 或 tg_id）-> 已推送命令列表的摘要
+        self._pushed = dict()
+        self.pushes = 0
+        self.skips = 0
+
+    @staticmethod
+    def digest(commands: List[BotCommand]) -> str:
+        return hashlib.sha1(
+            "\n".join(f"{c.command}:{c.description}" for c in commands).encode()
+        ).hexdigest()
+
+    @staticmethod
+    def expected_commands(role_name: Optional[str]) -> List[BotCommand]:
+        """角色对应的命令菜单，未注册用户使用默认菜单"""
+        if role_name is None:
+            return DEFAULT_COMMANDS
+        bot_commands = get_bot_commands()
+        return [bot_commands[command_name] for command_name in ROLE_COMMANDS.get(role_name, [])]
+
+    async def _push(self, bot: telegram.Bot, key, commands: List[BotCommand], scope, force: bool) -> bool:
+        digest = self.digest(commands)
+        if not force and self._pushed.get(key) == digest:
+            self.skips += 1
+            return False
+        # 先记录再推送，同一用户的并发更新不会重复推送
+        self._pushed[key] = digest
+        try:
+            await bot.set_my_commands(commands, scope=scope)
+        except Exception:
+            self._pushed.pop(key, None)
+            raise
+        self.pushes += 1
+        return True
+
+    async def sync_default(self, bot: telegram.Bot, force: bool = False) -> bool:
+        return await self._push(bot, DEFAULT_SCOPE_KEY, DEFAULT_COMMANDS, BotCommandScopeDefault(), force)
+
+    async def sync_user(self, bot: telegram.Bot, tg_id, role_name: Optional[str], force: bool = False) -> bool:
+        """同步单个用户的菜单，role_name 为 None 表示未注册用户；返回是否实际推送"""
+        return await self._push(
+            bot, int(tg_id), self.expected_commands(role_name), telegram.BotCommandScopeChat(tg_id), force
+        )
+
+    async def reconcile(self, bot: telegram.Bot, session: Union[Session, AsyncSession], force: bool = False) -> int:
+        """全量同步默认菜单和所有用户的菜单，返回实际推送次数；session 可为同步或异步会话"""
+        pushed = int(await self.sync_default(bot, force=force))
+        statement = select(User).options(joinedload(User.role))
+        if isinstance(session, AsyncSession):
+            users = (await session.scalars(statement)).all()
+        else:
+            users = session.scalars(statement).all()
+        for user in users:
+            try:
+                pushed += await self.sync_user(bot, user.tg_id, user.role.name, force=force)
+            except Exception as e:
+                logger.error(f"同步用户 {user.tg_id} 命令菜单失败: {e}")
+        logger.info(f"命令菜单同步完成：{len(users)} 个用户，推送 {pushed} 次")
+        return pushed
+
+    def forget(self, *tg_ids):
+        """忘记已推送的记录，下次同步时重新推送"""
+        for tg_id in tg_ids:
+            self._pushed.pop(int(tg_id), None)
+
+    def stats(self) -> dict:
+        return {
+            'scopes': len(self._pushed),
+            'pushes': self.pushes,
+            'skips': self.skips,
+        }
+
+
+command_menu_sync = CommandMenuSync()
+
+
+async def set_commands(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Union[Session, AsyncSession], users: Optional[List[User]]=None, force: bool = False):
+    """同步命令菜单，不传 users 时同步所有用户；菜单未变化的作用域不会调用 Telegram API"""
     if not users:
-        users = session.query(User).all()
-    logger.info(f"Setting {len(users)} users commands")
-    await context.bot.set_my_commands([
-        BotCommand('register', "注册"),
-        BotCommand('refresh_menu', "刷新菜单"),
-    ], scope=BotCommandScopeDefault())
+        await command_menu_sync.reconcile(context.bot, session, force=force)
+        return
 
-    bot_commands = get_bot_commands()
+    logger.info(f"Setting {len(users)} users commands")
+    await command_menu_sync.sync_default(context.bot, force=force)
     for user in users:
         if not user:
             continue
-        command_names = ROLE_COMMANDS.get(user.role.name)
-        to_set_commands = list()
-        for command_name in command_names:
-            to_set_commands.append(bot_commands[command_name])
-        await context.bot.set_my_commands(to_set_commands, scope=telegram.BotCommandScopeChat(user.tg_id))
-
-
+        await command_menu_sync.sync_user(context.bot, user.tg_id, user.role.name, force=force)
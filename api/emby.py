@@ -1,8 +1,10 @@
+import asyncio
 import logging
 
 from sqlalchemy.orm import Session
 from sqlalchemy.testing.suite.test_reflection import metadata
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto
+from telegram.constants import MediaGroupLimit
 from telegram.constants import ParseMode
 from telegram.ext import ConversationHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
 
@@ -12,11 +14,13 @@ from config.config import get_allow_roles_command_map
 from db.models.emby import EmbyConfig
 from db.models.user import User
 from utils.command_middleware import depends
-from utils.emby import Emby
-from utils.crypto import encrypt_sensitive_data, decrypt_sensitive_data
+from utils.emby import Emby, forget_emby_session
+from utils.crypto import encrypt_sensitive_data, decrypt_sensitive_data, forget_decrypted
+from utils.telegram_sender import send_queue, PRIORITY_BULK
 
 HOST_SET, API_TOKEN_SET, USERNAME_SET, PWD_SET = range(4)
 EMBY_EDIT_FIELD_SELECT, EMBY_EDIT_HOST, EMBY_EDIT_API_TOKEN, EMBY_EDIT_USERNAME, EMBY_EDIT_PASSWORD = range(4, 9)
+MEDIA_GROUP_MAX_SIZE = MediaGroupLimit.MAX_MEDIA_LENGTH
 
 
 logger = logging.getLogger(__name__)
@@ -58,27 +62,100 @@ async def emby_list_resource(update: Update, context: ContextTypes.DEFAULT_TYPE,
 
     emby = Emby(host=emby_config.host, token=api_token)
     data = await emby.list_resource(resource_name)
-    if data['Items']:
-        for item in data['Items']:
-            admin_user_id = await emby.get_admin_user_id()
-            meta_data = await emby.get_metadata_by_user_id_item_id(admin_user_id, int(item['Id']))
-            caption = f"<b>{meta_data['Name']} ({meta_data['ProductionYear']})</b>"
-
-            caption += "\n\n[相关链接]"
-            for external_url in meta_data['ExternalUrls']:
-                caption += f'\n<a href="{external_url.get('Url')}">{external_url.get('Name')}地址</a>'
-            await update.effective_message.reply_photo(
-                photo=await emby.get_remote_image_url_by_item_id(int(item['Id'])),
-                caption=caption,
-                reply_markup=InlineKeyboardMarkup([
-                    [
-                        InlineKeyboardButton('刷新此媒体库', callback_data=f'emby_refresh_library:{int(item['Id'])}'),
-                    ]
-                ]),
-                parse_mode=ParseMode.HTML,
-            )
-    else:
+    if not data or not data['Items']:
         await update.message.reply_text(f"没搜索到关于<b>{resource_name}</b>的资源")
+        return
+
+    item_ids = [int(item['Id']) for item in data['Items']]
+    admin_user_id = await emby.get_admin_user_id()
+    # 元数据一次批量查询，海报并发查询
+    metadata, image_urls = await asyncio.gather(
+        emby.get_items_metadata(admin_user_id, item_ids),
+        emby.get_remote_image_urls(item_ids),
+    )
+    resources = list()
+    for item_id in item_ids:
+        meta_data = metadata.get(item_id)
+        if meta_data is None:
+            continue
+        caption = f"<b>{meta_data['Name']} ({meta_data.get('ProductionYear')})</b>"
+
+        caption += "\n\n[相关链接]"
+        for external_url in meta_data.get('ExternalUrls') or []:
+            caption += f'\n<a href="{external_url.get('Url')}">{external_url.get('Name')}地址</a>'
+        resources.append((item_id, meta_data['Name'], caption, image_urls.get(item_id)))
+    await send_emby_resources(update, resources)
+
+
+def emby_refresh_library_button(item_id: int, label: str = '刷新此媒体库') -> InlineKeyboardButton:
+    return InlineKeyboardButton(label, callback_data=f'emby_refresh_library:{item_id}')
+
+
+async def send_emby_resources(update: Update, resources: list):
+    """
+    发送 (item_id, 名称, caption, 海报) 列表
+
+    有海报的资源按相册（每组最多 MEDIA_GROUP_MAX_SIZE 张）发送，相册不支持按钮，
+    刷新按钮在最后统一发送；只有一张海报或没有海报的资源单独发送并直接附带按钮
+    """
+    chat_id = update.effective_chat.id
+    with_photo = [resource for resource in resources if resource[3]]
+    without_photo = [resource for resource in resources if not resource[3]]
+    grouped = list()
+    albums = list()
+    futures = list()
+    if len(with_photo) == 1:
+        without_photo = with_photo + without_photo
+        with_photo = []
+    for start in range(0, len(with_photo), MEDIA_GROUP_MAX_SIZE):
+        chunk = with_photo[start:start + MEDIA_GROUP_MAX_SIZE]
+        if len(chunk) == 1:
+            without_photo.append(chunk[0])
+            continue
+        albums.append((chunk, send_queue.submit(
+            chat_id,
+            method='send_media_group',
+            priority=PRIORITY_BULK,
+            media=[
+                InputMediaPhoto(media=photo, caption=caption, parse_mode=ParseMode.HTML)
+                for _, _, caption, photo in chunk
+            ],
+        )))
+        grouped.extend(chunk)
+    for item_id, _, caption, photo in without_photo:
+        keyword_args = dict(
+            reply_markup=InlineKeyboardMarkup([[emby_refresh_library_button(item_id)]]),
+            parse_mode=ParseMode.HTML,
+        )
+        if photo:
+            futures.append(send_queue.submit(chat_id, method='send_photo', priority=PRIORITY_BULK, photo=photo,
+                                             caption=caption, **keyword_args))
+        else:
+            futures.append(send_queue.submit(chat_id, priority=PRIORITY_BULK, text=caption, **keyword_args))
+    for chunk, album in albums:
+        try:
+            await album
+        except Exception as e:
+            # 任意一张图片无效都会导致整个相册发送失败，改为逐张发送
+            logger.warning(f"发送 Emby 资源相册失败，改为逐张发送: {e}")
+            futures.extend(
+                send_queue.submit(chat_id, method='send_photo', priority=PRIORITY_BULK, photo=photo,
+                                  caption=caption, parse_mode=ParseMode.HTML)
+                for _, _, caption, photo in chunk
+            )
+    for result in await asyncio.gather(*futures, return_exceptions=True):
+        if isinstance(result, Exception):
+            logger.error(f"发送 Emby 资源失败: {result}")
+
+    if grouped:
+        await send_queue.send(
+            chat_id,
+            priority=PRIORITY_BULK,
+            text="可刷新以下媒体库：",
+            reply_markup=InlineKeyboardMarkup([
+                [emby_refresh_library_button(item_id, f'刷新 {name}')] for item_id, name, _, _ in grouped
+            ]),
+        )
 
 @command(name='emby_list_notification', description="列出 emby 通知列表")
 async def emby_list_notification(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, user: User):
@@ -95,11 +172,14 @@ async def emby_list_notification(update: Update, context: ContextTypes.DEFAULT_T
         return
 
     emby = Emby(host=emby_config.host, token=api_token)
-    access_token = await emby.get_access_token(username, password)
-    data = await emby.list_notification(access_token)
+    # 主动查看时读取最新配置，同时刷新切换通知使用的快照
+    data = await emby.list_notifications(username, password, use_cache=False)
     if data:
+        futures = list()
         for item in data:
-            await update.effective_message.reply_text(
+            futures.append(send_queue.submit(
+                update.effective_chat.id,
+                priority=PRIORITY_BULK,
                 text=item['FriendlyName'],
                 reply_markup=InlineKeyboardMarkup([
                     [
@@ -108,7 +188,8 @@ async def emby_list_notification(update: Update, context: ContextTypes.DEFAULT_T
                     ]
                 ]),
                 parse_mode=ParseMode.HTML,
-            )
+            ))
+        await asyncio.gather(*futures)
     else:
         await update.message.reply_text(f"没有配置通知")
 
@@ -159,8 +240,7 @@ async def emby_notification_set(update: Update, context: ContextTypes.DEFAULT_TY
         return
 
     emby = Emby(host=emby_config.host, token=api_token)
-    access_token = await emby.get_access_token(username, password)
-    resp = await emby.update_notification(access_token, notification_id, event_id, operation)
+    resp = await emby.update_notification(username, password, notification_id, event_id, operation)
     if resp:
         await update.effective_message.reply_text("更新通知配置成功")
     else:
@@ -432,16 +512,20 @@ async def upsert_emby_configuration_finish(update: Update, context: ContextTypes
     ).first()
 
     if existing_config:
+        # 旧配置对应的登录状态与缓存不再可用
+        forget_emby_session(existing_config.host, existing_config.username)
         # 部分更新：只更新提供的字段
         update_data = {}
         if host != existing_config.host:
             update_data[EmbyConfig.host] = host
         if encrypted_api_token != existing_config.api_token:
             update_data[EmbyConfig.api_token] = encrypted_api_token
+            forget_decrypted(existing_config.api_token)
         if username != existing_config.username:
             update_data[EmbyConfig.username] = username
         if encrypted_password != existing_config.password:
             update_data[EmbyConfig.password] = encrypted_password
+            forget_decrypted(existing_config.password)
 
         if update_data:
             session.query(EmbyConfig).filter(EmbyConfig.user_id == user.id).update(update_data)
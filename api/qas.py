@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 import html
 import json
@@ -5,7 +6,6 @@ import logging
 import os.path
 import re
 
-import aiohttp
 from sqlalchemy.orm import Session
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
@@ -20,10 +20,12 @@ from db.models.qas import QuarkAutoDownloadConfig
 from db.models.user import User
 from utils.command_middleware import depends
 from utils.common import get_random_letter_number_id
-from utils.qas import QuarkAutoDownload
-from utils.quark import Quark
-from utils.the_movie_db import TheMovieDB
-from utils.crypto import encrypt_sensitive_data, decrypt_sensitive_data
+from utils.qas import QuarkAutoDownload, TaskListPatch, TaskListConflictError, get_task_key, ROOT_TRUNCATED_NOTICE
+from utils.http_pool import http_session_pool
+from utils.quark import Quark, SHARE_DETAIL_URL
+from utils.the_movie_db import tmdb_service, MEDIA_TV, MEDIA_MOVIE
+from utils.crypto import encrypt_sensitive_data, decrypt_sensitive_data, forget_decrypted
+from utils.telegram_sender import send_queue, PRIORITY_BULK
 import pytz
 
 logger = logging.getLogger(__name__)
@@ -408,6 +410,7 @@ async def upsert_qas_configuration_finish(update: Update, context: ContextTypes.
             update_data[QuarkAutoDownloadConfig.host] = host
         if encrypted_api_token != existing_config.api_token:
             update_data[QuarkAutoDownloadConfig.api_token] = encrypted_api_token
+            forget_decrypted(existing_config.api_token)
         if save_path_prefix != existing_config.save_path_prefix:
             update_data[QuarkAutoDownloadConfig.save_path_prefix] = save_path_prefix
         if movie_save_path_prefix != existing_config.movie_save_path_prefix:
@@ -512,8 +515,10 @@ async def qas_add_task(update: Update, context: ContextTypes.DEFAULT_TYPE, sessi
     await update.message.reply_text(text='解析分享链接中，请稍后')
 
     qas = QuarkAutoDownload(api_token=api_token)
-    fid_files = await qas.get_fid_files(quark_share_url, True)
-    tree_paragraphs = await qas.get_tree_paragraphs(fid_files)
+    fid_files, truncated = await qas.get_fid_files(quark_share_url, True)
+    tree_paragraphs = await qas.get_tree_paragraphs(fid_files, truncated)
+    if 'root__0' in truncated:
+        await update.message.reply_text(ROOT_TRUNCATED_NOTICE)
 
     # AI 分析推荐包含最新集的文件夹
     recommended_fid = None
@@ -525,6 +530,8 @@ async def qas_add_task(update: Update, context: ContextTypes.DEFAULT_TYPE, sessi
     except Exception as e:
         logger.warning(f"AI 推荐文件夹失败，不影响正常流程: {e}")
 
+    # 每个目录一条消息，走批量车道排队发送
+    futures = list()
     for _ in tree_paragraphs:
         file_name = _.split('\n')[0].split('__')[0]
         fid = _.split('\n')[0].split('__')[1]
@@ -538,7 +545,9 @@ async def qas_add_task(update: Update, context: ContextTypes.DEFAULT_TYPE, sessi
         if is_recommended and recommend_reason:
             text += f"\n\n⭐ <b>AI 推荐</b>：{recommend_reason}"
 
-        await update.message.reply_text(
+        futures.append(send_queue.submit(
+            update.effective_chat.id,
+            priority=PRIORITY_BULK,
             text=text,
             reply_markup=InlineKeyboardMarkup([
                 [
@@ -546,7 +555,8 @@ async def qas_add_task(update: Update, context: ContextTypes.DEFAULT_TYPE, sessi
                 ]
             ]),
             parse_mode="html"
-        )
+        ))
+    await asyncio.gather(*futures)
 
 
 async def qas_add_task_select_resource_type(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, user: User):
@@ -574,21 +584,23 @@ async def qas_add_task_select_tv(update: Update, context: ContextTypes.DEFAULT_T
     task_name = context.user_data['qas_add_task']['taskname']
     url_id = query.data.split(":")[1]
     context.user_data['qas_add_task']['shareurl'] = context.user_data['qas_add_task']['shareurl'][url_id]
-    tv_list = await TheMovieDB().search_tv(task_name, count=5)
+    # 搜索结果已包含剧名、首播日期和海报，不需要再获取详情
+    search = await tmdb_service.search(MEDIA_TV, task_name)
+    tv_list = search.get('results', [])[:5]
     if not tv_list:
         await update.effective_message.reply_text("tmdb 查询不到相关信息，请重新运行添加任务指令并输入不同剧名")
         return
     for tv in tv_list:
         tv_info_tmp_id = get_random_letter_number_id()
         tv_name = tv.get('name')
-        tv_year = f"({tv.get('first_air_date').split('-')[0]})"
+        tv_year = f"({(tv.get('first_air_date') or '').split('-')[0]})"
         context.user_data['qas_add_task'][tv_info_tmp_id] = {
             "resource_name": tv_name,
             "resource_year": tv_year,
             "resource_type": "tv"
         }
         await query.message.reply_photo(
-            photo=tv.get('photo_url'),
+            photo=tmdb_service.poster_url(tv),
             reply_markup=InlineKeyboardMarkup([
                 [
                     InlineKeyboardButton(f"选择 {tv_name} {tv_year}", callback_data=f"qas_add_task_pattern_input:{tv_info_tmp_id}")
@@ -606,21 +618,22 @@ async def qas_add_task_select_movie(update: Update, context: ContextTypes.DEFAUL
     task_name = context.user_data['qas_add_task']['taskname']
     url_id = query.data.split(":")[1]
     context.user_data['qas_add_task']['shareurl'] = context.user_data['qas_add_task']['shareurl'][url_id]
-    movie_list = await TheMovieDB().search_movie(task_name, count=5)
+    search = await tmdb_service.search(MEDIA_MOVIE, task_name)
+    movie_list = search.get('results', [])[:5]
     if not movie_list:
         await update.effective_message.reply_text("tmdb 查询不到相关信息，请重新运行添加任务指令并输入不同剧名")
         return
     for movie in movie_list:
         movie_info_tmp_id = get_random_letter_number_id()
-        movie_name = movie.get('name')
-        movie_year = f"({movie.get('first_air_date').split('-')[0]})"
+        movie_name = movie.get('title')
+        movie_year = f"({(movie.get('release_date') or '').split('-')[0]})"
         context.user_data['qas_add_task'][movie_info_tmp_id] = {
             "resource_name": movie_name,
             "resource_year": movie_year,
             "resource_type": "movie"
         }
         await query.message.reply_photo(
-            photo=movie.get('photo_url'),
+            photo=tmdb_service.poster_url(movie),
             reply_markup=InlineKeyboardMarkup([
                 [
                     InlineKeyboardButton(f"选择 {movie_name} {movie_year}", callback_data=f"qas_add_task_pattern_input:{movie_info_tmp_id}")
@@ -739,11 +752,11 @@ async def qas_add_task_ai_ask_pattern_replace_button(update: Update, context: Co
         return
     qas = QuarkAutoDownload(api_token=api_token)
     quark_id, stoken, pdir_fid = await qas.get_quark_id_stoken_pdir_fid(url=context.user_data['qas_add_task']['shareurl'])
-    dir_details = await qas.get_quark_dir_detail(quark_id, stoken, pdir_fid, include_dir=False)
+    dir_details = await qas.get_quark_dir_detail(quark_id, stoken, pdir_fid, include_dir=False, limit=15)
 
     files_text = '\n'.join([
         f"🎥 {dir_detail['file_name']}"
-        for dir_detail in dir_details[:15]
+        for dir_detail in dir_details
     ])
 
     await update.effective_message.reply_text(
@@ -993,16 +1006,26 @@ async def qas_add_task_finish(update: Update, context: ContextTypes.DEFAULT_TYPE
         if data:
             save_path = data.get('data').get('savepath')
             # 修改 aria2 和 ignore_extension
-            data = await qas_instance.data(host=qas_config_instance.host)
-            for index, task in enumerate(data.get("tasklist", [])):
+            data = await qas_instance.data(host=qas_config_instance.host, use_cache=False)
+            for index, task in enumerate((data or {}).get("tasklist", [])):
                 if task.get("savepath") == save_path:
-                    data["tasklist"][index]['ignore_extension'] = ignore_extension
-                    if aria2 is False:
-                        data["tasklist"][index]["addition"]["aria2"]["auto_download"] = False
-                    else:
-                        data["tasklist"][index]["addition"]["aria2"]["auto_download"] = True
                     break
-            await qas_instance.update(host=qas_config_instance.host, data=data)
+            else:
+                # 找不到时不能改动其他任务
+                await update.effective_message.reply_text(
+                    text=f"任务{task_name}已添加，但未在任务列表中找到，Aria2 自动下载和忽略后缀名未设置"
+                )
+                return
+            task_key = get_task_key(data["tasklist"][index])
+            patch = TaskListPatch().update(task_key, {
+                'ignore_extension': ignore_extension,
+                'addition': {'aria2': {'auto_download': aria2 is not False}},
+            })
+            try:
+                data = await qas_instance.patch_tasklist(host=qas_config_instance.host, patch=patch) or data
+                index = patch.indexes.get(task_key, index)
+            except TaskListConflictError as e:
+                logger.warning(f"设置新增 QAS 任务扩展选项冲突: {e}")
             message = f"""
 新增任务成功：
 📌 <b>任务名称</b>：{data['tasklist'][index]['taskname']}
@@ -1141,6 +1164,8 @@ async def qas_list_task(update: Update, context: ContextTypes.DEFAULT_TYPE, sess
         )
 
     else:
+        # 每个任务一条消息，走批量车道排队发送
+        futures = list()
         for index, task in enumerate(data.get("tasklist", [])):
             if task not in task_list:
                 continue
@@ -1158,7 +1183,9 @@ async def qas_list_task(update: Update, context: ContextTypes.DEFAULT_TYPE, sess
                 task_text += f"🚫：{task.get('shareurl_ban')}"
             else:
                 task_text += f"✅：正常"
-            await update.effective_message.reply_text(
+            futures.append(send_queue.submit(
+                update.effective_chat.id,
+                priority=PRIORITY_BULK,
                 text=task_text,
                 reply_markup=InlineKeyboardMarkup([
                     [
@@ -1184,7 +1211,8 @@ async def qas_list_task(update: Update, context: ContextTypes.DEFAULT_TYPE, sess
                     ]
                 ]),
                 parse_mode=ParseMode.HTML,
-            )
+            ))
+        await asyncio.gather(*futures)
 
 
 @command(name='qas_list_err_task', description="列出 QAS 异常任务", args="{任务名称}")
@@ -1219,6 +1247,8 @@ async def qas_list_err_task(update: Update, context: ContextTypes.DEFAULT_TYPE,
         )
 
     else:
+        # 每个任务一条消息，走批量车道排队发送
+        futures = list()
         for index, task in enumerate(data.get("tasklist", [])):
             if task not in task_list:
                 continue
@@ -1236,7 +1266,9 @@ async def qas_list_err_task(update: Update, context: ContextTypes.DEFAULT_TYPE,
                 task_text += f"🚫：{task.get('shareurl_ban')}"
             else:
                 task_text += f"✅：正常"
-            await update.effective_message.reply_text(
+            futures.append(send_queue.submit(
+                update.effective_chat.id,
+                priority=PRIORITY_BULK,
                 text=task_text,
                 reply_markup=InlineKeyboardMarkup([
                     [
@@ -1262,7 +1294,8 @@ async def qas_list_err_task(update: Update, context: ContextTypes.DEFAULT_TYPE,
                     ]
                 ]),
                 parse_mode=ParseMode.HTML,
-            )
+            ))
+        await asyncio.gather(*futures)
 
 
 # @command(name='qas_update_task', description="更新 QAS 任务", args="{qas task id}")
@@ -1284,13 +1317,14 @@ async def qas_update_task(update: Update, context: ContextTypes.DEFAULT_TYPE, se
         return
 
     qas = QuarkAutoDownload(api_token=api_token)
-    data = await qas.data(host=qas_config.host)
+    # 编辑从最新的任务开始，提交时以此检测冲突
+    data = await qas.data(host=qas_config.host, use_cache=False)
     task_info = data.get("tasklist", [])[task_id]
 
     # 保存原始任务信息
     context.user_data.update({
         'qas_update_task_original': task_info.copy(),
-        'qas_update_task': {'id': task_id},
+        'qas_update_task': {'id': task_id, 'key': get_task_key(task_info)},
         'qas_update_task_edit_data': {}
     })
 
@@ -1466,12 +1500,14 @@ async def qas_task_update_share_url_set(update: Update, context: ContextTypes.DE
         return
 
     qas = QuarkAutoDownload(api_token=api_token)
-    fid_files = await qas.get_fid_files(quark_share_url)
+    fid_files, truncated = await qas.get_fid_files(quark_share_url)
     if not fid_files:
         await update.message.reply_text("链接状态异常，请重新输入")
         return
 
-    tree_paragraphs = await qas.get_tree_paragraphs(fid_files)
+    tree_paragraphs = await qas.get_tree_paragraphs(fid_files, truncated)
+    if 'root__0' in truncated:
+        await update.message.reply_text(ROOT_TRUNCATED_NOTICE)
 
     # AI 分析推荐包含最新集的文件夹
     recommended_fid = None
@@ -1483,6 +1519,8 @@ async def qas_task_update_share_url_set(update: Update, context: ContextTypes.DE
     except Exception as e:
         logger.warning(f"AI 推荐文件夹失败，不影响正常流程: {e}")
 
+    # 每个目录一条消息，走批量车道排队发送
+    futures = list()
     for _ in tree_paragraphs:
         file_name = _.split('\n')[0].split('__')[0]
         fid = _.split('\n')[0].split('__')[1]
@@ -1496,13 +1534,16 @@ async def qas_task_update_share_url_set(update: Update, context: ContextTypes.DE
         if is_recommended and recommend_reason:
             text += f"\n\n⭐ <b>AI 推荐</b>：{recommend_reason}"
 
-        await update.message.reply_text(
+        futures.append(send_queue.submit(
+            update.effective_chat.id,
+            priority=PRIORITY_BULK,
             text=text,
             reply_markup=InlineKeyboardMarkup([[
                 InlineKeyboardButton(recommend_label, callback_data=f"qas_task_update_share_url_select:{tmp_url_id}")
             ]]),
             parse_mode="html"
-        )
+        ))
+    await asyncio.gather(*futures)
     return QAS_TASK_UPDATE_SHARE_URL
 
 
@@ -1544,11 +1585,11 @@ async def qas_task_update_ai_generate_pattern(update: Update, context: ContextTy
 
     qas = QuarkAutoDownload(api_token=api_token)
     quark_id, stoken, pdir_fid = await qas.get_quark_id_stoken_pdir_fid(url=share_url)
-    dir_details = await qas.get_quark_dir_detail(quark_id, stoken, pdir_fid, include_dir=False)
+    dir_details = await qas.get_quark_dir_detail(quark_id, stoken, pdir_fid, include_dir=False, limit=15)
 
     files_text = '\n'.join([
         f"🎥 {dir_detail['file_name']}"
-        for dir_detail in dir_details[:15]
+        for dir_detail in dir_details
     ])
 
     await update.effective_message.reply_text(
@@ -1696,11 +1737,11 @@ async def qas_task_update_ai_generate_replace(update: Update, context: ContextTy
 
     qas = QuarkAutoDownload(api_token=api_token)
     quark_id, stoken, pdir_fid = await qas.get_quark_id_stoken_pdir_fid(url=share_url)
-    dir_details = await qas.get_quark_dir_detail(quark_id, stoken, pdir_fid, include_dir=False)
+    dir_details = await qas.get_quark_dir_detail(quark_id, stoken, pdir_fid, include_dir=False, limit=15)
 
     files_text = '\n'.join([
         f"🎥 {dir_detail['file_name']}"
-        for dir_detail in dir_details[:15]
+        for dir_detail in dir_details
     ])
 
     # 构建AI提示，告诉AI根据文件列表和当前Pattern生成合适的Replace
@@ -1916,26 +1957,15 @@ async def qas_task_update_finish(update: Update, context: ContextTypes.DEFAULT_T
         await update.effective_message.reply_text("没有进行任何修改")
         return ConversationHandler.END
 
-    # 构建更新数据
-    update_data = original_task.copy()
-
-    # 只更新用户修改过的字段
-    if "shareurl" in edit_data:
-        update_data["shareurl"] = edit_data["shareurl"]
-    if "savepath" in edit_data:
-        update_data["savepath"] = edit_data["savepath"]
-    if "pattern" in edit_data:
-        update_data["pattern"] = edit_data["pattern"]
-    if "replace" in edit_data:
-        update_data["replace"] = edit_data["replace"]
+    # 构建更新数据：只提交用户修改过的字段
+    update_fields = {
+        field: edit_data[field]
+        for field in ("shareurl", "savepath", "pattern", "replace", "ignore_extension")
+        if field in edit_data
+    }
     if "aria2_auto_download" in edit_data:
-        if "addition" not in update_data:
-            update_data["addition"] = {}
-        if "aria2" not in update_data["addition"]:
-            update_data["addition"]["aria2"] = {}
-        update_data["addition"]["aria2"]["auto_download"] = edit_data["aria2_auto_download"]
-    if "ignore_extension" in edit_data:
-        update_data["ignore_extension"] = edit_data["ignore_extension"]
+        update_fields["addition"] = {"aria2": {"auto_download": bool(edit_data["aria2_auto_download"])}}
+    update_fields['startfid'] = ''
 
     # 调用API更新任务
     qas_config = session.query(QuarkAutoDownloadConfig).filter(
@@ -1948,31 +1978,28 @@ async def qas_task_update_finish(update: Update, context: ContextTypes.DEFAULT_T
 
     qas = QuarkAutoDownload(api_token=api_token)
 
-    data = await qas.data(host=qas_config.host)
-
-    for index, task in enumerate(data.get("tasklist", [])):
-        if index == int(task_id):
-            for k, v in update_data.items():
-                data['tasklist'][index][k] = v
-            if 'id' in data['tasklist'][index]:
-                data['tasklist'][index].pop('id')
-            if 'ai_params' in data['tasklist'][index]:
-                data['tasklist'][index].pop('ai_params')
-            if 'shareurl_ban' in data['tasklist'][index]:
-                data['tasklist'][index].pop('shareurl_ban')
-
-            data['tasklist'][index]["addition"]["aria2"]["auto_download"] = update_data["addition"]["aria2"]["auto_download"] if update_data["addition"]["aria2"]["auto_download"] else False
-
-            data['tasklist'][index]['startfid'] = ''
-            if "ignore_extension" in edit_data:
-                data["tasklist"][index]['ignore_extension'] = edit_data["ignore_extension"]
-            break
-    success = await qas.update(host=qas_config.host, data=data)
+    task_key = context.user_data['qas_update_task'].get('key') or get_task_key(original_task)
+    patch = TaskListPatch().update(
+        task_key,
+        update_fields,
+        drop=('id', 'ai_params', 'shareurl_ban'),
+        expected_task=original_task
+    )
+    try:
+        updated_data = await qas.patch_tasklist(host=qas_config.host, patch=patch)
+    except TaskListConflictError as e:
+        logger.warning(f"更新 QAS 任务冲突: {e}")
+        updated_data = None
+        await update.effective_message.reply_text("⚠️ 任务在编辑期间已被修改或删除，请重新获取任务后再更新")
+        context.user_data.pop("qas_update_task_original", None)
+        context.user_data.pop("qas_update_task", None)
+        context.user_data.pop("qas_update_task_edit_data", None)
+        return ConversationHandler.END
 
-    if success:
+    if updated_data:
         # 获取更新后的任务数据
-        updated_data = await qas.data(host=qas_config.host)
-        updated_task = updated_data['tasklist'][int(task_id)]
+        task_id = patch.indexes[task_key]
+        updated_task = updated_data['tasklist'][task_id]
 
         message = f"""
 更新任务成功：
@@ -2097,7 +2124,7 @@ async def qas_fix_link_url_input(update: Update, context: ContextTypes.DEFAULT_T
         return ConversationHandler.END
 
     qas = QuarkAutoDownload(api_token=api_token)
-    fid_files = await qas.get_fid_files(quark_share_url)
+    fid_files, truncated = await qas.get_fid_files(quark_share_url)
     if not fid_files:
         await update.message.reply_text(
             "链接状态异常，请重新输入：",
@@ -2107,7 +2134,9 @@ async def qas_fix_link_url_input(update: Update, context: ContextTypes.DEFAULT_T
         )
         return QAS_FIX_LINK_INPUT_URL
 
-    tree_paragraphs = await qas.get_tree_paragraphs(fid_files)
+    tree_paragraphs = await qas.get_tree_paragraphs(fid_files, truncated)
+    if 'root__0' in truncated:
+        await update.message.reply_text(ROOT_TRUNCATED_NOTICE)
     if tree_paragraphs:
         # AI 分析推荐包含最新集的文件夹
         recommended_fid = None
@@ -2119,6 +2148,8 @@ async def qas_fix_link_url_input(update: Update, context: ContextTypes.DEFAULT_T
         except Exception as e:
             logger.warning(f"AI 推荐文件夹失败，不影响正常流程: {e}")
 
+        # 每个目录一条消息，走批量车道排队发送
+        futures = list()
         for _ in tree_paragraphs:
             file_name = _.split('\n')[0].split('__')[0]
             fid = _.split('\n')[0].split('__')[1]
@@ -2133,13 +2164,16 @@ async def qas_fix_link_url_input(update: Update, context: ContextTypes.DEFAULT_T
             if is_recommended and recommend_reason:
                 text += f"\n\n⭐ <b>AI 推荐</b>：{recommend_reason}"
 
-            await update.message.reply_text(
+            futures.append(send_queue.submit(
+                update.effective_chat.id,
+                priority=PRIORITY_BULK,
                 text=text,
                 reply_markup=InlineKeyboardMarkup([[
                     InlineKeyboardButton(recommend_label, callback_data=f"qas_fix_link_select:{tmp_url_id}")
                 ]]),
                 parse_mode="html"
-            )
+            ))
+        await asyncio.gather(*futures)
         return QAS_FIX_LINK_SELECT_URL
 
     # 无子目录，直接用当前链接进行 AI 生成
@@ -2260,21 +2294,26 @@ async def qas_fix_link_confirm(update: Update, context: ContextTypes.DEFAULT_TYP
     qas = QuarkAutoDownload(api_token=api_token)
     data = await qas.data(host=qas_config.host)
 
-    # 更新任务
-    task = data['tasklist'][task_id]
-    task['shareurl'] = new_shareurl
-    task['pattern'] = ai_params.get('pattern', '')
-    task['replace'] = ai_params.get('replace', '')
-    task['startfid'] = ''
-
-    # 清除临时字段
-    for key in ['id', 'ai_params', 'shareurl_ban']:
-        task.pop(key, None)
-
-    success = await qas.update(host=qas_config.host, data=data)
+    # 更新任务，同时清除临时字段
+    task_key = get_task_key(data['tasklist'][task_id])
+    patch = TaskListPatch().update(
+        task_key,
+        {
+            'shareurl': new_shareurl,
+            'pattern': ai_params.get('pattern', ''),
+            'replace': ai_params.get('replace', ''),
+            'startfid': '',
+        },
+        drop=('id', 'ai_params', 'shareurl_ban')
+    )
+    try:
+        updated_data = await qas.patch_tasklist(host=qas_config.host, patch=patch)
+    except TaskListConflictError as e:
+        logger.warning(f"修复 QAS 任务链接冲突: {e}")
+        updated_data = None
 
-    if success:
-        updated_data = await qas.data(host=qas_config.host)
+    if updated_data:
+        task_id = patch.indexes[task_key]
         updated_task = updated_data['tasklist'][task_id]
 
         message = (
@@ -2331,6 +2370,7 @@ async def qas_delete_task(update: Update, context: ContextTypes.DEFAULT_TYPE, se
     for index, task in enumerate(data.get("tasklist", [])):
         if index == int(qas_task_id):
             break
+    context.user_data['qas_delete_task_key'] = get_task_key(data['tasklist'][index])
     await update.effective_message.reply_text(
         text=f"确定删除任务 {data['tasklist'][index]['taskname']} 吗?",
         reply_markup=InlineKeyboardMarkup([
@@ -2362,14 +2402,30 @@ async def qas_delete_task_confirm_handler(update: Update, context: ContextTypes.
         await update.effective_message.reply_text("无法解密QAS API令牌，请重新配置")
         return
     qas = QuarkAutoDownload(api_token=api_token)
-    data = await qas.data(host=qas_config.host)
-    task_name = data['tasklist'][qas_deleted_task_id]['taskname']
-    data['tasklist'].pop(int(qas_deleted_task_id))
-    await qas.update(host=qas_config.host, data=data)
-    await update.effective_message.reply_text(
-        text=f"删除 QAS 任务 {task_name} 成功",
-    )
+    task_key = context.user_data.get('qas_delete_task_key')
+    if not task_key:
+        data = await qas.data(host=qas_config.host)
+        task_key = get_task_key(data['tasklist'][qas_deleted_task_id])
+    patch = TaskListPatch().delete(task_key)
+    try:
+        success = await qas.patch_tasklist(host=qas_config.host, patch=patch)
+    except TaskListConflictError as e:
+        logger.warning(f"删除 QAS 任务冲突: {e}")
+        success = None
+        await update.effective_message.reply_text(
+            text="⚠️ 任务已不存在，可能已被删除或修改",
+        )
+    else:
+        if success:
+            await update.effective_message.reply_text(
+                text=f"删除 QAS 任务 {patch.deleted[0]['taskname']} 成功",
+            )
+        else:
+            await update.effective_message.reply_text(
+                text="删除 QAS 任务失败，请检查配置",
+            )
     context.user_data['qas_delete_task_id'] = -1
+    context.user_data.pop('qas_delete_task_key', None)
     await query.edit_message_reply_markup(reply_markup=None)
 
 
@@ -2377,6 +2433,7 @@ async def qas_delete_task_cancel_handler(update: Update, context: ContextTypes.D
     query = update.callback_query
     await query.answer()
     context.user_data['qas_delete_task_id'] = -1
+    context.user_data.pop('qas_delete_task_key', None)
     await update.effective_message.reply_text(
         text=f"取消删除 QAS 任务",
     )
@@ -2441,10 +2498,12 @@ async def qas_run_script(update: Update, context: ContextTypes.DEFAULT_TYPE, ses
                 )
             # 清理完成后删除对应的 QAS 电影任务
             try:
-                qas_task_index = int(context.args[0]) if len(context.args) >= 1 else 0
-                qas_task_name = data['tasklist'][qas_task_index]['taskname']
-                data['tasklist'].pop(qas_task_index)
-                success = await qas.update(host=qas_config.host, data=data)
+                qas_task_name = task['taskname']
+                # 运行期间任务列表可能已变化，按任务键在最新配置上删除
+                success = await qas.patch_tasklist(
+                    host=qas_config.host,
+                    patch=TaskListPatch().delete(get_task_key(task))
+                )
                 if success:
                     await update.effective_message.reply_text(
                         text=f"已删除 QAS 电影任务 {qas_task_name}",
@@ -2490,42 +2549,47 @@ async def qas_tag_start_file(update: Update, context: ContextTypes.DEFAULT_TYPE,
         task_list = data["tasklist"]
     else:
         task_list = [data["tasklist"][int(context.args[0])]]
-    async with aiohttp.ClientSession() as http_session:
-        quark_cookies = await get_user_quark_cookies(user)
-        quark = Quark(cookies=quark_cookies)
-        for index, task in enumerate(task_list):
-            share_url = task.get('shareurl')
-            quark_id, stoken, pdir_fid, _ = await quark.get_quark_id_stoken_pdir_fid(url=share_url, session=http_session)
-            dir_details = await quark.get_quark_dir_detail(quark_id, stoken, pdir_fid, include_dir=False, size=1)
-            latest_timestamp = None
-            if isinstance(dir_details, list) and len(dir_details) > 0:
-                latest_fid = dir_details[0]['fid']
-                if len(context.args) < 1:
-                    data['tasklist'][index]['startfid'] = latest_fid
-                    latest_timestamp = int(dir_details[0]['l_updated_at'])
-                    latest_datetime = datetime.datetime.fromtimestamp(latest_timestamp / 1000, tz=datetime.UTC).astimezone(pytz.timezone(TIME_ZONE))
-                    await update.effective_message.reply_text(
-                        text=f"即将标记任务 <b>{data['tasklist'][index]['taskname']}</b> 的开始转存文件为 <b>{dir_details[0]['file_name']}</b> ({latest_datetime.strftime('%Y年%m月%d日 %H:%M:%S')})",
-                        parse_mode='html'
-                    )
-                else:
-                    data['tasklist'][int(context.args[0])]['startfid'] = latest_fid
-                    latest_timestamp = int(dir_details[0]['l_updated_at'])
-                    latest_datetime = datetime.datetime.fromtimestamp(latest_timestamp / 1000, tz=datetime.UTC).astimezone(pytz.timezone(TIME_ZONE))
-                    await update.effective_message.reply_text(
-                        text=f"即将标记任务 <b>{data['tasklist'][int(context.args[0])]['taskname']}</b> 的开始转存文件为 <b>{dir_details[0]['file_name']}</b> ({latest_datetime.strftime('%Y年%m月%d日 %H:%M:%S')})",
-                        parse_mode='html'
-                    )
+    patch = TaskListPatch()
+    http_session = http_session_pool.get(SHARE_DETAIL_URL)
+    quark_cookies = await get_user_quark_cookies(user)
+    quark = Quark(cookies=quark_cookies)
+    for index, task in enumerate(task_list):
+        share_url = task.get('shareurl')
+        quark_id, stoken, pdir_fid, _ = await quark.get_quark_id_stoken_pdir_fid(url=share_url, session=http_session)
+        dir_details = await quark.get_quark_dir_detail(quark_id, stoken, pdir_fid, include_dir=False, limit=1)
+        latest_timestamp = None
+        if isinstance(dir_details, list) and len(dir_details) > 0:
+            latest_fid = dir_details[0]['fid']
+            patch.update(get_task_key(task), {'startfid': latest_fid})
+            if len(context.args) < 1:
+                latest_timestamp = int(dir_details[0]['l_updated_at'])
+                latest_datetime = datetime.datetime.fromtimestamp(latest_timestamp / 1000, tz=datetime.UTC).astimezone(pytz.timezone(TIME_ZONE))
+                await update.effective_message.reply_text(
+                    text=f"即将标记任务 <b>{data['tasklist'][index]['taskname']}</b> 的开始转存文件为 <b>{dir_details[0]['file_name']}</b> ({latest_datetime.strftime('%Y年%m月%d日 %H:%M:%S')})",
+                    parse_mode='html'
+                )
+            else:
+                latest_timestamp = int(dir_details[0]['l_updated_at'])
+                latest_datetime = datetime.datetime.fromtimestamp(latest_timestamp / 1000, tz=datetime.UTC).astimezone(pytz.timezone(TIME_ZONE))
+                await update.effective_message.reply_text(
+                    text=f"即将标记任务 <b>{data['tasklist'][int(context.args[0])]['taskname']}</b> 的开始转存文件为 <b>{dir_details[0]['file_name']}</b> ({latest_datetime.strftime('%Y年%m月%d日 %H:%M:%S')})",
+                    parse_mode='html'
+                )
 
-        success = await qas.update(host=qas_config.host, data=data)
-        if success:
-            await update.effective_message.reply_text(
-                text="标记完成 ✅"
-            )
-        else:
-            await update.effective_message.reply_text(
-                text="标记失败 ❌"
-            )
+    # 遍历分享目录耗时较长，按任务键在最新配置上写回，避免覆盖期间的其他修改
+    try:
+        success = await qas.patch_tasklist(host=qas_config.host, patch=patch) if patch else True
+    except TaskListConflictError as e:
+        logger.warning(f"标记 QAS 任务开始文件冲突: {e}")
+        success = False
+    if success:
+        await update.effective_message.reply_text(
+            text="标记完成 ✅"
+        )
+    else:
+        await update.effective_message.reply_text(
+            text="标记失败 ❌"
+        )
 
 
 async def qas_tag_start_file_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, user: User):
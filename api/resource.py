@@ -1,8 +1,9 @@
 import asyncio
 import logging
+import time
 from collections import defaultdict
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from telegram import Update
 from telegram.constants import ParseMode
 from telegram.ext import ContextTypes, CallbackQueryHandler
@@ -13,8 +14,11 @@ from config.config import get_allow_roles_command_map, CLOUD_TYPE_QUARK
 from db.models.log import OperationLog, OperationType
 from db.models.user import User
 from utils.command_middleware import depends
+from utils.link_cache import link_validity_cache
 from utils.pansou import PanSou
 from utils.quark import Quark
+from utils.search_cache import search_result_cache
+from utils.telegram_sender import send_queue, PRIORITY_BULK
 
 logger = logging.getLogger(__name__)
 
@@ -26,8 +30,66 @@ def _get_pansou(context: ContextTypes.DEFAULT_TYPE) -> PanSou:
     return context.bot_data['pansou']
 
 
-@command(name='search_media_resource', description="搜索资源", args="{resource name}")
-async def search_media_resource(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, user: User):
+# 链接校验结果刷新到已发送消息的最小间隔（秒），避免触发 Telegram 的编辑频率限制
+SEARCH_RESULT_EDIT_INTERVAL = 2
+
+
+async def _sync_messages(chat_id: int, sent: list, texts: list):
+    """
+    将已发送的一组消息同步为 texts：内容变化的原地编辑，新增的发送，多余的删除
+
+    Args:
+        sent: [[message_id, text], ...]，发送失败的消息 message_id 为 None，下次同步时重新发送
+    """
+    for index, text in enumerate(texts):
+        if index < len(sent) and sent[index][0] is None and sent[index][1] == text:
+            # 同样的内容发送失败过，不再重复发送
+            continue
+        if index < len(sent) and sent[index][0] is not None:
+            message_id, old_text = sent[index]
+            if text == old_text:
+                continue
+            try:
+                await send_queue.send(
+                    chat_id,
+                    method='edit_message_text',
+                    priority=PRIORITY_BULK,
+                    message_id=message_id,
+                    text=text,
+                    parse_mode="html"
+                )
+                sent[index][1] = text
+            except Exception as e:
+                logger.error(f"resource edit (text: {text}) error: {e}")
+            continue
+
+        try:
+            message = await send_queue.send(
+                chat_id,
+                text=text,
+                parse_mode="html"
+            )
+            message_id = message.message_id
+        except Exception as e:
+            logger.error(f"resource reply (text: {text}) error: {e}")
+            message_id = None
+        if index < len(sent):
+            sent[index] = [message_id, text]
+        else:
+            sent.append([message_id, text])
+
+    while len(sent) > len(texts):
+        message_id, _ = sent.pop()
+        if message_id is None:
+            continue
+        try:
+            await send_queue.send(chat_id, method='delete_message', priority=PRIORITY_BULK, message_id=message_id)
+        except Exception as e:
+            logger.error(f"resource delete (message_id: {message_id}) error: {e}")
+
+
+@command(name='search_media_resource', description="搜索资源", args="{resource name}", async_session=True)
+async def search_media_resource(update: Update, context: ContextTypes.DEFAULT_TYPE, session: AsyncSession, user: User):
     async def cs_task(search_content: str):
         cloud_saver = context.bot_data['cloud_saver']
         data = await cloud_saver.search(search_content)
@@ -40,10 +102,78 @@ async def search_media_resource(update: Update, context: ContextTypes.DEFAULT_TY
             return {'merged_by_type': {}}
         return data.get('data') or {'merged_by_type': {}}
 
+    def cs_links(cs_result) -> dict:
+        links = defaultdict(list)
+        for channel_data in cs_result:
+            for item in channel_data.get("list", []):
+                for link in item.get("cloudLinks", []):
+                    url = link.get("link")
+                    if url:
+                        cloud_type_name = cloud_saver.cloud_type_map.get(link.get("cloudType", "").upper())
+                        # 如果用户配置了常用云盘，只添加用户配置的云盘类型
+                        if preferred_clouds is None or cloud_type_name in preferred_clouds:
+                            links[cloud_type_name].append(url)
+        return links
+
+    def ps_links(ps_result) -> dict:
+        links = defaultdict(list)
+        for cloud_type, resources in ps_result.get('merged_by_type').items():
+            cloud_type_name = p.cloud_type_map.get(cloud_type)
+            # 如果用户配置了常用云盘，只处理用户配置的云盘类型
+            if preferred_clouds is None or cloud_type_name in preferred_clouds:
+                for resource in resources:
+                    links[cloud_type_name].append(resource.get('url'))
+        return links
+
+    async def deliver(name: str, search, empty_result, collect_links, render) -> int:
+        """
+        单个搜索源的流水线：搜索返回后立即发送结果，再随链接校验结果原地编辑消息
+
+        Returns:
+            最终展示的消息数
+        """
+        try:
+            result = await search(search_content)
+        except Exception as e:
+            # 单个源失败不影响整体
+            logger.error(f"{name} 搜索失败: {e}")
+            result = empty_result
+
+        all_links = collect_links(result)
+        for urls in all_links.values():
+            for url in urls:
+                links_valid.setdefault(url, '状态未知')
+
+        # 已缓存的校验结果直接用于首次展示
+        quark_links = list(dict.fromkeys(all_links.get(CLOUD_TYPE_QUARK, [])))
+        cached = await link_validity_cache.get_many(quark_links)
+        links_valid.update(cached)
+        to_check = [link for link in quark_links if link not in cached]
+
+        sent = list()
+        await _sync_messages(chat_id, sent, await render(result))
+        if not to_check:
+            return len(sent)
+
+        checked = dict()
+        last_edit_at = time.monotonic()
+        try:
+            async for link, status in quark.iter_links_valid(to_check, use_cache=False):
+                links_valid[link] = status
+                checked[link] = status
+                if time.monotonic() - last_edit_at >= SEARCH_RESULT_EDIT_INTERVAL:
+                    await _sync_messages(chat_id, sent, await render(result))
+                    last_edit_at = time.monotonic()
+        finally:
+            await link_validity_cache.set_many(checked)
+        await _sync_messages(chat_id, sent, await render(result))
+        return len(sent)
+
     if len(context.args) == 0:
         await context.bot.send_message(chat_id=update.effective_chat.id, text="缺少资源名称")
         return
     search_content = context.args[0]
+    chat_id = update.effective_chat.id
 
     # 获取用户配置的常用云盘类型
     preferred_clouds = get_user_preferred_cloud_types(user)
@@ -52,70 +182,28 @@ async def search_media_resource(update: Update, context: ContextTypes.DEFAULT_TY
 
     cloud_saver = context.bot_data['cloud_saver']
     p = _get_pansou(context)
+    quark = Quark()
+    # 两个搜索源共用的链接状态
+    links_valid = dict()
 
     await context.bot.send_message(
-        chat_id=update.effective_chat.id,
-        text="资源搜索中，请稍等",
+        chat_id=chat_id,
+        text="资源搜索中，结果将按搜索源陆续发送，链接状态校验后会自动更新",
         parse_mode="html"
     )
 
-    cs_result, ps_result = await asyncio.gather(
-        cs_task(search_content),
-        ps_task(search_content),
-        return_exceptions=True
-    )
-
-    # 单个源失败不影响整体
-    if isinstance(cs_result, Exception):
-        logger.error(f"cloud_saver 搜索失败: {cs_result}")
-        cs_result = []
-    if isinstance(ps_result, Exception):
-        logger.error(f"pansou 搜索失败: {ps_result}")
-        ps_result = {'merged_by_type': {}}
-
-    await context.bot.send_message(
-        chat_id=update.effective_chat.id,
-        text="资源搜索已完成，正在校验资源有效性，请稍等",
-        parse_mode="html"
+    message_counts = await asyncio.gather(
+        deliver(
+            'cloud_saver', cs_task, [], cs_links,
+            lambda result: cloud_saver.format_links_by_cloud_type(result, links_valid, preferred_clouds)
+        ),
+        deliver(
+            'pansou', ps_task, {'merged_by_type': {}}, ps_links,
+            lambda result: p.format_links_by_cloud_type(result, links_valid, preferred_clouds)
+        ),
     )
 
-    all_links = defaultdict(list)
-    links_valid = dict()
-
-    # cs
-    for channel_data in cs_result:
-        for item in channel_data.get("list", []):
-            for link in item.get("cloudLinks", []):
-                url = link.get("link")
-                if url:
-                    cloud_type_name = cloud_saver.cloud_type_map.get(link.get("cloudType", "").upper())
-                    # 如果用户配置了常用云盘，只添加用户配置的云盘类型
-                    if preferred_clouds is None or cloud_type_name in preferred_clouds:
-                        all_links[cloud_type_name].append(url)
-                        links_valid[url] = '状态未知'
-    # ps
-    for cloud_type, resources in ps_result.get('merged_by_type').items():
-        cloud_type_name = p.cloud_type_map.get(cloud_type)
-        # 如果用户配置了常用云盘，只处理用户配置的云盘类型
-        if preferred_clouds is None or cloud_type_name in preferred_clouds:
-            for resource in resources:
-                all_links[cloud_type_name].append(resource.get('url'))
-                links_valid[resource.get('url')] = '状态未知'
-
-    # 查看夸克链接的状态
-    quark = Quark()
-    quark_links_valid = await quark.links_valid(links=all_links.get(CLOUD_TYPE_QUARK, []))
-
-    # 更新各网盘链接状态
-    links_valid.update(quark_links_valid)
-
-    # cs
-    cs_messages = await cloud_saver.format_links_by_cloud_type(cs_result, links_valid, preferred_clouds)
-
-    # ps
-    ps_messages = await p.format_links_by_cloud_type(ps_result, links_valid, preferred_clouds)
-
-    messages = cs_messages + ps_messages
+    logger.info(f"搜索结果缓存: {search_result_cache.stats()}, 链接校验缓存: {link_validity_cache.stats()}")
 
     session.add(
         OperationLog(
@@ -124,29 +212,17 @@ async def search_media_resource(update: Update, context: ContextTypes.DEFAULT_TY
             description=f"用户{user.tg_id} - {user.username} 搜索资源 {search_content}"
         )
     )
-    session.commit()
+    await session.commit()
 
-    if not messages:
+    if not sum(message_counts):
         await context.bot.send_message(
-            chat_id=update.effective_chat.id,
+            chat_id=chat_id,
             text=f"未找到资源 {search_content}",
             parse_mode="html"
         )
-        return
-
-    for message in messages:
-        try:
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=message,
-                parse_mode="html"
-            )
-        except Exception as e:
-            logger.error(f"resource reply (text: {message}) error: {e}")
-            continue
 
 
-async def on_search_media_resource_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, user: User):
+async def on_search_media_resource_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, session: AsyncSession, user: User):
     query = update.callback_query
     await query.answer()
 
@@ -159,6 +235,6 @@ async def on_search_media_resource_callback(update: Update, context: ContextType
 
 handlers = [
     CallbackQueryHandler(
-        depends(allowed_roles=get_allow_roles_command_map().get('search_media_resource'))(on_search_media_resource_callback),
+        depends(allowed_roles=get_allow_roles_command_map().get('search_media_resource'), async_session=True)(on_search_media_resource_callback),
         pattern=r"^search_media_resource:.*$"),
 ]
\ No newline at end of file
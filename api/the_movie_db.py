@@ -1,17 +1,17 @@
 import asyncio
 import logging
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, CallbackQueryHandler
-from tmdbv3api import TMDb, TV, Genre, Movie
-import telegram
 
 from api.base import command
-from config.config import TMDB_API_KEY, TMDB_POSTER_BASE_URL, get_allow_roles_command_map
+from config.config import get_allow_roles_command_map
 from db.models.log import OperationLog, OperationType
 from db.models.user import User
 from utils.command_middleware import depends
+from utils.telegram_sender import send_queue, PRIORITY_BULK
+from utils.the_movie_db import tmdb_service, MEDIA_TV, MEDIA_MOVIE
 
 logger = logging.getLogger(__name__)
 
@@ -20,7 +20,6 @@ async def format_tmdb_tv_search(data, genre_mapping, detail):
     genres = ", ".join(genre_mapping.get(gid, str(gid)) for gid in data.get('genre_ids', []))
     origin_countries = ", ".join(data.get('origin_country', []))
 
-    homepage = detail.homepage
     formatted_text = f"""<b>🎬 剧概述</b>
 <b>📌 剧名：</b>{data.get('name')}
 <b>🌍 原名：</b>{data.get('original_name')}
@@ -39,7 +38,6 @@ async def format_tmdb_tv_search(data, genre_mapping, detail):
     """
 
     # 最新一集信息
-    detail = detail._dict()
     last_episode_to_air = detail.get('last_episode_to_air')
     if last_episode_to_air:
         last_episode_to_air_msg = f"""<b>📺 最新一集</b>
@@ -104,39 +102,63 @@ def tmdb_search_tv_build_keyboard(search_content: str, page: int, total_page: in
     return InlineKeyboardMarkup([buttons]) if buttons else None
 
 
-@command(name='search_tv', description="搜索电视剧信息", args="{tv name}")
-async def tmdb_search_tv(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, user: User):
-    tmdb = TMDb()
-    tmdb.api_key = TMDB_API_KEY
-    poster_base_url = TMDB_POSTER_BASE_URL
-    tmdb.language = 'zh'
-    tmdb.debug = True
-
-    tv = TV()
-    genre = Genre()
-    genre_tv_data = await asyncio.to_thread(genre.tv_list)
-    genre_mapping = {genre['id']: genre['name'] for genre in genre_tv_data['genres']}
+async def send_search_photos(update: Update, photos: list):
+    """按顺序发送 (photo_url, caption) 图片消息，单条失败只记录日志"""
+    futures = [
+        send_queue.submit(
+            update.effective_chat.id,
+            method='send_photo',
+            priority=PRIORITY_BULK,
+            photo=photo_url,
+            caption=caption,
+            parse_mode="html",
+        )
+        for photo_url, caption in photos
+    ]
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    for (photo_url, caption), result in zip(photos, results):
+        if isinstance(result, Exception):
+            logger.error(f"send_photo (photo: {photo_url}, caption: {caption}) error: {result}")
+
+
+def parse_page(args: list) -> int | None:
+    """第二个参数为页码，缺省为第一页；不是正整数时返回 None"""
+    if len(args) < 2:
+        return 1
+    try:
+        page = int(args[1])
+    except (TypeError, ValueError):
+        return None
+    return page if page >= 1 else None
+
+
+@command(name='search_tv', description="搜索电视剧信息", args="{tv name}", async_session=True)
+async def tmdb_search_tv(update: Update, context: ContextTypes.DEFAULT_TYPE, session: AsyncSession, user: User):
     if len(context.args) == 0:
         await context.bot.send_message(chat_id=update.effective_chat.id, text="缺少剧名参数")
+        return
     search_content = context.args[0]
-    page = context.args[1] if len(context.args) > 1 else 1
-    search = await asyncio.to_thread(tv.search, search_content, page)
+    page = parse_page(context.args)
+    if page is None:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text="页码必须是正整数")
+        return
+
+    # 流派列表与本页所有结果的详情并发获取
+    genre_mapping, (search, hits) = await asyncio.gather(
+        tmdb_service.genre_mapping(MEDIA_TV),
+        tmdb_service.search_with_details(MEDIA_TV, search_content, page),
+    )
 
     logger.info(f"TMDB search tv: {search_content} page: {page}")
     logger.info(f"total_pages: {search.get('total_pages')}")
 
-    for index, res in enumerate(search.get('results', [])):
-        detail = await asyncio.to_thread(tv.details, res.get('id'))
-        poster_path = detail.get('poster_path')
-        photo_url = f"{poster_base_url}{poster_path}"
-        message = await format_tmdb_tv_search(res, genre_mapping, detail)
-        try:
-            await update.message.reply_photo(photo=photo_url, caption=message, parse_mode="html")
-        except telegram.error.BadRequest as e:
-            logger.error(f"reply_photo (photo: {photo_url}, caption: {message}) error: {e}")
+    await send_search_photos(update, [
+        (tmdb_service.poster_url(detail, res), await format_tmdb_tv_search(res, genre_mapping, detail))
+        for res, detail in hits
+    ])
 
     keyboard = tmdb_search_tv_build_keyboard(search_content, page, search.get('total_pages'))
-    await update.message.reply_text(
+    await update.effective_message.reply_text(
         text="可选择以下操作：",
         reply_markup=keyboard,
         parse_mode='HTML'
@@ -149,7 +171,7 @@ async def tmdb_search_tv(update: Update, context: ContextTypes.DEFAULT_TYPE, ses
     )
 
 
-async def on_search_tv_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, user: User):
+async def on_search_tv_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, session: AsyncSession, user: User):
     query = update.callback_query
     await query.answer()
 
@@ -169,42 +191,33 @@ def tmdb_search_movie_build_keyboard(search_content: str, page: int, total_page:
     return InlineKeyboardMarkup([buttons]) if buttons else None
 
 
-@command(name='search_movie', description="搜索电影信息", args="{movie name}")
-async def tmdb_search_movie(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, user: User):
-    tmdb = TMDb()
-    tmdb.api_key = TMDB_API_KEY
-    poster_base_url = TMDB_POSTER_BASE_URL
-    tmdb.language = 'zh'
-    tmdb.debug = True
-
-    movie = Movie()
-    genre = Genre()
-    genre_movie_data = await asyncio.to_thread(genre.movie_list)
-    genre_mapping = {genre['id']: genre['name'] for genre in genre_movie_data['genres']}
-
+@command(name='search_movie', description="搜索电影信息", args="{movie name}", async_session=True)
+async def tmdb_search_movie(update: Update, context: ContextTypes.DEFAULT_TYPE, session: AsyncSession, user: User):
     if len(context.args) == 0:
         await context.bot.send_message(chat_id=update.effective_chat.id, text="缺少剧名参数")
+        return
     search_content = context.args[0]
-    page = context.args[1] if len(context.args) > 1 else 1
-
-    search = await asyncio.to_thread(movie.search, search_content)
+    page = parse_page(context.args)
+    if page is None:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text="页码必须是正整数")
+        return
+
+    # 电影卡片只用到搜索结果中的字段，不需要再获取详情
+    genre_mapping, search = await asyncio.gather(
+        tmdb_service.genre_mapping(MEDIA_MOVIE),
+        tmdb_service.search(MEDIA_MOVIE, search_content, page),
+    )
 
     logger.info(f"TMDB search movie: {search_content} page: {page}")
     logger.info(f"total_pages: {search.get('total_pages')}")
 
-    for index, res in enumerate(search.get('results', [])):
-        detail = await asyncio.to_thread(movie.details, res.get('id'))
-        poster_path = detail.get('poster_path')
-        photo_url = f"{poster_base_url}{poster_path}"
-        message = await format_tmdb_movie_search(res, genre_mapping)
-
-        try:
-            await update.message.reply_photo(photo=photo_url, caption=message, parse_mode="html")
-        except telegram.error.BadRequest as e:
-            logger.error(f"reply_photo (photo: {photo_url}, caption: {message}) error: {e}")
+    await send_search_photos(update, [
+        (tmdb_service.poster_url(res), await format_tmdb_movie_search(res, genre_mapping))
+        for res in search.get('results', [])
+    ])
 
     keyboard = tmdb_search_movie_build_keyboard(search_content, page, search.get('total_pages'))
-    await update.message.reply_text(
+    await update.effective_message.reply_text(
         text="可选择以下操作：",
         reply_markup=keyboard,
         parse_mode='HTML'
@@ -215,7 +228,7 @@ async def tmdb_search_movie(update: Update, context: ContextTypes.DEFAULT_TYPE,
         description=f"用户{user.tg_id} - {user.username} 搜索 MOVIE {search_content} 信息"
     )
 
-async def on_search_movie_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, user: User):
+async def on_search_movie_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, session: AsyncSession, user: User):
     query = update.callback_query
     await query.answer()
 
@@ -229,9 +242,9 @@ async def on_search_movie_callback(update: Update, context: ContextTypes.DEFAULT
 
 handlers = [
     CallbackQueryHandler(
-        depends(allowed_roles=get_allow_roles_command_map().get('search_tv'))(on_search_tv_callback),
+        depends(allowed_roles=get_allow_roles_command_map().get('search_tv'), async_session=True)(on_search_tv_callback),
         pattern=r"^search_tv:.*$"),
     CallbackQueryHandler(
-        depends(allowed_roles=get_allow_roles_command_map().get('search_movie'))(on_search_movie_callback),
+        depends(allowed_roles=get_allow_roles_command_map().get('search_movie'), async_session=True)(on_search_movie_callback),
         pattern=r"^search_movie:.*$")
 ]
\ No newline at end of file
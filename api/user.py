@@ -1,7 +1,9 @@
 from pyexpat.errors import messages
 from typing import Optional
 
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func, update as sql_update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 from telegram import Update
 from telegram.ext import ContextTypes
 
@@ -10,22 +12,24 @@ from api.commands import set_commands
 from config.config import ADMIN_ROLE_NAME, USER_ROLE_NAME, OWNER_ROLE_NAME
 from db.models.log import OperationLog, OperationType
 from db.models.user import User, Role
+from utils.command_middleware import user_identity_cache
 
-@command(name='register', description="注册")
-async def register(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, user: User):
+@command(name='register', description="注册", async_session=True)
+async def register(update: Update, context: ContextTypes.DEFAULT_TYPE, session: AsyncSession, user: User):
     if not user:
-        user_count = session.query(User).count()
+        user_count = await session.scalar(select(func.count()).select_from(User))
         if user_count == 0:
-            user_role = session.query(Role).filter_by(name=OWNER_ROLE_NAME).first()
+            user_role = await session.scalar(select(Role).filter_by(name=OWNER_ROLE_NAME))
         else:
-            user_role = session.query(Role).filter_by(name=USER_ROLE_NAME).first()
+            user_role = await session.scalar(select(Role).filter_by(name=USER_ROLE_NAME))
         new_user = User(tg_id=update.effective_user.id,
                         chat_id=update.effective_chat.id,
                         username=update.effective_user.username,
-                        role_id=user_role.id
+                        role=user_role
                         )
         session.add(new_user)
-        session.commit()
+        await session.commit()
+        user_identity_cache.invalidate(update.effective_user.id)
         message = '注册成功'
         await set_commands(update, context, session, [new_user])
     else:
@@ -33,8 +37,8 @@ async def register(update: Update, context: ContextTypes.DEFAULT_TYPE, session:
     await context.bot.send_message(chat_id=update.effective_chat.id, text=message)
 
 
-@command(name='my_info', description="获取个人信息")
-async def my_info(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, user: User):
+@command(name='my_info', description="获取个人信息", async_session=True)
+async def my_info(update: Update, context: ContextTypes.DEFAULT_TYPE, session: AsyncSession, user: User):
     if user:
         message = "<pre>TG_ID   Username   Role\n"
         message += "------------------------\n"
@@ -44,19 +48,25 @@ async def my_info(update: Update, context: ContextTypes.DEFAULT_TYPE, session: S
         message = '你未注册'
     await context.bot.send_message(chat_id=update.effective_chat.id, text=message,parse_mode='HTML')
 
-@command(name='set_admin', description="将用户设置为管理员", args="{telegram id}")
-async def set_admin(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, user: User):
-    user_tg_ids = context.args[0].split(',')
-    admin_role = session.query(Role).filter_by(name=ADMIN_ROLE_NAME).first()
-    session.query(User).filter(User.tg_id.in_(user_tg_ids)
-                               ).update(
-        {User.role_id: admin_role.id},
-        synchronize_session=False
+@command(name='set_admin', description="将用户设置为管理员", args="{telegram id}", async_session=True)
+async def set_admin(update: Update, context: ContextTypes.DEFAULT_TYPE, session: AsyncSession, user: User):
+    if len(context.args) < 1:
+        await update.message.reply_text("缺少参数")
+        return
+    try:
+        user_tg_ids = [int(tg_id) for tg_id in context.args[0].split(',')]
+    except ValueError:
+        await update.message.reply_text("telegram id 必须是数字，多个用英文逗号分隔")
+        return
+    admin_role = await session.scalar(select(Role).filter_by(name=ADMIN_ROLE_NAME))
+    await session.execute(
+        sql_update(User).where(User.tg_id.in_(user_tg_ids)).values(role_id=admin_role.id),
+        execution_options={'synchronize_session': False}
     )
 
     op_logs = list()
     for user_tg_id in user_tg_ids:
-        update_user = session.query(User).filter_by(tg_id=user_tg_id).first()
+        update_user = await session.scalar(select(User).filter_by(tg_id=user_tg_id))
         if not update_user:
             continue
         op_logs.append(
@@ -69,8 +79,15 @@ async def set_admin(update: Update, context: ContextTypes.DEFAULT_TYPE, session:
             )
         )
     session.add_all(op_logs)
-    session.commit()
+    await session.commit()
+    user_identity_cache.invalidate(*user_tg_ids)
     message = f'{user_tg_ids} 已经设置为管理员'
-    admins = session.query(User).filter(User.tg_id.in_(user_tg_ids)).all()
-    await set_commands(update, context, session, admins)
+    # 会话提交后不过期对象，需覆盖已加载用户的旧角色
+    admins = (await session.scalars(
+        select(User).options(joinedload(User.role)).filter(User.tg_id.in_(user_tg_ids))
+        .execution_options(populate_existing=True)
+    )).all()
+    # 没有匹配的用户时无需同步，不能退化为全量同步
+    if admins:
+        await set_commands(update, context, session, admins)
     await context.bot.send_message(chat_id=update.effective_chat.id, text=message)
\ No newline at end of file
@@ -286,13 +286,14 @@ async def quark_cookies_set(update: Update, context: ContextTypes.DEFAULT_TYPE,
         return
 
     # 导入加密函数
-    from utils.crypto import encrypt_sensitive_data
+    from utils.crypto import encrypt_sensitive_data, forget_decrypted
 
     # 加密 Cookies
     encrypted_cookies = encrypt_sensitive_data(cookies)
 
     # 获取用户配置
     user_config = user.configuration or {}
+    forget_decrypted(user_config.get('quark_cookies'))
     user_config['quark_cookies'] = encrypted_cookies
 
     # 保存到数据库
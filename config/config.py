@@ -2,7 +2,6 @@ import os
 from collections import defaultdict
 from typing import List
 
-from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from telegram import BotCommand
 
 TIME_ZONE = "Asia/Shanghai"
@@ -12,6 +11,13 @@ TG_DB_PATH = os.path.join(DATA_PATH, 'tgbot.db')
 
 TG_BOT_TOKEN = os.getenv('TG_BOT_TOKEN')
 
+# SQLite：是否打印 SQL、写锁等待时间（毫秒）、内存映射大小（字节）、连接池大小与溢出连接数
+SQL_ECHO = os.environ.get('SQL_ECHO', 'false').lower() == 'true'
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', 5))
+SQLITE_POOL_MAX_OVERFLOW = int(os.environ.get('SQLITE_POOL_MAX_OVERFLOW', 10))
+
 # 加密配置 - 必需的环境变量
 CRYPTO_PASSWORD = os.getenv('CRYPTO_PASSWORD')
 CRYPTO_SALT = os.getenv('CRYPTO_SALT')
@@ -78,6 +84,85 @@ CLOUD_SAVER_HOST = os.environ.get('CLOUD_SAVER_HOST')
 CLOUD_SAVER_USERNAME = os.environ.get('CLOUD_SAVER_USERNAME')
 CLOUD_SAVER_PASSWORD = os.environ.get('CLOUD_SAVER_PASSWORD')
 
+# 夸克分享目录遍历：同层目录并发请求数上限、最大遍历深度（根目录为第 0 层）
+QUARK_SHARE_CRAWL_CONCURRENCY = int(os.environ.get('QUARK_SHARE_CRAWL_CONCURRENCY', 8))
+QUARK_SHARE_CRAWL_MAX_DEPTH = int(os.environ.get('QUARK_SHARE_CRAWL_MAX_DEPTH', 10))
+
+# QAS /data 快照缓存有效期（秒）
+QAS_DATA_CACHE_TTL = int(os.environ.get('QAS_DATA_CACHE_TTL', 60))
+
+# 进程级 HTTP 连接池：总连接数、每个主机的连接数、DNS 缓存时间（秒）、空闲连接保活时间（秒）
+HTTP_POOL_LIMIT = int(os.environ.get('HTTP_POOL_LIMIT', 100))
+HTTP_POOL_LIMIT_PER_HOST = int(os.environ.get('HTTP_POOL_LIMIT_PER_HOST', 30))
+HTTP_POOL_DNS_TTL = int(os.environ.get('HTTP_POOL_DNS_TTL', 300))
+HTTP_POOL_KEEPALIVE_TIMEOUT = int(os.environ.get('HTTP_POOL_KEEPALIVE_TIMEOUT', 60))
+
+# 夸克链接校验：并发校验数、每秒请求数与突发上限、限流或服务端错误时的最大重试次数
+QUARK_LINK_CHECK_CONCURRENCY = int(os.environ.get('QUARK_LINK_CHECK_CONCURRENCY', 8))
+QUARK_LINK_CHECK_RATE = float(os.environ.get('QUARK_LINK_CHECK_RATE', 10))
+QUARK_LINK_CHECK_BURST = int(os.environ.get('QUARK_LINK_CHECK_BURST', 20))
+QUARK_LINK_CHECK_RETRIES = int(os.environ.get('QUARK_LINK_CHECK_RETRIES', 3))
+
+# 链接校验结果缓存有效期（秒）：有效、失效、已封禁/取消分享；以及内存中缓存的链接数上限
+LINK_VALID_TTL = int(os.environ.get('LINK_VALID_TTL', 6 * 3600))
+LINK_INVALID_TTL = int(os.environ.get('LINK_INVALID_TTL', 3600))
+LINK_BANNED_TTL = int(os.environ.get('LINK_BANNED_TTL', 7 * 24 * 3600))
+LINK_CACHE_MEMORY_SIZE = int(os.environ.get('LINK_CACHE_MEMORY_SIZE', 4096))
+
+# CloudSaver / PanSou 搜索结果缓存有效期（秒）与最多缓存的关键词数
+SEARCH_RESULT_CACHE_TTL = int(os.environ.get('SEARCH_RESULT_CACHE_TTL', 300))
+SEARCH_RESULT_CACHE_SIZE = int(os.environ.get('SEARCH_RESULT_CACHE_SIZE', 256))
+
+# depends() 中 tg_id -> 用户身份缓存的有效期（秒），兜底进程外对 user 表的修改
+USER_IDENTITY_CACHE_TTL = int(os.environ.get('USER_IDENTITY_CACHE_TTL', 600))
+
+# 已结束提醒任务的兜底扫描：每批扫描的记录数、每次最多扫描的批数
+TAG_DONE_JOBS_BATCH_SIZE = int(os.environ.get('TAG_DONE_JOBS_BATCH_SIZE', 500))
+TAG_DONE_JOBS_MAX_BATCHES = int(os.environ.get('TAG_DONE_JOBS_MAX_BATCHES', 10))
+
+# 夸克 Cookies 定时检测：并发检测数、每秒请求数、单个用户的重试次数、
+# 检测出错后的退避基数与上限（秒）、已过期 Cookies 的复查间隔（秒）
+QUARK_COOKIE_CHECK_CONCURRENCY = int(os.environ.get('QUARK_COOKIE_CHECK_CONCURRENCY', 4))
+QUARK_COOKIE_CHECK_RATE = float(os.environ.get('QUARK_COOKIE_CHECK_RATE', 2))
+QUARK_COOKIE_CHECK_RETRIES = int(os.environ.get('QUARK_COOKIE_CHECK_RETRIES', 3))
+QUARK_COOKIE_CHECK_BACKOFF = int(os.environ.get('QUARK_COOKIE_CHECK_BACKOFF', 1800))
+QUARK_COOKIE_CHECK_MAX_BACKOFF = int(os.environ.get('QUARK_COOKIE_CHECK_MAX_BACKOFF', 24 * 3600))
+QUARK_COOKIE_EXPIRED_RECHECK = int(os.environ.get('QUARK_COOKIE_EXPIRED_RECHECK', 24 * 3600))
+
+# Telegram 出站消息队列：全局每秒条数、单个聊天每秒条数、被限流（RetryAfter）后的最大重试次数
+TELEGRAM_GLOBAL_RATE = float(os.environ.get('TELEGRAM_GLOBAL_RATE', 30))
+TELEGRAM_CHAT_RATE = float(os.environ.get('TELEGRAM_CHAT_RATE', 1))
+TELEGRAM_SEND_RETRIES = int(os.environ.get('TELEGRAM_SEND_RETRIES', 3))
+
+# 解密结果的内存缓存：有效期（秒）与最多缓存的密文数，有效期设为 0 关闭缓存
+DECRYPT_CACHE_TTL = int(os.environ.get('DECRYPT_CACHE_TTL', 300))
+DECRYPT_CACHE_SIZE = int(os.environ.get('DECRYPT_CACHE_SIZE', 1024))
+
+# TMDB 查询：每秒请求数、被限流（429）后的最大重试次数、
+# 流派列表 / 条目详情 / 搜索结果的缓存有效期（秒）与详情缓存条数，缓存过期后带 ETag 重新验证
+TMDB_RATE = float(os.environ.get('TMDB_RATE', 40))
+TMDB_RETRIES = int(os.environ.get('TMDB_RETRIES', 2))
+TMDB_GENRE_CACHE_TTL = int(os.environ.get('TMDB_GENRE_CACHE_TTL', 12 * 3600))
+TMDB_DETAIL_CACHE_TTL = int(os.environ.get('TMDB_DETAIL_CACHE_TTL', 6 * 3600))
+TMDB_DETAIL_CACHE_SIZE = int(os.environ.get('TMDB_DETAIL_CACHE_SIZE', 1024))
+TMDB_SEARCH_CACHE_TTL = int(os.environ.get('TMDB_SEARCH_CACHE_TTL', 600))
+
+# Emby 管理员用户 id 缓存有效期（秒），按服务器地址缓存
+EMBY_ADMIN_USER_CACHE_TTL = int(os.environ.get('EMBY_ADMIN_USER_CACHE_TTL', 3600))
+# Emby 登录 access token 的缓存有效期（秒），按 (服务器地址, 用户名) 缓存，失效（401）时自动重新登录
+EMBY_ACCESS_TOKEN_TTL = int(os.environ.get('EMBY_ACCESS_TOKEN_TTL', 24 * 3600))
+# Emby 通知配置快照的有效期（秒），按服务器地址缓存，查看通知后切换时基于快照修改，修改成功后写回快照，失败时丢弃
+EMBY_NOTIFICATION_SNAPSHOT_TTL = int(os.environ.get('EMBY_NOTIFICATION_SNAPSHOT_TTL', 600))
+
+# Emby 新入库轮询：轮询间隔（秒，0 为关闭）、每页条目数、每个用户每次最多拉取的页数、同时轮询的用户数、
+# 轮询出错后的退避基数与上限（秒）
+EMBY_POLL_INTERVAL = int(os.environ.get('EMBY_POLL_INTERVAL', 600))
+EMBY_POLL_PAGE_SIZE = int(os.environ.get('EMBY_POLL_PAGE_SIZE', 50))
+EMBY_POLL_MAX_PAGES = int(os.environ.get('EMBY_POLL_MAX_PAGES', 5))
+EMBY_POLL_CONCURRENCY = int(os.environ.get('EMBY_POLL_CONCURRENCY', 4))
+EMBY_POLL_BACKOFF = int(os.environ.get('EMBY_POLL_BACKOFF', 1800))
+EMBY_POLL_MAX_BACKOFF = int(os.environ.get('EMBY_POLL_MAX_BACKOFF', 24 * 3600))
+
 # 网盘类型常量（用于代码引用，避免硬编码）
 CLOUD_TYPE_QUARK = "夸克网盘"
 CLOUD_TYPE_ALIPAN = "阿里云盘"
@@ -105,10 +190,6 @@ CLOUD_TYPE_MAP = {
 # 所有可用的网盘类型名称
 AVAILABLE_CLOUD_TYPES = set(CLOUD_TYPE_MAP.values())
 
-JOB_STORES = {
-    'default': SQLAlchemyJobStore(url=f'sqlite:///{TG_DB_PATH}')
-}
-
 AI_API_KEYS = {
     'openai': {
         'host': os.environ.get('OPENAI_HOST'),
@@ -0,0 +1,61 @@
+import logging
+from functools import lru_cache
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
+
+from config.config import TG_DB_PATH, SQL_ECHO, SQLITE_BUSY_TIMEOUT, SQLITE_MMAP_SIZE, SQLITE_POOL_SIZE, \
+    SQLITE_POOL_MAX_OVERFLOW
+
+logger = logging.getLogger(__name__)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    每个新连接建立时设置 PRAGMA
+
+    WAL 模式下读写互不阻塞；busy_timeout 让写锁冲突时等待而不是直接报 database is locked；
+    WAL 下 synchronous=NORMAL 仍能保证一致性，只在断电时可能丢失最近的事务
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+
+def _pool_options() -> dict:
+    return {
+        'echo': SQL_ECHO,
+        'pool_size': SQLITE_POOL_SIZE,
+        'max_overflow': SQLITE_POOL_MAX_OVERFLOW,
+        'pool_pre_ping': True,
+    }
+
+
+@lru_cache(maxsize=None)
+def get_engine(db_path: str = TG_DB_PATH) -> Engine:
+    """进程内共享的同步引擎，同一数据库文件只创建一个"""
+    engine = create_engine(f'sqlite:///{db_path}', **_pool_options())
+    event.listen(engine, 'connect', _set_sqlite_pragmas)
+    logger.info(f"已创建 SQLite 引擎: {db_path}")
+    return engine
+
+
+@lru_cache(maxsize=None)
+def get_async_engine(db_path: str = TG_DB_PATH) -> AsyncEngine:
+    """进程内共享的异步引擎（aiosqlite），PRAGMA 与同步引擎一致"""
+    engine = create_async_engine(f'sqlite+aiosqlite:///{db_path}', **_pool_options())
+    event.listen(engine.sync_engine, 'connect', _set_sqlite_pragmas)
+    logger.info(f"已创建 SQLite 异步引擎: {db_path}")
+    return engine
+
+
+def get_job_stores() -> dict:
+    """APScheduler 任务存储，与业务代码共用同一个引擎"""
+    from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+    return {
+        'default': SQLAlchemyJobStore(engine=get_engine())
+    }
@@ -1,21 +1,28 @@
+import logging
 import os
 import sqlite3
 
 import pytz
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.schedulers.background import BackgroundScheduler
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 
-from config.config import ADMIN_ROLE_NAME, OWNER_ROLE_NAME, USER_ROLE_NAME, TG_DB_PATH, JOB_STORES
+from config.config import ADMIN_ROLE_NAME, OWNER_ROLE_NAME, USER_ROLE_NAME
+from db.engine import get_job_stores
+from db.models import model_engine, session_local, async_model_engine, async_session_local
 from db.models.base import Base
 from db.models.user import Role
 
+logger = logging.getLogger(__name__)
+
 
 class Init:
     def __init__(self):
-        self.engine = create_engine(f'sqlite:///{TG_DB_PATH}', echo=True)
-        self.session_local = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        # 与 db.models 共用引擎，避免同一数据库文件上多个连接池互相争抢写锁
+        self.engine = model_engine
+        self.session_local = session_local
+        # 供 handler 使用的异步会话，查询和提交不阻塞事件循环
+        self.async_engine = async_model_engine
+        self.async_session_local = async_session_local
         # # Initialize APScheduler tables first
         # self.init_apscheduler_tables()
         # Then initialize other database tables
@@ -28,19 +35,26 @@ class Init:
         from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 
         # Create a temporary jobstore to initialize tables
-        temp_jobstore = SQLAlchemyJobStore(url=f'sqlite:///{TG_DB_PATH}')
+        temp_jobstore = SQLAlchemyJobStore(engine=self.engine)
         # This will create the necessary tables
         temp_jobstore.start()
 
     def init_apscheduler(self):
         self.async_scheduler = AsyncIOScheduler(
-            jobstores=JOB_STORES,
+            jobstores=get_job_stores(),
             timezone=pytz.timezone('Asia/Shanghai')
         )
 
     def init_db(self):
         Base.metadata.create_all(self.engine)
         self.init_role()
+        self.check_query_plans()
+
+    def check_query_plans(self):
+        """已有数据库不会由 create_all 补建索引，未执行迁移时在启动日志中提示"""
+        from db.query_plan import check_hot_query_plans
+        for problem in check_hot_query_plans(self.engine):
+            logger.warning(f"{problem}，请执行 alembic upgrade head")
 
     def init_role(self):
         with self.session_local() as session:
@@ -1,7 +1,15 @@
-from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
 
-from config.config import TG_DB_PATH
+from db.engine import get_engine, get_async_engine
 
-model_engine = create_engine(f'sqlite:///{TG_DB_PATH}')
+# 进程内共享的引擎，Init、任务存储、定时任务和缓存都使用同一个
+model_engine = get_engine()
+session_local = sessionmaker(autocommit=False, autoflush=False, bind=model_engine)
+
+# 异步引擎（aiosqlite）：SQLite 读写在驱动线程中执行，不阻塞事件循环
+async_model_engine = get_async_engine()
+# 提交后不过期对象，避免在提交后访问属性时触发隐式（同步）懒加载
+async_session_local = async_sessionmaker(async_model_engine, autoflush=False, expire_on_commit=False)
 
 from db.models.ai_config import AIProviderConfig
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, Index
 from sqlalchemy.orm import relationship
 
 from db.models.base import Base, CreateTimeUpdateTimeBase
@@ -27,5 +27,7 @@ class AIProviderConfig(Base, CreateTimeUpdateTimeBase):
     extra_config = Column(String(1024), nullable=True)
 
     __table_args__ = (
+        # 按用户（及提供商）查询配置；默认提供商在按用户取出的配置中判断，不单独按 is_default 查询
+        Index('ix_ai_provider_config_user_id_provider_name', 'user_id', 'provider_name'),
         {'sqlite_autoincrement': True},
     )
\ No newline at end of file
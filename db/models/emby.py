@@ -1,4 +1,4 @@
-from sqlalchemy import Integer, Column, String, ForeignKey
+from sqlalchemy import Integer, Column, String, ForeignKey, DateTime, JSON
 from sqlalchemy.orm import relationship
 
 from db.models.base import Base, CreateTimeUpdateTimeBase
@@ -13,4 +13,22 @@ class EmbyConfig(Base, CreateTimeUpdateTimeBase):
     password = Column(String(256), nullable=False, server_default="admin")
     user_id = Column(Integer, ForeignKey('user.id'), nullable=False, unique=True)
     user = relationship(User)
-    host = Column(String(256), nullable=False)
\ No newline at end of file
+    host = Column(String(256), nullable=False)
+
+
+class EmbyLibrarySync(Base, CreateTimeUpdateTimeBase):
+    """用户 Emby 媒体库的增量同步进度，定时轮询只拉取水位之后新入库的条目"""
+    __tablename__ = 'emby_library_sync'
+
+    user_id = Column(Integer, ForeignKey('user.id'), primary_key=True)
+    # 建立水位时的服务器地址，地址变更后重新建立水位
+    host = Column(String(256), nullable=False)
+    # 已处理条目中最新的 DateCreated（UTC），为空表示尚未建立水位
+    last_date_created = Column(DateTime, nullable=True)
+    # DateCreated 恰好等于水位的条目 id，避免同一时刻入库的条目被重复或遗漏通知
+    last_item_ids = Column(JSON, nullable=True, default=None)
+    synced_at = Column(DateTime, nullable=False)
+    # 连续轮询出错的次数
+    failures = Column(Integer, nullable=False, default=0, server_default='0')
+    # 出错后按退避时间推迟下次轮询，为空表示每轮都轮询
+    next_poll_at = Column(DateTime, nullable=True)
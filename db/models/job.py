@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, ForeignKey, String, TEXT
+from sqlalchemy import Column, Integer, ForeignKey, String, TEXT, Index, text
 from sqlalchemy.orm import relationship
 
 from db.models.base import Base, CreateTimeUpdateTimeBase, DeletedTimeBase
@@ -14,4 +14,13 @@ class UserApschedulerJobs(Base, CreateTimeUpdateTimeBase, DeletedTimeBase):
     user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
     apscheduler_job = relationship(ApschedulerJobs)
     apscheduler_job_id = Column(String, ForeignKey('apscheduler_jobs.id'), nullable=False)
-    description = Column(TEXT, nullable=False)
\ No newline at end of file
+    description = Column(TEXT, nullable=False)
+
+    __table_args__ = (
+        # list_my_job 分页：按用户查询未删除的任务
+        Index('ix_user_apscheduler_jobs_user_id_active', 'user_id', 'id',
+              sqlite_where=text('deleted_at IS NULL')),
+        # 提醒完成回调、调度任务移除监听：按调度任务 id 查询未删除的任务
+        Index('ix_user_apscheduler_jobs_job_id_active', 'apscheduler_job_id',
+              sqlite_where=text('deleted_at IS NULL')),
+    )
@@ -1,6 +1,6 @@
 from sqlalchemy import (
     Column, Integer, String, Text, DateTime,
-    Enum, ForeignKey
+    Enum, ForeignKey, Index
 )
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
@@ -27,3 +27,7 @@ class OperationLog(Base, CreateTimeUpdateTimeBase):
     target_table = Column(String(64), nullable=True)
     target_id = Column(Integer, nullable=True)
     description = Column(Text, nullable=True)
+
+    __table_args__ = (
+        Index('ix_operation_log_user_id_created_at', 'user_id', 'created_at'),
+    )
@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+
+from db.models.base import Base, CreateTimeUpdateTimeBase
+
+
+class QuarkCookieCheck(Base, CreateTimeUpdateTimeBase):
+    """用户夸克 Cookies 的检测状态，跨多次定时检测保留"""
+    __tablename__ = 'quark_cookie_check'
+
+    user_id = Column(Integer, ForeignKey('user.id'), primary_key=True)
+    # 检测时所用 Cookies（加密后）的摘要，用户更新 Cookies 后状态重新开始
+    cookies_digest = Column(String(40), nullable=False)
+    # valid / expired / error
+    state = Column(String(16), nullable=False)
+    # 连续检测出错（网络错误等，不含已过期）的次数，用于退避
+    failures = Column(Integer, nullable=False, default=0, server_default='0')
+    checked_at = Column(DateTime, nullable=False)
+    # 在此时间之前跳过检测
+    next_check_at = Column(DateTime, nullable=True)
+    # 已发送过期通知的时间，同一份 Cookies 只通知一次
+    notified_at = Column(DateTime, nullable=True)
@@ -0,0 +1,20 @@
+from sqlalchemy import Column, String, DateTime, Index
+
+from db.models.base import Base
+
+
+class LinkValidity(Base):
+    """分享链接校验结果缓存"""
+    __tablename__ = 'link_validity'
+
+    url = Column(String(512), primary_key=True)
+    # 有效 / 失效 / 封禁
+    state = Column(String(16), nullable=False)
+    # 校验得到的原始状态文本，展示给用户
+    status = Column(String(256), nullable=False)
+    checked_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_link_validity_expires_at', 'expires_at'),
+    )
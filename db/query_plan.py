@@ -0,0 +1,94 @@
+"""
+热点查询的执行计划检查：对 list_my_job、tag_done_jobs 等高频查询执行 EXPLAIN QUERY PLAN，
+确认走到了预期的索引而不是全表扫描
+
+    python -m db.query_plan
+"""
+import datetime
+import logging
+import sys
+
+from sqlalchemy import select, func
+from sqlalchemy.engine import Engine
+
+from db.models import model_engine
+from db.models.ai_config import AIProviderConfig
+from db.models.emby import EmbyConfig
+from db.models.job import UserApschedulerJobs
+from db.models.log import OperationLog
+from db.models.qas import QuarkAutoDownloadConfig
+
+logger = logging.getLogger(__name__)
+
+
+# 按 INTEGER PRIMARY KEY（rowid）范围查找，不经过二级索引
+ROWID = 'INTEGER PRIMARY KEY'
+
+
+def hot_queries() -> list:
+    """(名称, 查询, 期望使用的索引名或索引名前缀；为元组时每个都要出现)"""
+    # 延迟导入，避免加载数据库模型时引入调度任务模块
+    from utils.job import DoneJobSweeper
+
+    active_jobs = select(UserApschedulerJobs).filter(
+        UserApschedulerJobs.user_id == 1,
+        UserApschedulerJobs.deleted_at.is_(None),
+    )
+    return [
+        ('list_my_job 分页', active_jobs.offset(0).limit(10),
+         'ix_user_apscheduler_jobs_user_id_active'),
+        ('list_my_job 计数', select(func.count()).select_from(active_jobs.subquery()),
+         'ix_user_apscheduler_jobs_user_id_active'),
+        ('tag_done_jobs 取一批', DoneJobSweeper.batch_statement(0, 500), ROWID),
+        ('tag_done_jobs 标记',
+         DoneJobSweeper.tag_statement(1, 500, datetime.datetime(2000, 1, 1)),
+         (ROWID, 'sqlite_autoindex_apscheduler_jobs')),
+        ('提醒完成回调',
+         select(UserApschedulerJobs).filter(
+             UserApschedulerJobs.apscheduler_job_id == 'job', UserApschedulerJobs.deleted_at.is_(None)
+         ),
+         'ix_user_apscheduler_jobs_job_id_active'),
+        ('QAS 配置', select(QuarkAutoDownloadConfig).filter_by(user_id=1),
+         'sqlite_autoindex_qas_config'),
+        ('Emby 配置', select(EmbyConfig).filter_by(user_id=1),
+         'sqlite_autoindex_emby_config'),
+        ('AI 配置', select(AIProviderConfig).filter_by(user_id=1, provider_name='kimi'),
+         'ix_ai_provider_config_user_id_provider_name'),
+        ('操作日志', select(OperationLog).filter_by(user_id=1).order_by(OperationLog.created_at.desc()).limit(20),
+         'ix_operation_log_user_id_created_at'),
+    ]
+
+
+def explain(engine: Engine, statement) -> list[str]:
+    sql = str(statement.compile(engine, compile_kwargs={'literal_binds': True}))
+    with engine.connect() as conn:
+        return [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+def check_hot_query_plans(engine: Engine = model_engine) -> list[str]:
+    """返回未使用预期索引的查询说明，全部命中时返回空列表"""
+    problems = []
+    for name, statement, index_name in hot_queries():
+        try:
+            plan = explain(engine, statement)
+        except Exception as e:
+            problems.append(f"{name}: 无法获取执行计划: {e}")
+            continue
+        logger.debug(f"{name}: {plan}")
+        for index_name in index_name if isinstance(index_name, tuple) else (index_name,):
+            if not any(f"INDEX {index_name}" in line or f"USING {index_name}" in line for line in plan):
+                problems.append(f"{name}: 未使用索引 {index_name}，执行计划: {plan}")
+    return problems
+
+
+def main():
+    problems = check_hot_query_plans()
+    for problem in problems:
+        print(problem)
+    if problems:
+        sys.exit(1)
+    print("热点查询均已使用索引")
+
+
+if __name__ == '__main__':
+    main()
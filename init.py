@@ -4,13 +4,13 @@ import logging
 import pytz
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-from config.config import JOB_STORES
+from db.engine import get_job_stores
 
 logger = logging.getLogger(__name__)
 
 async def main():
     scheduler = AsyncIOScheduler(
-        jobstores=JOB_STORES,
+        jobstores=get_job_stores(),
         timezone=pytz.timezone('Asia/Shanghai')
     )
     scheduler.start()
@@ -2,20 +2,23 @@ import importlib
 import logging
 
 import telegram
+from apscheduler.events import EVENT_JOB_REMOVED
 from apscheduler.triggers.interval import IntervalTrigger
 from sqlalchemy.orm import Session
 from telegram import Update, BotCommandScopeChat
 from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler
 
-from api.base import get_handlers, command, get_bot_commands
-from api.commands import set_commands
-from config.config import TG_BOT_TOKEN, ROLE_COMMANDS, DEFAULT_COMMANDS
+from api.base import get_handlers, command
+from api.commands import set_commands, command_menu_sync
+from config.config import TG_BOT_TOKEN, EMBY_POLL_INTERVAL
 
 from db.main import Init
 from db.models.user import User
 from api.base import commands as all_commands
 from utils.cloud_saver import CloudSaver
 from utils.command_middleware import depends
+from utils.http_pool import http_session_pool
+from utils.telegram_sender import set_application_bot, shutdown_fallback_bot, send_queue
 
 from api import user
 from api import the_movie_db
@@ -27,7 +30,8 @@ from api import emby
 from api import ai_config
 from api import user_config
 
-from utils.job import tag_done_jobs, check_quark_cookies_validity
+from utils.job import tag_done_jobs, tag_removed_job, check_quark_cookies_validity, purge_expired_link_validity, reconcile_command_menus, \
+    poll_emby_libraries, log_cache_stats
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -68,16 +72,10 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Ses
 @command(name='refresh_menu', description="刷新菜单")
 async def refresh_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, user: User):
     logger.info(f"Refresh user {update.effective_user.id} commands")
-    if not user:
-        await context.bot.set_my_commands(DEFAULT_COMMANDS, scope=telegram.BotCommandScopeChat(update.effective_user.id))
-
-    else:
-        bot_commands = get_bot_commands()
-        command_names = ROLE_COMMANDS.get(user.role.name)
-        to_set_commands = list()
-        for command_name in command_names:
-            to_set_commands.append(bot_commands[command_name])
-        await context.bot.set_my_commands(to_set_commands, scope=telegram.BotCommandScopeChat(user.tg_id))
+    # 用户主动刷新时无视已推送记录，强制重新推送
+    await command_menu_sync.sync_user(
+        context.bot, update.effective_user.id, None if user is None else user.role.name, force=True
+    )
 
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -139,49 +137,18 @@ async def help_tips(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     text += "\n<i>💡 提示：点击命令可以直接复制</i>"
 
-    # 如果消息太长，分开发送
-    if len(text) > 4096:
-        # 分割消息
-        parts = []
-        current_part = ""
-        lines = text.split('\n')
-
-        for line in lines:
-            if len(current_part + line + '\n') > 4000:
-                parts.append(current_part)
-                current_part = line + '\n'
-            else:
-                current_part += line + '\n'
-
-        if current_part:
-            parts.append(current_part)
-
-        # 发送第一部分（包含标题和第一组）
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=parts[0],
-            parse_mode="HTML"
-        )
-
-        # 发送剩余部分
-        for part in parts[1:]:
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=part,
-                parse_mode="HTML"
-            )
-    else:
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=text,
-            parse_mode="HTML"
-        )
+    # 超长时按行拆成多条发送
+    await send_queue.send_text(update.effective_chat.id, text, parse_mode="HTML")
 
 async def post_init(app):
+    # 定时任务通过 Application 的 bot 发送消息，复用其 HTTP 连接
+    set_application_bot(app.bot)
+    # 一次性提醒执行完后调度器会移除 job，此时立即标记，定时扫描只做兜底
+    app.bot_data['async_scheduler'].add_listener(tag_removed_job, EVENT_JOB_REMOVED)
     app.bot_data['async_scheduler'].start()
     app.bot_data['async_scheduler'].add_job(
         tag_done_jobs,
-        trigger=IntervalTrigger(minutes=1),
+        trigger=IntervalTrigger(minutes=10),
         id="tag_done_jobs",
         replace_existing=True
     )
@@ -191,6 +158,49 @@ async def post_init(app):
         id="check_quark_cookies_validity",
         replace_existing=True
     )
+    app.bot_data['async_scheduler'].add_job(
+        purge_expired_link_validity,
+        trigger=IntervalTrigger(hours=12),
+        id="purge_expired_link_validity",
+        replace_existing=True
+    )
+    app.bot_data['async_scheduler'].add_job(
+        reconcile_command_menus,
+        trigger=IntervalTrigger(hours=1),
+        id="reconcile_command_menus",
+        replace_existing=True
+    )
+    app.bot_data['async_scheduler'].add_job(
+        log_cache_stats,
+        trigger=IntervalTrigger(hours=1),
+        id="log_cache_stats",
+        replace_existing=True
+    )
+    if EMBY_POLL_INTERVAL > 0:
+        app.bot_data['async_scheduler'].add_job(
+            poll_emby_libraries,
+            trigger=IntervalTrigger(seconds=EMBY_POLL_INTERVAL),
+            id="poll_emby_libraries",
+            replace_existing=True
+        )
+    elif app.bot_data['async_scheduler'].get_job("poll_emby_libraries"):
+        app.bot_data['async_scheduler'].remove_job("poll_emby_libraries")
+    # 启动时在后台全量同步命令菜单，不阻塞开始处理更新
+    app.create_task(_reconcile_command_menus_on_startup(app))
+
+
+async def _reconcile_command_menus_on_startup(app):
+    try:
+        with app.bot_data['db_session_local']() as session:
+            await command_menu_sync.reconcile(app.bot, session)
+    except Exception as e:
+        logger.error(f"启动时同步命令菜单失败: {e}")
+
+
+async def post_stop(app: telegram.ext.Application):
+    """bot 关闭前发完队列中剩余的消息"""
+    await send_queue.close()
+    logger.info(f"Send queue closed: {send_queue.stats()}")
 
 
 async def post_shutdown(app: telegram.ext.Application):
@@ -203,11 +213,27 @@ async def post_shutdown(app: telegram.ext.Application):
         scheduler.shutdown()
         logger.info("Scheduler shutdown complete")
 
-    # 关闭 CloudSaver 的 ClientSession
+    # 解除定时任务对 Application bot 的引用
+    set_application_bot(None)
+    await shutdown_fallback_bot()
+
+    # 清理 CloudSaver 登录状态
     cloud_saver = app.bot_data.get('cloud_saver')
     if cloud_saver:
         await cloud_saver.close()
-        logger.info("CloudSaver session closed")
+        logger.info("CloudSaver closed")
+
+    # 关闭进程级 HTTP 会话池
+    http_pool = app.bot_data.get('http_session_pool')
+    if http_pool:
+        await http_pool.close()
+        logger.info("HTTP session pool closed")
+
+    # 释放异步数据库引擎的连接（aiosqlite 连接线程）
+    async_engine = app.bot_data.get('db_async_engine')
+    if async_engine:
+        await async_engine.dispose()
+        logger.info("Async database engine disposed")
 
 if __name__ == '__main__':
     init = Init()
@@ -216,12 +242,16 @@ if __name__ == '__main__':
     application = ApplicationBuilder()\
         .token(TG_BOT_TOKEN)\
         .post_init(post_init)\
+        .post_stop(post_stop)\
         .post_shutdown(post_shutdown)\
         .concurrent_updates(True)\
         .build()
 
     application.bot_data['db_session_local'] = init.session_local
+    application.bot_data['db_async_engine'] = init.async_engine
+    application.bot_data['db_async_session_local'] = init.async_session_local
     application.bot_data['cloud_saver'] = cloud_saver
+    application.bot_data['http_session_pool'] = http_session_pool
     application.bot_data['async_scheduler'] = init.async_scheduler
 
     application.add_handler(CommandHandler('start', depends()(start)))
@@ -4,8 +4,12 @@ from typing import Optional
 
 import aiohttp
 
+from utils.http_pool import http_session_pool
+
 logger = logging.getLogger(__name__)
 
+AI_CHAT_TIMEOUT = aiohttp.ClientTimeout(total=90)
+
 def get_ai_config_from_db(session=None, user_id: int = None) -> Optional[dict]:
     """从数据库获取AI配置（适配新的表结构）"""
     if not session or not user_id:
@@ -92,17 +96,16 @@ async def openapi_chat(role: str, prompt: str, host: str = None, api_key: str =
         "Authorization": f"Bearer {api_key}",
     }
     try:
-        timeout = aiohttp.ClientTimeout(total=90)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(url=host, headers=headers, json=data) as resp:
-                if resp.status != 200:
-                    error_text = await resp.text()
-                    logger.error(f'[{resp.status}] ai chat error: {error_text}')
-                    print(prompt)
-                    return None
-                json_data = await resp.json()
-                result = json_data['choices'][0]['message']['content']
-                return result
+        session = http_session_pool.get(host, timeout=AI_CHAT_TIMEOUT)
+        async with session.post(url=host, headers=headers, json=data) as resp:
+            if resp.status != 200:
+                error_text = await resp.text()
+                logger.error(f'[{resp.status}] ai chat error: {error_text}')
+                print(prompt)
+                return None
+            json_data = await resp.json()
+            result = json_data['choices'][0]['message']['content']
+            return result
 
     except Exception as e:
         logger.error(f'ai chat error: {e}')
@@ -0,0 +1,116 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+
+def hit_rate(hits: int, total: int) -> float:
+    return round(hits / total, 4) if total else 0.0
+
+
+class TTLCache:
+    """
+    OrderedDict 实现的 LRU + TTL 缓存，所有操作加锁，可在线程池中使用
+
+    - 条目在 ttl 秒后过期，set 时可为单个条目指定有效期
+    - 超过 size 条时淘汰最久未使用的，size 为 None 表示不限
+    - keep_stale=False 时 get 遇到过期条目直接删除；为 True 时保留，
+      peek 仍可取到，用于带 ETag 重新验证
+    """
+
+    def __init__(self, ttl: float, size: Optional[int] = None, keep_stale: bool = False):
+        self.ttl = ttl
+        self.size = size
+        self.keep_stale = keep_stale
+        # key -> (value, expires_at)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """返回未过期的值，未缓存或已过期时返回 default"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None and not self.keep_stale:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, key, default=None):
+        """返回缓存的值（包括已过期的），不计入命中统计"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return default if entry is None else entry[0]
+
+    def set(self, key, value, ttl: float = None):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._entries.move_to_end(key)
+            if self.size is not None:
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return default if entry is None else entry[0]
+
+    def remove_if(self, predicate: Callable) -> int:
+        """删除 predicate(key, value) 为真的条目，返回删除条数"""
+        with self._lock:
+            keys = [key for key, (value, _) in self._entries.items() if predicate(key, value)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': hit_rate(self.hits, self.hits + self.misses),
+        }
+
+
+class SingleFlight:
+    """
+    相同键的并发调用只执行一次，其余调用等待同一结果
+
+    执行放在独立的任务中，等待的调用方被取消不会中断执行，也不影响其他等待者
+    """
+
+    def __init__(self):
+        self._tasks = dict()
+
+    def __contains__(self, key):
+        return key in self._tasks
+
+    async def run(self, key, factory: Callable[[], Awaitable]):
+        """
+        Args:
+            key: 去重键
+            factory: 无参函数，返回要执行的协程；已有相同键在执行时不会调用
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._tasks.pop(key, None) if self._tasks.get(key) is t else None)
+        return await asyncio.shield(task)
+
+    def forget(self, key):
+        """之后的调用不再等待正在执行的任务，而是重新执行"""
+        self._tasks.pop(key, None)
@@ -1,122 +1,76 @@
-import asyncio
 import logging
 from collections import defaultdict
-from datetime import datetime, timedelta
 from html import escape
 
-import aiohttp
-
 from config.config import CLOUD_SAVER_HOST, CLOUD_SAVER_USERNAME, CLOUD_SAVER_PASSWORD, CLOUD_TYPE_MAP
+from utils.http_pool import http_session_pool
+from utils.search_cache import search_result_cache
 
 logger = logging.getLogger(__name__)
 
 class CloudSaver:
-    # 会话最大存活时间：1小时
-    _SESSION_MAX_AGE = timedelta(hours=1)
-
     def __init__(self):
         self.username = CLOUD_SAVER_USERNAME
         self.password = CLOUD_SAVER_PASSWORD
         self.host = CLOUD_SAVER_HOST
-        self._session = None
-        self._session_created_at = None
         self._token = None
         self.cloud_type_map = CLOUD_TYPE_MAP
 
     async def _get_session(self):
-        """获取或创建会话，支持会话过期自动重建"""
-        # 检查会话是否需要重新创建
-        need_new_session = (
-            self._session is None or
-            self._session_created_at is None or
-            self._session.closed or
-            datetime.now() - self._session_created_at > self._SESSION_MAX_AGE
-        )
-
-        if need_new_session:
-            # 关闭旧会话（如果存在）
-            if self._session and not self._session.closed:
-                try:
-                    await self._session.close()
-                except Exception:
-                    pass
-
-            # 创建新会话，添加超时和连接器配置
-            timeout = aiohttp.ClientTimeout(
-                total=30,        # 总超时 30 秒
-                connect=10,      # 连接超时 10 秒
-                sock_read=20     # 读取超时 20 秒
-            )
-
-            connector = aiohttp.TCPConnector(
-                limit=100,           # 最大连接数
-                limit_per_host=30,   # 每个主机的最大连接数
-                ttl_dns_cache=300,   # DNS 缓存 5 分钟
-                force_close=False,   # 使用 HTTP keep-alive
-                enable_cleanup_closed=True  # 清理关闭的连接
-            )
-
-            self._session = aiohttp.ClientSession(
-                timeout=timeout,
-                connector=connector
-            )
-            self._session_created_at = datetime.now()
-
-        return self._session
+        """从进程级会话池获取到 CloudSaver 服务的会话"""
+        return http_session_pool.get(self.host)
 
     async def _get_token(self):
         """获取认证令牌，如果令牌过期则重新获取"""
         if self._token is None:
-            async with await self._get_session() as session:
-                async with session.post(
-                    f'{self.host}/api/user/login',
-                    json={'username': self.username, 'password': self.password}
-                ) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        self._token = data.get('data', {}).get('token')
+            session = await self._get_session()
+            async with session.post(
+                f'{self.host}/api/user/login',
+                json={'username': self.username, 'password': self.password}
+            ) as resp:
+                if resp.status == 200:
+                    data = await resp.json()
+                    self._token = data.get('data', {}).get('token')
         return self._token
 
     async def close(self):
-        """关闭会话并清理资源"""
-        if self._session and not self._session.closed:
-            try:
-                await self._session.close()
-                await asyncio.sleep(0.1)
-            except Exception:
-                pass
-            finally:
-                self._session = None
-                self._session_created_at = None
-                self._token = None
+        """清理登录状态，会话由进程级会话池统一关闭"""
+        self._token = None
 
     async def get(self, url, params=None):
         token = await self._get_token()
-        async with await self._get_session() as session:
-            async with session.get(
-                url=f'{self.host}/{url}',
-                params=params,
-                headers={'Authorization': f'Bearer {token}'}
-            ) as resp:
-                logger.info(f"{resp.status}: {resp.reason}")
-                # 处理 401 未授权错误，清除token并重试一次
-                if resp.status == 401:
-                    logger.warning("Token已过期或无效，尝试重新获取")
-                    self._token = None
-                    token = await self._get_token()
-                    async with session.get(
-                        url=f'{self.host}/{url}',
-                        params=params,
-                        headers={'Authorization': f'Bearer {token}'}
-                    ) as retry_resp:
-                        logger.info(f"重试后状态码: {retry_resp.status}")
-                        data = await retry_resp.json()
-                        return data
-                data = await resp.json()
-                return data
-
-    async def search(self, search_content):
-        return await self.get('/api/search', {'keyword': search_content})
+        session = await self._get_session()
+        async with session.get(
+            url=f'{self.host}/{url}',
+            params=params,
+            headers={'Authorization': f'Bearer {token}'}
+        ) as resp:
+            logger.info(f"{resp.status}: {resp.reason}")
+            # 处理 401 未授权错误，清除token并重试一次
+            if resp.status == 401:
+                logger.warning("Token已过期或无效，尝试重新获取")
+                self._token = None
+                token = await self._get_token()
+                async with session.get(
+                    url=f'{self.host}/{url}',
+                    params=params,
+                    headers={'Authorization': f'Bearer {token}'}
+                ) as retry_resp:
+                    logger.info(f"重试后状态码: {retry_resp.status}")
+                    data = await retry_resp.json()
+                    return data
+            data = await resp.json()
+            return data
+
+    async def search(self, search_content, use_cache=True):
+        if not use_cache:
+            return await self.get('/api/search', {'keyword': search_content})
+        return await search_result_cache.get(
+            'cloud_saver',
+            search_content,
+            lambda: self.get('/api/search', {'keyword': search_content}),
+            cacheable=lambda data: isinstance(data, dict) and bool(data.get('data'))
+        )
 
     async def format_links_by_channel(self, data):
         result = []
@@ -1,30 +1,179 @@
+import logging
+import time
 from functools import wraps
-from typing import Optional
+from typing import Optional, NamedTuple
 
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
 from telegram import Update
 from telegram.ext import ContextTypes
+
+from config.config import USER_IDENTITY_CACHE_TTL
 from db.models.user import User
+from utils.cache import hit_rate
+
+logger = logging.getLogger(__name__)
+
+
+class UserIdentity(NamedTuple):
+    user_id: int
+    role_name: str
+
+
+class UserIdentityCache:
+    """
+    tg_id -> 用户身份的进程内缓存，未注册的 tg_id 也会缓存（负缓存）
+
+    只缓存用户 id 和角色，用户配置每次随用户按主键加载；register、set_admin 后需调用 invalidate
+    """
+    MISSING = object()
+
+    def __init__(self, ttl: int = USER_IDENTITY_CACHE_TTL):
+        self.ttl = ttl
+        # tg_id -> (UserIdentity 或 None, expires_at)
+        self._entries = dict()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, tg_id):
+        """返回 UserIdentity；已知未注册返回 None；未缓存或已过期返回 MISSING"""
+        entry = self._entries.get(int(tg_id))
+        if entry is None or entry[1] < time.monotonic():
+            self.misses += 1
+            return self.MISSING
+        if entry[0] is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return entry[0]
+
+    def set(self, tg_id, user: Optional[User]):
+        identity = None if user is None else UserIdentity(
+            user_id=user.id,
+            role_name=user.role.name,
+        )
+        self._entries[int(tg_id)] = (identity, time.monotonic() + self.ttl)
+        return identity
+
+    def invalidate(self, *tg_ids):
+        for tg_id in tg_ids:
+            self._entries.pop(int(tg_id), None)
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.negative_hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_rate': hit_rate(self.hits + self.negative_hits, total),
+        }
+
+
+user_identity_cache = UserIdentityCache()
+
 
+def load_user(session: Session, tg_id, identity=UserIdentityCache.MISSING) -> Optional[User]:
+    """
+    按 tg_id 加载用户
 
-def depends(allowed_roles: Optional[list[str]]=None):
+    identity 为缓存中的身份时只按主键加载用户，角色在用到时再懒加载；
+    为 MISSING 时按 tg_id 查询并预加载角色，结果写入身份缓存
+    """
+    if identity is None:
+        return None
+    if identity is not UserIdentityCache.MISSING:
+        user = session.get(User, identity.user_id)
+        if user is not None and user.tg_id == int(tg_id):
+            return user
+        # 缓存的用户已被删除或变更，下次请求回源查询
+        user_identity_cache.invalidate(tg_id)
+        return None
+
+    user = session.query(User).options(joinedload(User.role)).filter_by(tg_id=str(tg_id)).first()
+    user_identity_cache.set(tg_id, user)
+    return user
+
+
+async def load_user_async(session: AsyncSession, tg_id, identity=UserIdentityCache.MISSING) -> Optional[User]:
+    """load_user 的异步版本，AsyncSession 不能懒加载，角色总是预加载"""
+    if identity is None:
+        return None
+    if identity is not UserIdentityCache.MISSING:
+        user = await session.get(User, identity.user_id, options=[joinedload(User.role)])
+        if user is not None and user.tg_id == int(tg_id):
+            return user
+        # 缓存的用户已被删除或变更，下次请求回源查询
+        user_identity_cache.invalidate(tg_id)
+        return None
+
+    user = (await session.execute(
+        select(User).options(joinedload(User.role)).filter_by(tg_id=str(tg_id))
+    )).scalars().first()
+    user_identity_cache.set(tg_id, user)
+    return user
+
+
+async def _authorize(allowed_roles, update: Update, context: ContextTypes.DEFAULT_TYPE, role_name: Optional[str]) -> bool:
+    # 只在该用户期望的菜单与上次推送的不同时才调用 Telegram API
+    from api.commands import command_menu_sync
+    user_id = update.effective_user.id
+    try:
+        await command_menu_sync.sync_user(context.bot, user_id, role_name)
+    except Exception as e:
+        logger.warning(f"同步用户 {user_id} 命令菜单失败: {e}")
+
+    if not allowed_roles or role_name in allowed_roles:
+        return True
+    await update.effective_message.reply_text("你没有权限执行此操作。")
+    return False
+
+
+async def _call_handler(func, allowed_roles, authorized: bool, update: Update, context: ContextTypes.DEFAULT_TYPE, session, user, *args, **kwargs):
+    if not authorized:
+        # 身份未缓存，用刚查出的用户校验
+        if not await _authorize(allowed_roles, update, context, None if user is None else user.role.name):
+            return
+    elif allowed_roles and user is None:
+        # 已按缓存的身份放行，但该用户已不存在
+        await update.effective_message.reply_text("你没有权限执行此操作。")
+        return
+    return await func(update, context, session, user, *args, **kwargs)
+
+
+def depends(allowed_roles: Optional[list[str]]=None, async_session: bool = False):
+    """
+    注入数据库会话和当前用户，并校验角色权限
+
+    Args:
+        allowed_roles: 允许执行的角色，为空表示不限制
+        async_session: 为 True 时注入 AsyncSession，handler 中通过 await 执行查询和提交；
+            关联对象需在查询时预加载，不能依赖懒加载
+    """
     def decorator(func):
         @wraps(func)
         async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+            user_id = str(update.effective_user.id)
+            # 身份已缓存时直接用缓存的角色同步菜单、校验权限，无权限时不打开数据库会话
+            identity = user_identity_cache.get(user_id)
+            authorized = identity is not UserIdentityCache.MISSING
+            if authorized and not await _authorize(
+                    allowed_roles, update, context, None if identity is None else identity.role_name):
+                return
+
+            if async_session:
+                async with context.bot_data['db_async_session_local']() as session:
+                    user = await load_user_async(session, user_id, identity)
+                    return await _call_handler(func, allowed_roles, authorized, update, context, session, user, *args, **kwargs)
+
             SessionLocal = context.bot_data['db_session_local']
             with SessionLocal() as session:
-                user_id = str(update.effective_user.id)
-                user = session.query(User).filter_by(tg_id=user_id).first()
-
-                from api.commands import set_commands
-                await set_commands(update, context, session, None if user is None else [user])
-
-                if not allowed_roles:
-                    return await func(update, context, session, user, *args, **kwargs)
-                elif user and user.role.name in allowed_roles:
-                    return await func(update, context, session, user, *args, **kwargs)
-                else:
-                    await update.effective_message.reply_text("你没有权限执行此操作。")
-                    return
+                user = load_user(session, user_id, identity)
+                return await _call_handler(func, allowed_roles, authorized, update, context, session, user, *args, **kwargs)
         return wrapper
     return decorator
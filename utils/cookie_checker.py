@@ -0,0 +1,231 @@
+import asyncio
+import datetime
+import hashlib
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+
+from config.config import QUARK_COOKIE_CHECK_CONCURRENCY, QUARK_COOKIE_CHECK_RATE, QUARK_COOKIE_CHECK_RETRIES, \
+    QUARK_COOKIE_CHECK_BACKOFF, QUARK_COOKIE_CHECK_MAX_BACKOFF, QUARK_COOKIE_EXPIRED_RECHECK
+from db.models import session_local
+from db.models.quark import QuarkCookieCheck
+from db.models.user import User
+from utils.crypto import decrypt_many
+from utils.http_pool import get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+STATE_VALID = 'valid'
+STATE_EXPIRED = 'expired'
+STATE_ERROR = 'error'
+
+QUARK_ACCOUNT_URL = "https://pan.quark.cn/account/info"
+# 每次从数据库读取的用户数，读完即关闭会话
+_PAGE_SIZE = 100
+# 检测结果攒够一批再写入
+_WRITE_CHUNK_SIZE = 100
+
+EXPIRED_MESSAGE = (
+    "⚠️ <b>夸克网盘 Cookies 已过期</b>\n\n"
+    "您的夸克网盘 Cookies 已失效，请重新配置。\n"
+    "使用 /upsert_configuration 命令更新「夸克网盘」Cookies。"
+)
+
+
+def cookies_digest(encrypted_cookies: str) -> str:
+    return hashlib.sha1(encrypted_cookies.encode()).hexdigest()
+
+
+class QuarkCookieChecker:
+    """
+    并发检测所有用户的夸克 Cookies
+
+    用户按 id 分页读取，每页使用独立的短会话；检测由固定数量的 worker 并发执行，
+    并共用夸克接口的令牌桶限流。每个用户的检测状态保存在 quark_cookie_check 表中：
+    检测出错按指数退避推迟下次检测，已过期的 Cookies 只通知一次，用户更新 Cookies 后状态重新开始
+    """
+
+    def __init__(self, concurrency: int = QUARK_COOKIE_CHECK_CONCURRENCY, retries: int = QUARK_COOKIE_CHECK_RETRIES,
+                 rate: float = QUARK_COOKIE_CHECK_RATE):
+        self.concurrency = concurrency
+        self.retries = retries
+        self.rate = rate
+
+    @staticmethod
+    def _iter_user_pages():
+        """按 id 分页读取配置了夸克 Cookies 的用户及其上次检测状态"""
+        last_id = 0
+        while True:
+            with session_local() as session:
+                users = session.execute(
+                    select(User.id, User.username, User.chat_id, User.configuration).filter(
+                        User.id > last_id,
+                        User.configuration.isnot(None),
+                    ).order_by(User.id).limit(_PAGE_SIZE)
+                ).all()
+                if not users:
+                    return
+                states = {
+                    state.user_id: {
+                        'cookies_digest': state.cookies_digest,
+                        'state': state.state,
+                        'failures': state.failures,
+                        'next_check_at': state.next_check_at,
+                        'notified_at': state.notified_at,
+                    }
+                    for state in session.scalars(
+                        select(QuarkCookieCheck).filter(QuarkCookieCheck.user_id.in_([user.id for user in users]))
+                    )
+                }
+            last_id = users[-1].id
+            yield [(user, states.get(user.id)) for user in users]
+
+    async def _check_account(self, cookies: str) -> str:
+        """返回 STATE_*；重试 retries 次均明确返回无账户信息才判定为过期，其间出现异常则为检测出错"""
+        from utils.quark import Quark
+        quark = Quark(cookies=cookies)
+        limiter = get_rate_limiter(QUARK_ACCOUNT_URL, self.rate, max(1, int(self.rate)))
+        last_error = None
+        for attempt in range(self.retries):
+            if attempt:
+                await asyncio.sleep(random.uniform(1, 2) * 2 ** (attempt - 1))
+            await limiter.acquire()
+            try:
+                if await quark.get_account_info(raise_error=True):
+                    return STATE_VALID
+            except Exception as e:
+                last_error = e
+        if last_error is not None:
+            logger.warning(f"夸克 Cookies 检测出错: {last_error}")
+            return STATE_ERROR
+        return STATE_EXPIRED
+
+    async def _process(self, user, cookies: Optional[str], previous: Optional[dict], digest: str, notify,
+                       summary: dict) -> dict:
+        try:
+            state = await self._check_account(cookies) if cookies else STATE_ERROR
+        except Exception as e:
+            logger.error(f"检查用户 {user.username} (ID: {user.id}) 的夸克 Cookies 时出错: {e}")
+            state = STATE_ERROR
+
+        now = datetime.datetime.utcnow()
+        row = {
+            'user_id': user.id,
+            'cookies_digest': digest,
+            'state': state,
+            'failures': 0,
+            'checked_at': now,
+            'next_check_at': None,
+            'notified_at': previous['notified_at'] if previous else None,
+        }
+        if state == STATE_VALID:
+            row['notified_at'] = None
+            summary['valid'] += 1
+            logger.info(f"用户 {user.username} (ID: {user.id}) 的夸克网盘 Cookies 有效")
+        elif state == STATE_EXPIRED:
+            row['next_check_at'] = now + datetime.timedelta(seconds=QUARK_COOKIE_EXPIRED_RECHECK)
+            summary['expired'] += 1
+            logger.warning(f"用户 {user.username} (ID: {user.id}) 的夸克网盘 Cookies 已过期")
+            if row['notified_at'] is None:
+                try:
+                    await notify(EXPIRED_MESSAGE, user.chat_id)
+                    row['notified_at'] = now
+                    summary['notified'] += 1
+                except Exception as e:
+                    logger.error(f"通知用户 {user.username} (ID: {user.id}) Cookies 过期失败: {e}")
+        else:
+            row['failures'] = (previous['failures'] if previous else 0) + 1
+            backoff = min(QUARK_COOKIE_CHECK_BACKOFF * 2 ** (row['failures'] - 1), QUARK_COOKIE_CHECK_MAX_BACKOFF)
+            row['next_check_at'] = now + datetime.timedelta(seconds=backoff)
+            summary['errors'] += 1
+        return row
+
+    @staticmethod
+    def _save(rows: list):
+        if not rows:
+            return
+        try:
+            with session_local() as session:
+                statement = insert(QuarkCookieCheck).values(rows)
+                session.execute(statement.on_conflict_do_update(
+                    index_elements=[QuarkCookieCheck.user_id],
+                    set_={
+                        'cookies_digest': statement.excluded.cookies_digest,
+                        'state': statement.excluded.state,
+                        'failures': statement.excluded.failures,
+                        'checked_at': statement.excluded.checked_at,
+                        'next_check_at': statement.excluded.next_check_at,
+                        'notified_at': statement.excluded.notified_at,
+                        'updated_at': statement.excluded.checked_at,
+                    }
+                ))
+                session.commit()
+        except Exception as e:
+            logger.error(f"保存夸克 Cookies 检测状态失败: {e}")
+
+    async def run(self, notify: Callable[[str, int], Awaitable]) -> dict:
+        """
+        执行一轮检测
+
+        Args:
+            notify: 发送过期通知的协程函数，参数为 (message, chat_id)
+
+        Returns:
+            本轮汇总：checked / valid / expired / errors / skipped / notified / duration
+        """
+        started_at = time.monotonic()
+        summary = dict(checked=0, valid=0, expired=0, errors=0, skipped=0, notified=0)
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        pending_rows = list()
+
+        async def worker():
+            while True:
+                user, cookies, previous, digest = await queue.get()
+                try:
+                    pending_rows.append(await self._process(user, cookies, previous, digest, notify, summary))
+                    summary['checked'] += 1
+                    if len(pending_rows) >= _WRITE_CHUNK_SIZE:
+                        self._save(pending_rows[:])
+                        pending_rows.clear()
+                except Exception as e:
+                    logger.error(f"检查用户 {user.username} (ID: {user.id}) 的夸克 Cookies 时出错: {e}")
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            now = datetime.datetime.utcnow()
+            for page in self._iter_user_pages():
+                due = list()
+                for user, state in page:
+                    encrypted_cookies = (user.configuration or {}).get('quark_cookies')
+                    if not encrypted_cookies:
+                        continue
+                    digest = cookies_digest(encrypted_cookies)
+                    # Cookies 已更新时丢弃旧状态
+                    previous = state if state and state['cookies_digest'] == digest else None
+                    if previous and previous['next_check_at'] and previous['next_check_at'] > now:
+                        summary['skipped'] += 1
+                        continue
+                    due.append((user, encrypted_cookies, previous, digest))
+                # 整页一次解密，解密失败的按检测出错处理
+                decrypted = decrypt_many([item[1] for item in due], ignore_errors=True, use_cache=False)
+                for user, encrypted_cookies, previous, digest in due:
+                    await queue.put((user, decrypted.get(encrypted_cookies), previous, digest))
+            await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self._save(pending_rows)
+
+        summary['duration'] = round(time.monotonic() - started_at, 2)
+        logger.info(f"夸克 Cookies 检测完成: {summary}")
+        return summary
+
+
+quark_cookie_checker = QuarkCookieChecker()
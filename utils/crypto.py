@@ -1,9 +1,15 @@
 import base64
+import hashlib
 import os
+from typing import Iterable, Optional
+
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
+from config.config import DECRYPT_CACHE_TTL, DECRYPT_CACHE_SIZE
+from utils.cache import TTLCache
+
 
 class CryptoManager:
     """加密管理器，用于加密和解密敏感数据"""
@@ -81,6 +87,44 @@ class CryptoManager:
         return base64.urlsafe_b64encode(self.salt).decode()
 
 
+class DecryptedCache:
+    """
+    密文 -> 明文的进程内缓存
+
+    以密文的 SHA-256 摘要为键，不在内存中保留密文本身；条目在 ttl 秒后过期，
+    超过 size 条时淘汰最久未使用的。修改配置后需调用 invalidate 或 clear
+    """
+
+    def __init__(self, ttl: int = DECRYPT_CACHE_TTL, size: int = DECRYPT_CACHE_SIZE):
+        # digest -> 明文
+        self._entries = TTLCache(ttl, size)
+
+    @staticmethod
+    def _digest(encrypted_data: str) -> str:
+        return hashlib.sha256(encrypted_data.encode()).hexdigest()
+
+    def get(self, encrypted_data: str) -> Optional[str]:
+        return self._entries.get(self._digest(encrypted_data))
+
+    def set(self, encrypted_data: str, data: str):
+        if self._entries.ttl <= 0:
+            return
+        self._entries.set(self._digest(encrypted_data), data)
+
+    def invalidate(self, *encrypted_data: str):
+        for item in encrypted_data:
+            if item:
+                self._entries.pop(self._digest(item))
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return self._entries.stats()
+
+
+decrypted_cache = DecryptedCache()
+
 # 全局加密管理器实例
 crypto_manager = None
 
@@ -121,5 +165,38 @@ def decrypt_sensitive_data(encrypted_data: str) -> str:
     """
     if not encrypted_data:
         return encrypted_data
-    manager = get_crypto_manager()
-    return manager.decrypt(encrypted_data)
\ No newline at end of file
+    data = decrypted_cache.get(encrypted_data)
+    if data is None:
+        data = get_crypto_manager().decrypt(encrypted_data)
+        decrypted_cache.set(encrypted_data, data)
+    return data
+
+
+def decrypt_many(encrypted_items: Iterable[str], ignore_errors: bool = False, use_cache: bool = True) -> dict:
+    """
+    批量解密，相同的密文只解密一次
+
+    Args:
+        encrypted_items: 加密的字符串数据
+        ignore_errors: 为 True 时解密失败的密文不出现在结果中，否则抛出 ValueError
+        use_cache: 为 False 时不读写解密缓存，用于遍历所有用户的批量任务，避免把全部密钥留在内存中
+
+    Returns:
+        {密文: 明文}
+    """
+    decrypt = decrypt_sensitive_data if use_cache else get_crypto_manager().decrypt
+    result = dict()
+    for encrypted_data in dict.fromkeys(encrypted_items):
+        if not encrypted_data:
+            continue
+        try:
+            result[encrypted_data] = decrypt(encrypted_data)
+        except ValueError:
+            if not ignore_errors:
+                raise
+    return result
+
+
+def forget_decrypted(*encrypted_data: str):
+    """配置被修改或删除后，清除旧密文对应的解密缓存"""
+    decrypted_cache.invalidate(*encrypted_data)
\ No newline at end of file
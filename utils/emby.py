@@ -1,106 +1,143 @@
 import asyncio
+import copy
+import datetime
 import logging
 import pprint
-from datetime import datetime, timedelta
+import time
 
-import aiohttp
+from config.config import EMBY_ADMIN_USER_CACHE_TTL, EMBY_ACCESS_TOKEN_TTL, EMBY_NOTIFICATION_SNAPSHOT_TTL
+from utils.http_pool import http_session_pool
 
 logger = logging.getLogger(__name__)
 
-class Emby:
-    # 会话最大存活时间：1小时
-    _SESSION_MAX_AGE = timedelta(hours=1)
+# 按 Ids 批量查询元数据时每个请求的条目数，避免 URL 过长
+_IDS_CHUNK_SIZE = 50
+# host -> (管理员用户 id, expires_at)
+_admin_user_ids = dict()
+# (host, username) -> (access_token, expires_at)
+_access_tokens = dict()
+_auth_locks = dict()
+# 通知配置是服务器级的，同一服务器的所有用户共用一份快照
+# host -> (通知配置列表, expires_at)
+_notification_snapshots = dict()
+_notification_locks = dict()
+
+
+class EmbyUnauthorizedError(Exception):
+    """Emby 返回 401，access token 已失效"""
 
+
+def forget_emby_session(host, username=None):
+    """Emby 配置修改后清除该服务器（及用户）缓存的 access token，以及该服务器的通知快照和管理员 id"""
+    for key in [key for key in _access_tokens if key[0] == host and (username is None or key[1] == username)]:
+        del _access_tokens[key]
+    _notification_snapshots.pop(host, None)
+    _admin_user_ids.pop(host, None)
+
+class Emby:
     def __init__(self, host, token):
         self.host = host
         self.token = token
-        self._session = None
-        self._session_created_at = None
 
     async def _get_session(self):
-        """获取或创建会话，支持会话过期自动重建"""
-        # 检查会话是否需要重新创建
-        need_new_session = (
-            self._session is None or
-            self._session_created_at is None or
-            self._session.closed or
-            datetime.now() - self._session_created_at > self._SESSION_MAX_AGE
-        )
-
-        if need_new_session:
-            # 关闭旧会话（如果存在）
-            if self._session and not self._session.closed:
-                try:
-                    await self._session.close()
-                except Exception as e:
-                    logger.warning(f"关闭旧会话时出错: {e}")
-
-            # 创建新会话，添加超时和连接器配置
-            timeout = aiohttp.ClientTimeout(
-                total=30,        # 总超时 30 秒
-                connect=10,      # 连接超时 10 秒
-                sock_read=20     # 读取超时 20 秒
-            )
-
-            connector = aiohttp.TCPConnector(
-                limit=100,           # 最大连接数
-                limit_per_host=30,   # 每个主机的最大连接数
-                ttl_dns_cache=300,   # DNS 缓存 5 分钟
-                force_close=False,   # 使用 HTTP keep-alive
-                enable_cleanup_closed=True  # 清理关闭的连接
-            )
-
-            self._session = aiohttp.ClientSession(
-                timeout=timeout,
-                connector=connector
-            )
-            self._session_created_at = datetime.now()
-            logger.debug("已创建新的 Emby HTTP 会话")
-
-        return self._session
-
-    async def close(self):
-        """关闭会话并清理资源"""
-        if self._session and not self._session.closed:
-            try:
-                await self._session.close()
-                await asyncio.sleep(0.1)
-            except Exception as e:
-                logger.warning(f"关闭会话时出错: {e}")
-            finally:
-                self._session = None
-                self._session_created_at = None
+        """从进程级会话池获取到 Emby 服务的会话"""
+        return http_session_pool.get(self.host)
 
     async def get_access_token(self, username, password):
-        user_id = await self.get_id_by_username(username)
-        authentication_data = await self.authenticate_by_id_pwd(user_id, password)
-        access_token = authentication_data['AccessToken']
-        return access_token
+        """
+        用户登录的 access token，按 (服务器地址, 用户名) 缓存 EMBY_ACCESS_TOKEN_TTL 秒
+
+        同一用户的并发调用只登录一次，登录失败返回 None
+        """
+        key = (self.host, username)
+        entry = _access_tokens.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        lock = _auth_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = _access_tokens.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                return entry[0]
+            user_id = await self.get_id_by_username(username)
+            if user_id is None:
+                logger.error(f"Emby user {username} not found")
+                return None
+            authentication_data = await self.authenticate_by_id_pwd(user_id, password)
+            if not authentication_data:
+                return None
+            access_token = authentication_data['AccessToken']
+            _access_tokens[key] = (access_token, time.monotonic() + EMBY_ACCESS_TOKEN_TTL)
+            return access_token
+
+    def invalidate_access_token(self, username, access_token=None):
+        """丢弃缓存的 access token；传入 access_token 时仅当缓存的仍是它才丢弃，避免并发重复登录"""
+        key = (self.host, username)
+        entry = _access_tokens.get(key)
+        if entry is not None and (access_token is None or entry[0] == access_token):
+            del _access_tokens[key]
+
+    async def _with_access_token(self, username, password, call):
+        """用缓存的 access token 执行 call(access_token)，返回 401 时重新登录并重试一次"""
+        access_token = await self.get_access_token(username, password)
+        if access_token is None:
+            return None
+        try:
+            return await call(access_token)
+        except EmbyUnauthorizedError:
+            logger.info(f"Emby access token of {username} expired, re-authenticating")
+            self.invalidate_access_token(username, access_token)
+        access_token = await self.get_access_token(username, password)
+        if access_token is None:
+            return None
+        try:
+            return await call(access_token)
+        except EmbyUnauthorizedError:
+            logger.error(f"Emby access token of {username} rejected after re-authentication")
+            return None
 
     async def list_resource(self, resource_name):
-        async with await self._get_session() as session:
-            async with session.get(
-                f"{self.host}/emby/Items",
-                params={
-                    'Recursive': 'true',
-                    'SearchTerm': resource_name,
-                    'IncludeItemTypes': "Series",
-                    'EnableImages': 'true',
-                    'api_key': self.token,
-                }
-            ) as resp:
-                if 300 > resp.status >= 200:
-                    return await resp.json()
-                else:
-                    error_text = await resp.text()
-                    logger.error(f"Emby.list_resource: {error_text}")
-                    return None
+        session = await self._get_session()
+        async with session.get(
+            f"{self.host}/emby/Items",
+            params={
+                'Recursive': 'true',
+                'SearchTerm': resource_name,
+                'IncludeItemTypes': "Series",
+                'EnableImages': 'true',
+                'api_key': self.token,
+            }
+        ) as resp:
+            if 300 > resp.status >= 200:
+                return await resp.json()
+            else:
+                error_text = await resp.text()
+                logger.error(f"Emby.list_resource: {error_text}")
+                return None
 
     async def get_image_url_by_item_id(self, item_id):
         return f"{self.host}/emby/Items/{item_id}/Images/Primary/0?api_key={self.token}"
 
     async def get_remote_image_url_by_item_id(self, item_id):
-        async with await self._get_session() as session:
+        session = await self._get_session()
+        async with session.get(
+            f"{self.host}/emby/Items/{item_id}/RemoteImages",
+            params={
+                'api_key': self.token,
+                'Type': 'Primary',
+            }
+        ) as resp:
+            data = await resp.json()
+            images = data['Images']
+            return [img.get('Url') for img in images if img['ProviderName'] == 'TheMovieDb'][0]
+
+    async def get_remote_image_urls(self, item_ids: list) -> dict:
+        """
+        并发查询多个条目的远程海报，返回 {item_id: url}
+
+        优先使用 TheMovieDb 的图片，没有时退回其他来源，都没有或查询失败的条目为 None
+        """
+        async def fetch(item_id):
+            session = await self._get_session()
             async with session.get(
                 f"{self.host}/emby/Items/{item_id}/RemoteImages",
                 params={
@@ -108,137 +145,260 @@ class Emby:
                     'Type': 'Primary',
                 }
             ) as resp:
-                data = await resp.json()
-                images = data['Images']
-                return [img.get('Url') for img in images if img['ProviderName'] == 'TheMovieDb'][0]
+                if not 300 > resp.status >= 200:
+                    logger.error(f"Emby.get_remote_image_urls({item_id}): {await resp.text()}")
+                    return None
+                images = (await resp.json()).get('Images') or []
+            urls = [img.get('Url') for img in images if img.get('ProviderName') == 'TheMovieDb']
+            urls += [img.get('Url') for img in images]
+            return next((url for url in urls if url), None)
 
-    async def get_admin_user_id(self):
-        async with await self._get_session() as session:
-            async with session.get(
-                f"{self.host}/emby/Users/Query",
-                params={
-                    'api_key': self.token,
-                }
-            ) as resp:
-                data = await resp.json()
-                for user in data['Items']:
-                    if user['Policy']['IsAdministrator']:
-                        return user['Id']
-                return None
+        item_ids = list(dict.fromkeys(item_ids))
+        results = await asyncio.gather(*(fetch(item_id) for item_id in item_ids), return_exceptions=True)
+        urls = dict()
+        for item_id, result in zip(item_ids, results):
+            if isinstance(result, Exception):
+                logger.error(f"Emby.get_remote_image_urls({item_id}): {result}")
+                result = None
+            urls[item_id] = result
+        return urls
 
-    async def get_metadata_by_user_id_item_id(self, user_id, item_id):
-        async with await self._get_session() as session:
+    async def get_admin_user_id(self, use_cache=True):
+        """管理员用户 id，按服务器地址缓存 EMBY_ADMIN_USER_CACHE_TTL 秒"""
+        entry = _admin_user_ids.get(self.host)
+        if use_cache and entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        session = await self._get_session()
+        async with session.get(
+            f"{self.host}/emby/Users/Query",
+            params={
+                'api_key': self.token,
+            }
+        ) as resp:
+            data = await resp.json()
+        admin_user_id = next((user['Id'] for user in data['Items'] if user['Policy']['IsAdministrator']), None)
+        if admin_user_id is not None:
+            _admin_user_ids[self.host] = (admin_user_id, time.monotonic() + EMBY_ADMIN_USER_CACHE_TTL)
+        return admin_user_id
+
+    async def get_items_metadata(self, user_id, item_ids: list) -> dict:
+        """
+        按 Ids 批量查询条目元数据（每 _IDS_CHUNK_SIZE 个一个请求，并发执行），返回 {item_id: metadata}
+
+        查询失败的条目不在结果中
+        """
+        async def fetch(chunk):
+            session = await self._get_session()
             async with session.get(
-                f"{self.host}/emby/Users/{user_id}/Items/{item_id}",
+                f"{self.host}/emby/Users/{user_id}/Items",
                 params={
+                    'Ids': ','.join(str(item_id) for item_id in chunk),
+                    'Fields': 'ProductionYear,ExternalUrls,ProviderIds',
                     'api_key': self.token,
                 }
             ) as resp:
                 if 300 > resp.status >= 200:
-                    return await resp.json()
-                else:
-                    error_text = await resp.text()
-                    logger.error(f"Emby.get_metadata_by_user_id_item_id: {error_text}")
-                    return None
+                    return (await resp.json()).get('Items') or []
+                error_text = await resp.text()
+                logger.error(f"Emby.get_items_metadata: {error_text}")
+                return []
+
+        item_ids = list(dict.fromkeys(item_ids))
+        chunks = [item_ids[i:i + _IDS_CHUNK_SIZE] for i in range(0, len(item_ids), _IDS_CHUNK_SIZE)]
+        metadata = dict()
+        for items in await asyncio.gather(*(fetch(chunk) for chunk in chunks)):
+            for item in items:
+                metadata[int(item['Id'])] = item
+        return metadata
+
+    async def list_latest_items(self, user_id, min_date_last_saved: datetime.datetime = None, start_index: int = 0,
+                                limit: int = 50):
+        """
+        按 DateCreated 从新到旧分页列出剧集和电影
+
+        Args:
+            user_id: 查询所用的用户 id（管理员可见全部媒体库）
+            min_date_last_saved: 只返回此时间（UTC）之后保存过的条目，新入库的条目必然在其中
+            start_index: 分页起始位置
+            limit: 每页条目数
+
+        Returns:
+            条目列表，请求失败时返回 None
+        """
+        params = {
+            'Recursive': 'true',
+            'IncludeItemTypes': 'Episode,Movie',
+            'SortBy': 'DateCreated',
+            'SortOrder': 'Descending',
+            'Fields': 'DateCreated,ProductionYear',
+            'StartIndex': start_index,
+            'Limit': limit,
+            'api_key': self.token,
+        }
+        if min_date_last_saved is not None:
+            params['MinDateLastSaved'] = min_date_last_saved.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        session = await self._get_session()
+        async with session.get(f"{self.host}/emby/Users/{user_id}/Items", params=params) as resp:
+            if 300 > resp.status >= 200:
+                return (await resp.json()).get('Items') or []
+            error_text = await resp.text()
+            logger.error(f"Emby.list_latest_items: {error_text}")
+            return None
+
+    async def get_metadata_by_user_id_item_id(self, user_id, item_id):
+        session = await self._get_session()
+        async with session.get(
+            f"{self.host}/emby/Users/{user_id}/Items/{item_id}",
+            params={
+                'api_key': self.token,
+            }
+        ) as resp:
+            if 300 > resp.status >= 200:
+                return await resp.json()
+            else:
+                error_text = await resp.text()
+                logger.error(f"Emby.get_metadata_by_user_id_item_id: {error_text}")
+                return None
 
     async def refresh_library(self, item_id: int):
-        async with await self._get_session() as session:
-            async with session.post(
-                f"{self.host}/emby/Items/{item_id}/Refresh",
-                params={
-                    "Recursive": "true",
-                    "MetadataRefreshMode": "FullRefresh",
-                    "ImageRefreshMode": "FullRefresh",
-                    "ReplaceAllMetadata": "true",
-                    "ReplaceAllImages": "true",
-                    "api_key": self.token,
-                }
-            ) as resp:
-                if 300 > resp.status >= 200:
-                    return True
-                else:
-                    error_text = await resp.text()
-                    logger.error(f"Emby.refresh_library: {error_text}")
-                    return None
+        session = await self._get_session()
+        async with session.post(
+            f"{self.host}/emby/Items/{item_id}/Refresh",
+            params={
+                "Recursive": "true",
+                "MetadataRefreshMode": "FullRefresh",
+                "ImageRefreshMode": "FullRefresh",
+                "ReplaceAllMetadata": "true",
+                "ReplaceAllImages": "true",
+                "api_key": self.token,
+            }
+        ) as resp:
+            if 300 > resp.status >= 200:
+                return True
+            else:
+                error_text = await resp.text()
+                logger.error(f"Emby.refresh_library: {error_text}")
+                return None
 
     async def get_id_by_username(self, username):
-        async with await self._get_session() as session:
-            async with session.get(
-                f"{self.host}/emby/Users/Query",
-                params={
-                    'api_key': self.token,
-                }
-            ) as resp:
-                data = await resp.json()
-                for user in data['Items']:
-                    if user['Name'] == username:
-                        return user['Id']
-                return None
+        session = await self._get_session()
+        async with session.get(
+            f"{self.host}/emby/Users/Query",
+            params={
+                'api_key': self.token,
+            }
+        ) as resp:
+            data = await resp.json()
+            for user in data['Items']:
+                if user['Name'] == username:
+                    return user['Id']
+            return None
 
     async def authenticate_by_id_pwd(self, user_id, user_pwd):
-        async with await self._get_session() as session:
-            async with session.post(
-                f"{self.host}/emby/Users/{user_id}/Authenticate",
-                params={
-                    'api_key': self.token,
-                },
-                json={
-                    "Pw": user_pwd,
-                }
-            ) as resp:
-                if 300 > resp.status >= 200:
-                    return await resp.json()
-                else:
-                    error_text = await resp.text()
-                    logger.error(f"Emby.authenticate_by_id_pwd: {error_text}")
-                    return None
+        session = await self._get_session()
+        async with session.post(
+            f"{self.host}/emby/Users/{user_id}/Authenticate",
+            params={
+                'api_key': self.token,
+            },
+            json={
+                "Pw": user_pwd,
+            }
+        ) as resp:
+            if 300 > resp.status >= 200:
+                return await resp.json()
+            else:
+                error_text = await resp.text()
+                logger.error(f"Emby.authenticate_by_id_pwd: {error_text}")
+                return None
 
     async def list_notification(self, access_token):
-        async with await self._get_session() as session:
-            async with session.get(
-                f"{self.host}/emby/Notifications/Services/Configured",
-                params={
-                    "X-Emby-Token": access_token
-                }
-            ) as resp:
-                if 300 > resp.status >= 200:
-                    return await resp.json()
-                else:
-                    error_text = await resp.text()
-                    logger.error(f"Emby.list_notification: {error_text}")
-                    return None
+        session = await self._get_session()
+        async with session.get(
+            f"{self.host}/emby/Notifications/Services/Configured",
+            params={
+                "X-Emby-Token": access_token
+            }
+        ) as resp:
+            if resp.status == 401:
+                raise EmbyUnauthorizedError()
+            if 300 > resp.status >= 200:
+                return await resp.json()
+            else:
+                error_text = await resp.text()
+                logger.error(f"Emby.list_notification: {error_text}")
+                return None
+
+    async def list_notifications(self, username, password, use_cache=True):
+        """
+        通知配置列表，结果按服务器地址作为快照缓存 EMBY_NOTIFICATION_SNAPSHOT_TTL 秒
+
+        快照为共享对象，调用方不要修改；use_cache=False 时重新读取并刷新快照
+        """
+        entry = _notification_snapshots.get(self.host)
+        if use_cache and entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        notifications = await self._with_access_token(username, password, self.list_notification)
+        if notifications is not None:
+            _notification_snapshots[self.host] = (notifications, time.monotonic() + EMBY_NOTIFICATION_SNAPSHOT_TTL)
+        return notifications
 
-    async def update_notification(self, access_token: str, notification_id: str, event_id: str, operation: str):
-        notifications = await self.list_notification(access_token)
-        notification = None
-        for _ in notifications:
-            if _['Id'] == notification_id:
-                notification = _
-                break
-        if notification is None:
+    async def update_notification(self, username, password, notification_id: str, event_id: str, operation: str):
+        """
+        基于通知快照开启或关闭事件
+
+        同一服务器的写入逐个进行；写入成功后把修改写回快照，连续切换只需读取一次。
+        写入失败时丢弃该服务器的快照，下一次修改重新读取
+        """
+        async with _notification_locks.setdefault(self.host, asyncio.Lock()):
+            resp = None
+            try:
+                resp = await self._update_notification(username, password, notification_id, event_id, operation)
+                return resp
+            finally:
+                if resp is None:
+                    _notification_snapshots.pop(self.host, None)
+
+    async def _update_notification(self, username, password, notification_id: str, event_id: str, operation: str):
+        def find(items):
+            return next((index for index, item in enumerate(items or []) if item['Id'] == notification_id), None)
+
+        notifications = await self.list_notifications(username, password)
+        index = find(notifications)
+        if index is None and notifications is not None:
+            # 快照中没有时可能是新加的通知，重新读取一次
+            notifications = await self.list_notifications(username, password, use_cache=False)
+            index = find(notifications)
+        if index is None:
             logger.error(f"Notification {notification_id} not found")
             return None
+        notification = copy.deepcopy(notifications[index])
         if operation == 'open':
             if event_id not in notification['EventIds']:
                 notification['EventIds'].append(event_id)
         elif operation == 'close':
             if event_id in notification['EventIds']:
                 notification['EventIds'].remove(event_id)
-        async with await self._get_session() as session:
-            async with session.post(
-                f"{self.host}/emby/Notifications/Services/Configured",
-                params={
-                    "X-Emby-Token": self.token
-                },
-                json=notification
-            ) as resp:
-                if resp.status == 204:
-                    return resp
-                else:
-                    error_text = await resp.text()
-                    logger.error(f"Emby.update_notification: {error_text}")
-                    return None
-
+        session = await self._get_session()
+        async with session.post(
+            f"{self.host}/emby/Notifications/Services/Configured",
+            params={
+                "X-Emby-Token": self.token
+            },
+            json=notification
+        ) as resp:
+            if resp.status == 204:
+                # 快照为共享对象，替换为新列表而不是原地修改
+                entry = _notification_snapshots.get(self.host)
+                if entry is not None and entry[0] is notifications:
+                    _notification_snapshots[self.host] = (
+                        notifications[:index] + [notification] + notifications[index + 1:], entry[1]
+                    )
+                return resp
+            else:
+                error_text = await resp.text()
+                logger.error(f"Emby.update_notification: {error_text}")
+                return None
 
 if __name__ == '__main__':
     emby = Emby(host='', token='')
@@ -0,0 +1,284 @@
+import asyncio
+import datetime
+import html
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+
+from config.config import EMBY_POLL_CONCURRENCY, EMBY_POLL_PAGE_SIZE, EMBY_POLL_MAX_PAGES, EMBY_POLL_BACKOFF, \
+    EMBY_POLL_MAX_BACKOFF
+from db.models import session_local
+from db.models.emby import EmbyConfig, EmbyLibrarySync
+from db.models.user import User
+from utils.crypto import decrypt_many
+from utils.emby import Emby
+
+logger = logging.getLogger(__name__)
+
+# 每次从数据库读取的用户数，读完即关闭会话
+_PAGE_SIZE = 100
+
+
+def parse_emby_date(value: Optional[str]) -> Optional[datetime.datetime]:
+    """Emby 的 UTC 时间字符串（如 2024-01-02T03:04:05.1234567Z）转为不带时区的 UTC 时间"""
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value).astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def format_new_items(items: list, truncated: bool = False) -> str:
+    """新入库条目的通知文本，剧集按剧名合并为一行；truncated 时注明更早入库的条目已跳过"""
+    # 剧名 -> [((季号, 集号), 显示文本)]
+    series = OrderedDict()
+    movies = list()
+    for item in items:
+        name = html.escape(item.get('Name') or '')
+        if item.get('Type') == 'Episode':
+            season, episode = item.get('ParentIndexNumber'), item.get('IndexNumber')
+            if season is not None and episode is not None:
+                episode_key, label = (season, episode), f"S{season:02d}E{episode:02d}"
+            else:
+                episode_key, label = (float('inf'), float('inf')), name
+            series.setdefault(html.escape(item.get('SeriesName') or '未知剧集'), []).append((episode_key, label))
+        else:
+            year = f" ({item['ProductionYear']})" if item.get('ProductionYear') else ''
+            movies.append(f"🎬 <b>{name}</b>{year}")
+    lines = ["🆕 <b>Emby 新入库</b>", ""]
+    lines += [
+        f"📺 <b>{name}</b>：{'、'.join(label for _, label in sorted(episodes, key=lambda episode: episode[0]))}"
+        for name, episodes in series.items()
+    ]
+    lines += movies
+    if truncated:
+        lines += ["", f"⚠️ 新入库条目过多，仅列出最新的 {len(items)} 项，更早入库的条目已跳过"]
+    return '\n'.join(lines)
+
+
+class EmbyPollError(Exception):
+    """轮询 Emby 失败"""
+
+
+class EmbyLibraryPoller:
+    """
+    定时轮询所有用户的 Emby 媒体库，把新入库的剧集和电影推送给对应用户
+
+    每个用户在 emby_library_sync 表中保存一个水位（已处理条目中最新的 DateCreated）。
+    轮询时按 DateCreated 从新到旧分页拉取，并用 MinDateLastSaved 让服务端先过滤掉旧条目，
+    遇到水位之前的条目即停止，因此只会拉取新条目。首次轮询或服务器地址变更时只建立水位，不推送。
+    新条目超过页数上限时只推送最新的部分并在通知中注明，水位直接推进到最新条目。
+    轮询出错的用户按连续出错次数指数退避，退避期间跳过
+    """
+
+    def __init__(self, concurrency: int = EMBY_POLL_CONCURRENCY, page_size: int = EMBY_POLL_PAGE_SIZE,
+                 max_pages: int = EMBY_POLL_MAX_PAGES):
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.max_pages = max_pages
+
+    @staticmethod
+    def _iter_config_pages():
+        """按用户 id 分页读取 Emby 配置及其同步进度"""
+        last_user_id = 0
+        while True:
+            with session_local() as session:
+                configs = session.execute(
+                    select(EmbyConfig.user_id, EmbyConfig.host, EmbyConfig.api_token, User.username, User.chat_id)
+                    .join(User, EmbyConfig.user_id == User.id)
+                    .filter(EmbyConfig.user_id > last_user_id)
+                    .order_by(EmbyConfig.user_id).limit(_PAGE_SIZE)
+                ).all()
+                if not configs:
+                    return
+                states = {
+                    state.user_id: {
+                        'host': state.host,
+                        'last_date_created': state.last_date_created,
+                        'last_item_ids': state.last_item_ids or [],
+                        'failures': state.failures,
+                        'next_poll_at': state.next_poll_at,
+                    }
+                    for state in session.scalars(
+                        select(EmbyLibrarySync).filter(
+                            EmbyLibrarySync.user_id.in_([config.user_id for config in configs])
+                        )
+                    )
+                }
+            last_user_id = configs[-1].user_id
+            yield [(config, states.get(config.user_id)) for config in configs]
+
+    async def _new_items(self, emby: Emby, admin_user_id, since: datetime.datetime, seen: set):
+        """
+        拉取水位之后的条目
+
+        Returns:
+            ([(DateCreated, item)]，从新到旧), 是否因达到页数上限而截断
+        """
+        items = list()
+        last_created = None
+        for page in range(self.max_pages):
+            batch = await emby.list_latest_items(admin_user_id, since, page * self.page_size, self.page_size)
+            if batch is None:
+                raise EmbyPollError("获取最新条目失败")
+            for item in batch:
+                created = parse_emby_date(item.get('DateCreated'))
+                if created is None:
+                    continue
+                last_created = created
+                if created == since and item['Id'] in seen:
+                    continue
+                if created < since:
+                    return items, False
+                items.append((created, item))
+            if len(batch) < self.page_size:
+                return items, False
+        # 最后一页恰好停在水位上时没有更多新条目
+        return items, last_created is None or last_created > since
+
+    async def _baseline(self, emby: Emby, admin_user_id) -> tuple:
+        latest = await emby.list_latest_items(admin_user_id, limit=1)
+        if latest is None:
+            raise EmbyPollError("获取最新条目失败")
+        created = parse_emby_date(latest[0].get('DateCreated')) if latest else None
+        if created is None:
+            return datetime.datetime.utcnow(), []
+        return created, [latest[0]['Id']]
+
+    async def _process(self, config, api_token: Optional[str], state: Optional[dict], notify,
+                       summary: dict) -> Optional[dict]:
+        now = datetime.datetime.utcnow()
+        row = None if state is None else {
+            'user_id': config.user_id,
+            'host': state['host'],
+            'last_date_created': state['last_date_created'],
+            'last_item_ids': state['last_item_ids'],
+            'synced_at': now,
+            'failures': 0,
+            'next_poll_at': None,
+        }
+        try:
+            if not api_token:
+                raise EmbyPollError("无法解密 Emby API 令牌")
+            emby = Emby(host=config.host, token=api_token)
+            admin_user_id = await emby.get_admin_user_id()
+            if admin_user_id is None:
+                raise EmbyPollError("找不到管理员用户")
+
+            if state is None or state['host'] != config.host or state['last_date_created'] is None:
+                last_date_created, last_item_ids = await self._baseline(emby, admin_user_id)
+                summary['baselined'] += 1
+                return {
+                    'user_id': config.user_id,
+                    'host': config.host,
+                    'last_date_created': last_date_created,
+                    'last_item_ids': last_item_ids,
+                    'synced_at': now,
+                    'failures': 0,
+                    'next_poll_at': None,
+                }
+
+            since = state['last_date_created']
+            items, truncated = await self._new_items(emby, admin_user_id, since, set(state['last_item_ids']))
+            if not items:
+                return row
+            # 先推送再推进水位，推送失败时下次轮询重新推送
+            await notify(format_new_items([item for _, item in reversed(items)], truncated), config.chat_id)
+            summary['notified'] += 1
+            summary['new_items'] += len(items)
+
+            newest = items[0][0]
+            newest_ids = [item['Id'] for created, item in items if created == newest]
+            row['last_date_created'] = newest
+            row['last_item_ids'] = list(dict.fromkeys(
+                (state['last_item_ids'] if newest == since else []) + newest_ids
+            ))
+            logger.info(f"用户 {config.username} (ID: {config.user_id}) 的 Emby 新入库 {len(items)} 项")
+            return row
+        except Exception as e:
+            summary['errors'] += 1
+            failures = (state['failures'] if state else 0) + 1
+            backoff = min(EMBY_POLL_BACKOFF * 2 ** (failures - 1), EMBY_POLL_MAX_BACKOFF)
+            logger.warning(f"轮询用户 {config.username} (ID: {config.user_id}) 的 Emby 失败（连续 {failures} 次），"
+                           f"{backoff} 秒后重试: {e}")
+            if row is None:
+                # 尚未建立水位，只记录出错次数，退避结束后重新建立水位
+                row = {
+                    'user_id': config.user_id,
+                    'host': config.host,
+                    'last_date_created': None,
+                    'last_item_ids': [],
+                    'synced_at': now,
+                }
+            row['failures'] = failures
+            row['next_poll_at'] = now + datetime.timedelta(seconds=backoff)
+            return row
+
+    @staticmethod
+    def _save(rows: list):
+        if not rows:
+            return
+        try:
+            with session_local() as session:
+                statement = insert(EmbyLibrarySync).values(rows)
+                session.execute(statement.on_conflict_do_update(
+                    index_elements=[EmbyLibrarySync.user_id],
+                    set_={
+                        'host': statement.excluded.host,
+                        'last_date_created': statement.excluded.last_date_created,
+                        'last_item_ids': statement.excluded.last_item_ids,
+                        'synced_at': statement.excluded.synced_at,
+                        'failures': statement.excluded.failures,
+                        'next_poll_at': statement.excluded.next_poll_at,
+                        'updated_at': statement.excluded.synced_at,
+                    }
+                ))
+                session.commit()
+        except Exception as e:
+            logger.error(f"保存 Emby 同步进度失败: {e}")
+
+    async def run(self, notify: Callable[[str, int], Awaitable]) -> dict:
+        """
+        执行一轮轮询
+
+        Args:
+            notify: 发送通知的协程函数，参数为 (message, chat_id)
+
+        Returns:
+            本轮汇总：users / baselined / notified / new_items / errors / skipped / duration
+        """
+        started_at = time.monotonic()
+        summary = dict(users=0, baselined=0, notified=0, new_items=0, errors=0, skipped=0)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def process(config, api_token, state):
+            async with semaphore:
+                return await self._process(config, api_token, state, notify, summary)
+
+        now = datetime.datetime.utcnow()
+        for page in self._iter_config_pages():
+            # 退避中的用户本轮跳过
+            due = [
+                (config, state) for config, state in page
+                if not (state and state['next_poll_at'] and state['next_poll_at'] > now)
+            ]
+            summary['skipped'] += len(page) - len(due)
+            # 整页一次解密，解密失败的按轮询出错处理
+            tokens = decrypt_many([config.api_token for config, _ in due], ignore_errors=True, use_cache=False)
+            rows = await asyncio.gather(
+                *(process(config, tokens.get(config.api_token), state) for config, state in due)
+            )
+            summary['users'] += len(due)
+            self._save([row for row in rows if row is not None])
+
+        summary['duration'] = round(time.monotonic() - started_at, 2)
+        logger.info(f"Emby 新入库轮询完成: {summary}")
+        return summary
+
+
+emby_library_poller = EmbyLibraryPoller()
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import time
+from urllib.parse import urlparse
+
+import aiohttp
+
+from config.config import HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_POOL_DNS_TTL, HTTP_POOL_KEEPALIVE_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(
+    total=30,        # 总超时 30 秒
+    connect=10,      # 连接超时 10 秒
+    sock_read=20     # 读取超时 20 秒
+)
+
+
+class HttpSessionPool:
+    """
+    进程级 aiohttp 会话池，按上游主机复用 ClientSession
+
+    所有会话共用同一个 TCPConnector：keep-alive 连接跨调用复用，DNS 缓存共享，
+    并按主机限制并发连接数。会话不保存 Cookie，需要 Cookie 的调用方每次通过请求头传入。
+    会话由池持有，调用方不要关闭；
+    由 Application 在 post_shutdown 中统一关闭
+    """
+
+    def __init__(self, limit: int = HTTP_POOL_LIMIT, limit_per_host: int = HTTP_POOL_LIMIT_PER_HOST,
+                 ttl_dns_cache: int = HTTP_POOL_DNS_TTL, keepalive_timeout: int = HTTP_POOL_KEEPALIVE_TIMEOUT):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.ttl_dns_cache = ttl_dns_cache
+        self.keepalive_timeout = keepalive_timeout
+        self._connector = None
+        self._loop = None
+        # (origin, timeout) -> ClientSession
+        self._sessions = dict()
+
+    @staticmethod
+    def _origin(url: str) -> str:
+        parsed = urlparse(url)
+        if not parsed.netloc:
+            raise ValueError(f"无效的上游地址: {url}")
+        return f"{parsed.scheme}://{parsed.netloc}".lower()
+
+    def _get_connector(self) -> aiohttp.TCPConnector:
+        loop = asyncio.get_running_loop()
+        if self._connector is None or self._connector.closed or self._loop is not loop:
+            # 连接器绑定事件循环，循环变化或已关闭时连同旧会话一起丢弃
+            self._sessions.clear()
+            self._connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.ttl_dns_cache,
+                keepalive_timeout=self.keepalive_timeout,
+                force_close=False,
+            )
+            self._loop = loop
+            logger.debug("已创建进程级 HTTP 连接器")
+        return self._connector
+
+    def get(self, url: str, timeout: aiohttp.ClientTimeout = DEFAULT_TIMEOUT) -> aiohttp.ClientSession:
+        """
+        获取访问 url 所在主机的会话，须在事件循环中调用
+
+        Args:
+            url: 上游地址，只取 scheme + host 部分
+            timeout: 会话默认超时，不同超时配置的调用方各自使用一个会话，但共用连接
+        """
+        connector = self._get_connector()
+        key = (self._origin(url), timeout)
+        session = self._sessions.get(key)
+        if session is None or session.closed:
+            # 会话被所有用户共用，不保存响应中的 Set-Cookie，
+            # 否则某个用户的 Cookie 会覆盖下一个用户请求头中的 Cookie
+            session = aiohttp.ClientSession(
+                connector=connector,
+                connector_owner=False,
+                timeout=timeout,
+                cookie_jar=aiohttp.DummyCookieJar(),
+            )
+            self._sessions[key] = session
+            logger.debug(f"已创建 HTTP 会话: {key[0]}")
+        return session
+
+    async def close(self):
+        """关闭所有会话及共用的连接器"""
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for session in sessions:
+            try:
+                await session.close()
+            except Exception as e:
+                logger.warning(f"关闭会话时出错: {e}")
+        if self._connector is not None and not self._connector.closed:
+            await self._connector.close()
+            # 等待 SSL 连接完全关闭
+            await asyncio.sleep(0.1)
+        self._connector = None
+        self._loop = None
+
+    def stats(self) -> dict:
+        return {
+            'sessions': len(self._sessions),
+            'hosts': sorted({origin for origin, _ in self._sessions}),
+        }
+
+
+http_session_pool = HttpSessionPool()
+
+
+class TokenBucket:
+    """令牌桶限流：每秒补充 rate 个令牌，最多积攒 capacity 个，令牌不足时等待"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self):
+        # 加锁排队，保证等待中的调用按先后顺序拿到令牌
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+# origin -> TokenBucket
+_rate_limiters = dict()
+
+
+def get_rate_limiter(url: str, rate: float, capacity: int) -> TokenBucket:
+    """获取 url 所在主机的限流器，同一上游的所有调用方共用一个令牌桶"""
+    origin = HttpSessionPool._origin(url)
+    limiter = _rate_limiters.get(origin)
+    if limiter is None:
+        limiter = _rate_limiters[origin] = TokenBucket(rate=rate, capacity=capacity)
+    return limiter
@@ -1,113 +1,154 @@
+import asyncio
 import datetime
 import logging
 
-import telegram
-from sqlalchemy import select
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import select, update, exists
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
-from config.config import TG_BOT_TOKEN
-from db.models import model_engine
+from config.config import TAG_DONE_JOBS_BATCH_SIZE, TAG_DONE_JOBS_MAX_BATCHES
+from db.models import session_local
 from db.models.external import ApschedulerJobs
 from db.models.job import UserApschedulerJobs
-from db.models.user import User
+from utils import telegram_sender
+from utils.cookie_checker import quark_cookie_checker
+from utils.emby_poller import emby_library_poller
+from utils.link_cache import link_validity_cache
 
 logger = logging.getLogger(__name__)
 
 async def send_message(message: str, chat_id: int):
-    bot = telegram.Bot(token=TG_BOT_TOKEN)
-    await bot.send_message(
-        chat_id=chat_id,
-        text=message,
+    await telegram_sender.send_message(
+        chat_id,
+        message,
         parse_mode="HTML"
     )
 
 
 async def send_reminder_message(message: str, chat_id: int, job_id: str):
-    bot = telegram.Bot(token=TG_BOT_TOKEN)
     keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("完成 ✅", callback_data=f"remind_done:{job_id}")]])
-    await bot.send_message(
-        chat_id=chat_id,
-        text=message,
+    await telegram_sender.send_message(
+        chat_id,
+        message,
         parse_mode="HTML",
         reply_markup=keyboard
     )
 
 
+class DoneJobSweeper:
+    """
+    标记已结束的提醒任务（调度器中已不存在对应 job）为已删除
+
+    按 user_apscheduler_jobs.id 分批扫描未删除的记录，每批一条 UPDATE ... NOT EXISTS 完成标记；
+    高水位记录上次扫描到的 id，下次从这里继续，扫描到末尾后从头开始。
+    一次性提醒结束时由 EVENT_JOB_REMOVED 监听即时标记，这里只做兜底
+    """
+
+    def __init__(self, batch_size: int = TAG_DONE_JOBS_BATCH_SIZE, max_batches: int = TAG_DONE_JOBS_MAX_BATCHES):
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self._high_water_mark = 0
+
+    @staticmethod
+    def batch_statement(after_id: int, batch_size: int):
+        """一批未删除记录的 id，db.query_plan 也用它检查执行计划"""
+        return select(UserApschedulerJobs.id).filter(
+            UserApschedulerJobs.deleted_at.is_(None),
+            UserApschedulerJobs.id > after_id,
+        ).order_by(UserApschedulerJobs.id).limit(batch_size)
+
+    @staticmethod
+    def tag_statement(first_id: int, last_id: int, now: datetime.datetime):
+        """标记 id 区间内调度任务已不存在的记录，db.query_plan 也用它检查执行计划"""
+        return update(UserApschedulerJobs).where(
+            UserApschedulerJobs.id.between(first_id, last_id),
+            UserApschedulerJobs.deleted_at.is_(None),
+            ~exists().where(ApschedulerJobs.id == UserApschedulerJobs.apscheduler_job_id),
+        ).values(deleted_at=now)
+
+    def sweep(self, session) -> int:
+        """扫描至多 max_batches 批，返回本次标记的记录数"""
+        tagged = 0
+        for _ in range(self.max_batches):
+            ids = session.scalars(self.batch_statement(self._high_water_mark, self.batch_size)).all()
+            if not ids:
+                self._high_water_mark = 0
+                break
+
+            result = session.execute(
+                self.tag_statement(ids[0], ids[-1], datetime.datetime.utcnow()),
+                execution_options={'synchronize_session': False}
+            )
+            session.commit()
+            tagged += result.rowcount
+
+            if len(ids) < self.batch_size:
+                # 已扫描到末尾，下次从头开始
+                self._high_water_mark = 0
+                break
+            self._high_water_mark = ids[-1]
+        return tagged
+
+
+done_job_sweeper = DoneJobSweeper()
+
+
 async def tag_done_jobs():
-    session_local = sessionmaker(autocommit=False, autoflush=False, bind=model_engine)
     with session_local() as session:
-        subquery = (
-            session.query(UserApschedulerJobs.id)
-            .outerjoin(
-                ApschedulerJobs, UserApschedulerJobs.apscheduler_job_id == ApschedulerJobs.id
-            )
-            .filter(
-                ApschedulerJobs.id == None,
-                UserApschedulerJobs.deleted_at.is_(None)
+        tagged = done_job_sweeper.sweep(session)
+    if tagged:
+        logger.info(f"标记删除已完成任务 {tagged} 个")
+
+
+def tag_removed_job(event):
+    """APScheduler EVENT_JOB_REMOVED 监听：一次性任务执行完被移除后立即标记对应记录"""
+    try:
+        with session_local() as session:
+            result = session.execute(
+                update(UserApschedulerJobs).where(
+                    UserApschedulerJobs.apscheduler_job_id == event.job_id,
+                    UserApschedulerJobs.deleted_at.is_(None),
+                ).values(deleted_at=datetime.datetime.utcnow()),
+                execution_options={'synchronize_session': False}
             )
-            .subquery()
-        )
+            session.commit()
+        if result.rowcount:
+            logger.info(f"任务 {event.job_id} 已移除，标记删除")
+    except Exception as e:
+        logger.error(f"标记已移除任务 {event.job_id} 失败: {e}")
 
-        session.query(UserApschedulerJobs).filter(UserApschedulerJobs.id.in_(select(subquery))).update(
-            {UserApschedulerJobs.deleted_at: datetime.datetime.utcnow()},
-            synchronize_session=False
-        )
-        session.commit()
-        logger.info(f"标记删除已完成任务")
+
+async def purge_expired_link_validity():
+    """清理已过期的链接校验缓存"""
+    count = await asyncio.to_thread(link_validity_cache.purge_expired)
+    logger.info(f"清理过期链接校验缓存 {count} 条")
 
 
 async def check_quark_cookies_validity():
-    """检查所有用户的夸克网盘 Cookies 是否有效"""
-    import asyncio
-    session_local = sessionmaker(autocommit=False, autoflush=False, bind=model_engine)
-    with session_local() as session:
-        # 查询所有配置了夸克 cookies 的用户
-        users = session.query(User).filter(
-            User.configuration.isnot(None)
-        ).all()
-
-        for user in users:
-            # 检查用户是否配置了夸克 cookies
-            if not user.configuration or not user.configuration.get('quark_cookies'):
-                continue
-
-            try:
-                # 获取解密后的 cookies
-                from api.user_config import get_user_quark_cookies
-                quark_cookies = await get_user_quark_cookies(user)
-
-                if not quark_cookies:
-                    continue
-
-                # 检查 cookies 是否有效，重试3次防止偶然失败
-                from utils.quark import Quark
-                quark = Quark(cookies=quark_cookies)
-
-                max_retries = 3
-                account_info = None
-                for attempt in range(1, max_retries + 1):
-                    account_info = await quark.get_account_info()
-                    if account_info:
-                        break
-                    if attempt < max_retries:
-                        logger.warning(f"用户 {user.username} (ID: {user.id}) 夸克 Cookies 检测第 {attempt} 次失败，{2}秒后重试")
-                        await asyncio.sleep(2)
-
-                if not account_info:
-                    # 3次都失败，Cookies 已过期，发送通知
-                    logger.warning(f"用户 {user.username} (ID: {user.id}) 的夸克网盘 Cookies 已过期（重试 {max_retries} 次均失败）")
-
-                    message = (
-                        "⚠️ <b>夸克网盘 Cookies 已过期</b>\n\n"
-                        "您的夸克网盘 Cookies 已失效，请重新配置。\n"
-                        "使用 /upsert_configuration 命令更新「夸克网盘」Cookies。"
-                    )
-
-                    await send_message(message, user.chat_id)
-                else:
-                    logger.info(f"用户 {user.username} (ID: {user.id}) 的夸克网盘 Cookies 有效")
-
-            except Exception as e:
-                logger.error(f"检查用户 {user.username} (ID: {user.id}) 的夸克 Cookies 时出错: {e}")
+    """检查所有用户的夸克网盘 Cookies 是否有效，过期时通知用户"""
+    await quark_cookie_checker.run(notify=send_message)
+
+
+async def poll_emby_libraries():
+    """增量拉取各用户 Emby 媒体库的新入库条目并推送"""
+    await emby_library_poller.run(notify=send_message)
 
+
+async def reconcile_command_menus():
+    """定时全量同步命令菜单，兜底进程外对用户角色的修改；菜单未变化的用户不会调用 Telegram API"""
+    from api.commands import command_menu_sync
+    bot = await telegram_sender.get_bot()
+    with session_local() as session:
+        await command_menu_sync.reconcile(bot, session)
+
+
+async def log_cache_stats():
+    """定时记录各进程内缓存的命中率"""
+    from utils.command_middleware import user_identity_cache
+    from utils.crypto import decrypted_cache
+    from utils.qas import qas_data_cache
+    from utils.quark import share_token_cache
+    from utils.the_movie_db import tmdb_service
+    logger.info(
+        f"缓存统计: 用户身份 {user_identity_cache.stats()}, 分享 token {share_token_cache.stats()}, "
+        f"QAS 快照 {qas_data_cache.stats()}, 解密 {decrypted_cache.stats()}, TMDB {tmdb_service.stats()}"
+    )
@@ -0,0 +1,153 @@
+import asyncio
+import datetime
+import logging
+
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import sessionmaker
+
+from config.config import LINK_VALID_TTL, LINK_INVALID_TTL, LINK_BANNED_TTL, LINK_CACHE_MEMORY_SIZE
+from db.models import model_engine
+from db.models.resource import LinkValidity
+from utils.cache import TTLCache, hit_rate
+
+logger = logging.getLogger(__name__)
+
+STATE_VALID = 'valid'
+STATE_INVALID = 'invalid'
+STATE_BANNED = 'banned'
+
+# 分享被封禁、取消或删除，短期内不会恢复
+_BANNED_KEYWORDS = ('违规', '封禁', '取消', '删除', '不存在')
+# SQLite 单条语句的参数个数有限，分批查询和写入
+_QUERY_CHUNK_SIZE = 500
+_WRITE_CHUNK_SIZE = 150
+
+
+def classify_link_status(status: str):
+    """
+    将链接校验状态归类，返回 STATE_* 之一；限流、超时等临时状态返回 None，不缓存
+    """
+    if not status or status == '状态未知' or status.startswith('检查失败'):
+        return None
+    if status == '有效':
+        return STATE_VALID
+    if any(keyword in status for keyword in _BANNED_KEYWORDS):
+        return STATE_BANNED
+    return STATE_INVALID
+
+
+class LinkValidityCache:
+    """
+    分享链接校验结果缓存：内存 LRU + SQLite 持久化
+
+    有效、失效、封禁三类结果分别使用不同的有效期，封禁的分享作为负缓存长期保留
+    """
+
+    def __init__(self, engine=model_engine, memory_size: int = LINK_CACHE_MEMORY_SIZE):
+        self.ttls = {
+            STATE_VALID: LINK_VALID_TTL,
+            STATE_INVALID: LINK_INVALID_TTL,
+            STATE_BANNED: LINK_BANNED_TTL,
+        }
+        self._session_local = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        # url -> status，有效期随结果类别不同，写入时逐条指定
+        self._memory = TTLCache(max(self.ttls.values()), memory_size)
+        self.db_hits = 0
+        self.misses = 0
+
+    def _remember(self, url, status, expires_at, now):
+        self._memory.set(url, status, ttl=(expires_at - now).total_seconds())
+
+    async def get_many(self, urls: list) -> dict:
+        """返回未过期的 {url: status}，不在结果中的链接需要重新校验；内存未命中的在线程池中查询数据库"""
+        urls = list(dict.fromkeys(urls))
+        result = dict()
+        missing = list()
+        for url in urls:
+            status = self._memory.get(url)
+            if status is not None:
+                result[url] = status
+            else:
+                missing.append(url)
+        if missing:
+            result.update(await asyncio.to_thread(self._load, missing))
+        self.misses += len(urls) - len(result)
+        return result
+
+    def _load(self, urls: list) -> dict:
+        now = datetime.datetime.utcnow()
+        result = dict()
+        try:
+            with self._session_local() as session:
+                for i in range(0, len(urls), _QUERY_CHUNK_SIZE):
+                    rows = session.query(LinkValidity).filter(
+                        LinkValidity.url.in_(urls[i:i + _QUERY_CHUNK_SIZE]),
+                        LinkValidity.expires_at > now
+                    ).all()
+                    for row in rows:
+                        result[row.url] = row.status
+                        self._remember(row.url, row.status, row.expires_at, now)
+                        self.db_hits += 1
+        except Exception as e:
+            logger.error(f"读取链接校验缓存失败: {e}")
+        return result
+
+    async def set_many(self, results: dict):
+        """保存 {url: status}，临时状态（如限流导致的状态未知）不保存；数据库写入在线程池中进行"""
+        now = datetime.datetime.utcnow()
+        rows = list()
+        for url, status in results.items():
+            state = classify_link_status(status)
+            if state is None:
+                continue
+            expires_at = now + datetime.timedelta(seconds=self.ttls[state])
+            self._remember(url, status, expires_at, now)
+            rows.append({
+                'url': url,
+                'state': state,
+                'status': status[:256],
+                'checked_at': now,
+                'expires_at': expires_at,
+            })
+        if rows:
+            await asyncio.to_thread(self._save, rows)
+
+    def _save(self, rows: list):
+        try:
+            with self._session_local() as session:
+                for i in range(0, len(rows), _WRITE_CHUNK_SIZE):
+                    statement = insert(LinkValidity).values(rows[i:i + _WRITE_CHUNK_SIZE])
+                    session.execute(statement.on_conflict_do_update(
+                        index_elements=[LinkValidity.url],
+                        set_={
+                            'state': statement.excluded.state,
+                            'status': statement.excluded.status,
+                            'checked_at': statement.excluded.checked_at,
+                            'expires_at': statement.excluded.expires_at,
+                        }
+                    ))
+                session.commit()
+        except Exception as e:
+            logger.error(f"保存链接校验缓存失败: {e}")
+
+    def purge_expired(self) -> int:
+        """删除已过期的持久化记录，返回删除条数"""
+        with self._session_local() as session:
+            count = session.query(LinkValidity).filter(
+                LinkValidity.expires_at <= datetime.datetime.utcnow()
+            ).delete(synchronize_session=False)
+            session.commit()
+        return count
+
+    def stats(self) -> dict:
+        memory_hits = self._memory.hits
+        return {
+            'memory_size': len(self._memory),
+            'memory_hits': memory_hits,
+            'db_hits': self.db_hits,
+            'misses': self.misses,
+            'hit_rate': hit_rate(memory_hits + self.db_hits, memory_hits + self.db_hits + self.misses),
+        }
+
+
+link_validity_cache = LinkValidityCache()
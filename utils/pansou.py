@@ -1,96 +1,48 @@
-import asyncio
 import logging
 import os
-from datetime import datetime, timedelta
-
-import aiohttp
 
 from config.config import CLOUD_TYPE_MAP
+from utils.http_pool import http_session_pool
+from utils.search_cache import search_result_cache
 
 logger = logging.getLogger(__name__)
 
 class PanSou(object):
-    # 会话最大存活时间：1小时
-    _SESSION_MAX_AGE = timedelta(hours=1)
-
     def __init__(self):
         self.host = os.getenv('PANSOU_HOST')
-        self._session = None
-        self._session_created_at = None
         self.cloud_type_map = CLOUD_TYPE_MAP
 
     async def _get_session(self):
-        """获取或创建会话，支持会话过期自动重建"""
-        # 检查会话是否需要重新创建
-        need_new_session = (
-            self._session is None or
-            self._session_created_at is None or
-            self._session.closed or
-            datetime.now() - self._session_created_at > self._SESSION_MAX_AGE
+        """从进程级会话池获取到 PanSou 服务的会话"""
+        return http_session_pool.get(self.host)
+
+    async def search(self, keyword, use_cache=True):
+        if not use_cache:
+            return await self._search(keyword)
+        return await search_result_cache.get(
+            'pansou',
+            keyword,
+            lambda: self._search(keyword),
+            cacheable=lambda data: isinstance(data, dict) and bool((data.get('data') or {}).get('merged_by_type'))
         )
 
-        if need_new_session:
-            # 关闭旧会话（如果存在）
-            if self._session and not self._session.closed:
-                try:
-                    await self._session.close()
-                except Exception as e:
-                    logger.warning(f"关闭旧会话时出错: {e}")
-
-            # 创建新会话，添加超时和连接器配置
-            timeout = aiohttp.ClientTimeout(
-                total=30,        # 总超时 30 秒
-                connect=10,      # 连接超时 10 秒
-                sock_read=20     # 读取超时 20 秒
-            )
-
-            connector = aiohttp.TCPConnector(
-                limit=100,           # 最大连接数
-                limit_per_host=30,   # 每个主机的最大连接数
-                ttl_dns_cache=300,   # DNS 缓存 5 分钟
-                force_close=False,   # 使用 HTTP keep-alive
-                enable_cleanup_closed=True  # 清理关闭的连接
-            )
-
-            self._session = aiohttp.ClientSession(
-                timeout=timeout,
-                connector=connector
-            )
-            self._session_created_at = datetime.now()
-            logger.debug("已创建新的 HTTP 会话")
-
-        return self._session
-
-    async def close(self):
-        """关闭会话并清理资源"""
-        if self._session and not self._session.closed:
-            try:
-                await self._session.close()
-                # 等待连接器完全关闭
-                await asyncio.sleep(0.1)
-            except Exception as e:
-                logger.warning(f"关闭会话时出错: {e}")
-            finally:
-                self._session = None
-                self._session_created_at = None
-
-    async def search(self, keyword):
-        async with await self._get_session() as session:
-            async with session.post(
-                self.host + "/api/search",
-                json={
-                  "kw": keyword,
-                  "refresh": False,
-                  "res": "merge",
-                  "src": "all",
-                  "cloud_types": ["baidu", "quark"]
-                }
-            ) as resp:
-                if resp.status != 200:
-                    error_text = await resp.text()
-                    logger.error(f"PANSOU search error: {error_text}")
-                    return None
-                return await resp.json()
+    async def _search(self, keyword):
+        session = await self._get_session()
+        async with session.post(
+            self.host + "/api/search",
+            json={
+              "kw": keyword,
+              "refresh": False,
+              "res": "merge",
+              "src": "all",
+              "cloud_types": ["baidu", "quark"]
+            }
+        ) as resp:
+            if resp.status != 200:
+                error_text = await resp.text()
+                logger.error(f"PANSOU search error: {error_text}")
+                return None
+            return await resp.json()
 
     async def format_links_by_cloud_type(self, result: dict, links_valid: dict, preferred_clouds=None):
         messages = list()
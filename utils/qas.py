@@ -1,143 +1,326 @@
 import asyncio
+import copy
 import datetime
+import hashlib
 import json
 import logging
 import pprint
 import re
-from datetime import timedelta
 from typing import Tuple
 from urllib.parse import urlparse, parse_qs
 
 import aiohttp
 import pytz
 
-from config.config import TIME_ZONE, AI_API_KEYS, AI_MODEL, AI_API_KEY, AI_HOST
+from config.config import TIME_ZONE, AI_API_KEYS, AI_MODEL, AI_API_KEY, AI_HOST, QUARK_SHARE_CRAWL_CONCURRENCY, \
+    QUARK_SHARE_CRAWL_MAX_DEPTH, QAS_DATA_CACHE_TTL
 from utils.ai import openapi_chat
+from utils.cache import TTLCache, SingleFlight
+from utils.http_pool import http_session_pool
+from utils.quark import iter_share_dir_detail, share_token_cache, SHARE_DETAIL_URL, QuarkShareListError
 
 logger = logging.getLogger(__name__)
 
+# 分享根目录列表不完整时单独发送的提示，不参与目录段落的解析
+ROOT_TRUNCATED_NOTICE = "⚠️ 分享根目录获取不完整，部分文件夹未显示"
+
+
+class QASDataCache:
+    """
+    QAS /data 快照缓存，按 (host, api_token) 区分用户
+
+    - 快照在有效期内直接返回副本，调用方可随意修改而不影响缓存
+    - 同一用户并发读取时只发起一次请求（single-flight）
+    - 写操作后调用 invalidate，保证之后的读取拿到最新数据
+    - 每个快照带有内容版本号，服务端返回 ETag 时刷新会带上 If-None-Match
+    """
+
+    def __init__(self, ttl: int = QAS_DATA_CACHE_TTL):
+        # 过期快照保留 ETag 用于重新验证
+        self._snapshots = TTLCache(ttl, keep_stale=True)
+        self._flights = SingleFlight()
+        self._generations = dict()
+
+    @staticmethod
+    def compute_version(data) -> str:
+        return hashlib.sha1(json.dumps(data, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+    async def get(self, key, fetcher):
+        """
+        获取快照，过期时通过 fetcher(etag) 刷新
+
+        Args:
+            key: 缓存键
+            fetcher: 协程函数，返回 (data, etag, not_modified)
+
+        Returns:
+            快照 dict（包含 data、version），获取失败时返回 None
+        """
+        snapshot = self._snapshots.get(key)
+        if snapshot is not None:
+            return snapshot
+        return await self._flights.run(key, lambda: self._refresh(key, fetcher, self._snapshots.peek(key)))
+
+    async def _refresh(self, key, fetcher, snapshot):
+        generation = self._generations.get(key, 0)
+        data, etag, not_modified = await fetcher(snapshot['etag'] if snapshot else None)
+        if not_modified and snapshot is not None:
+            data, etag = snapshot['data'], snapshot['etag']
+        if data is None:
+            return None
 
-class QuarkAutoDownload:
-    # 会话最大存活时间：1小时
-    _SESSION_MAX_AGE = timedelta(hours=1)
+        new_snapshot = {
+            'data': data,
+            'etag': etag,
+            'version': self.compute_version(data),
+        }
+        # 刷新期间发生过写操作，本次结果可能是旧数据，不写入缓存
+        if self._generations.get(key, 0) == generation:
+            self._snapshots.set(key, new_snapshot)
+        return new_snapshot
 
-    def __init__(self, api_token):
-        self.api_token = api_token
-        self._session = None
-        self._session_created_at = None
-
-    async def _get_session(self):
-        """获取或创建会话，支持会话过期自动重建"""
-        # 检查会话是否需要重新创建
-        need_new_session = (
-            self._session is None or
-            self._session_created_at is None or
-            self._session.closed or
-            datetime.datetime.now() - self._session_created_at > self._SESSION_MAX_AGE
-        )
+    def invalidate(self, key):
+        self._generations[key] = self._generations.get(key, 0) + 1
+        self._snapshots.pop(key)
+        self._flights.forget(key)
 
-        if need_new_session:
-            # 关闭旧会话（如果存在）
-            if self._session and not self._session.closed:
-                try:
-                    await self._session.close()
-                except Exception as e:
-                    logger.warning(f"关闭旧会话时出错: {e}")
-
-            # 创建新会话，添加超时和连接器配置
-            timeout = aiohttp.ClientTimeout(
-                total=180,        # 总超时 180 秒
-                connect=30,      # 连接超时 30 秒
-                sock_read=40     # 读取超时 40 秒
-            )
+    def stats(self) -> dict:
+        return self._snapshots.stats()
 
-            connector = aiohttp.TCPConnector(
-                limit=100,           # 最大连接数
-                limit_per_host=30,   # 每个主机的最大连接数
-                ttl_dns_cache=300,   # DNS 缓存 5 分钟
-                force_close=False,   # 使用 HTTP keep-alive
-                enable_cleanup_closed=True  # 清理关闭的连接
-            )
 
-            self._session = aiohttp.ClientSession(
-                timeout=timeout,
-                connector=connector
-            )
-            self._session_created_at = datetime.datetime.now()
-            logger.debug("已创建新的 QAS HTTP 会话")
+qas_data_cache = QASDataCache()
 
-        return self._session
 
-    async def close(self):
-        """关闭会话并清理资源"""
-        if self._session and not self._session.closed:
-            try:
-                await self._session.close()
-                await asyncio.sleep(0.1)
-            except Exception as e:
-                logger.warning(f"关闭会话时出错: {e}")
-            finally:
-                self._session = None
-                self._session_created_at = None
+def get_task_key(task: dict) -> str:
+    """任务的稳定标识：任务名 + 分享链接哈希，不随任务在列表中的位置变化"""
+    share_url_hash = hashlib.sha1(str(task.get('shareurl', '')).encode()).hexdigest()[:12]
+    return f"{task.get('taskname')}#{share_url_hash}"
 
-    async def data(self, host):
-        async with await self._get_session() as session:
-            async with session.get(f'{host}/data?token={self.api_token}') as resp:
-                if not resp.ok:
-                    logger.error(f'Failed to get data {host}, error: {resp.reason}')
-                    return None
-                else:
-                    data = await resp.json()
-                    return data.get('data')
+
+def find_task(tasklist: list, task_key: str) -> Tuple[int, dict | None]:
+    """按任务键查找任务，返回 (索引, 任务)，找不到时返回 (-1, None)"""
+    for index, task in enumerate(tasklist):
+        if get_task_key(task) == task_key:
+            return index, task
+    return -1, None
+
+
+def _deep_merge(target: dict, fields: dict):
+    for k, v in fields.items():
+        if isinstance(v, dict) and isinstance(target.get(k), dict):
+            _deep_merge(target[k], v)
+        else:
+            target[k] = copy.deepcopy(v)
+
+
+class TaskListConflictError(Exception):
+    """提交补丁时目标任务已被删除或在读取之后被他人修改"""
+
+
+class TaskListPatch:
+    """
+    QAS tasklist 补丁，按任务键而非列表索引记录修改
+
+    多次修改在提交时合并为一次 update；记录修改时传入读取到的任务，
+    提交前会校验该任务在此期间是否被其他人修改过。更新只校验要修改的字段，
+    QAS 运行时改写的其他字段不算冲突；删除校验整个任务
+    """
+
+    def __init__(self):
+        self._ops = list()
+        # 任务键 -> (参与校验的字段，None 为整个任务, 读取时的版本)
+        self._expected = dict()
+        # 提交后：被更新任务的 原任务键 -> 新索引，以及被删除的任务
+        self.indexes = dict()
+        self.deleted = list()
+
+    def __bool__(self):
+        return bool(self._ops)
+
+    @staticmethod
+    def _version(task: dict, fields) -> str:
+        if fields is not None:
+            task = {field: task.get(field) for field in fields}
+        return QASDataCache.compute_version(task)
+
+    def _expect(self, task_key, expected_task, fields=None):
+        if expected_task is not None and task_key not in self._expected:
+            self._expected[task_key] = (fields, self._version(expected_task, fields))
+
+    def update(self, task_key: str, fields: dict, drop=(), expected_task: dict = None):
+        """
+        Args:
+            task_key: 任务键
+            fields: 要修改的字段，dict 类型的值会与原值递归合并
+            drop: 要移除的字段
+            expected_task: 读取到的任务，用于冲突检测，只比较 fields 中的字段
+        """
+        self._expect(task_key, expected_task, tuple(fields))
+        self._ops.append(('update', task_key, fields, tuple(drop)))
+        return self
+
+    def delete(self, task_key: str, expected_task: dict = None):
+        self._expect(task_key, expected_task)
+        self._ops.append(('delete', task_key, None, ()))
+        return self
+
+    def apply(self, tasklist: list) -> list:
+        """在最新的 tasklist 上应用补丁，返回新的 tasklist，冲突时抛出 TaskListConflictError"""
+        result = copy.deepcopy(tasklist)
+        positions = dict()
+        for index, task in enumerate(result):
+            positions.setdefault(get_task_key(task), index)
+
+        for task_key, (fields, expected_version) in self._expected.items():
+            if task_key not in positions:
+                raise TaskListConflictError(f"任务 {task_key} 已不存在")
+            if self._version(tasklist[positions[task_key]], fields) != expected_version:
+                raise TaskListConflictError(f"任务 {task_key} 已被修改")
+
+        self.deleted = list()
+        deleted_indexes = set()
+        for op, task_key, fields, drop in self._ops:
+            index = positions.get(task_key)
+            if index is None or index in deleted_indexes:
+                raise TaskListConflictError(f"任务 {task_key} 已不存在")
+            if op == 'delete':
+                deleted_indexes.add(index)
+                self.deleted.append(result[index])
+                continue
+            _deep_merge(result[index], fields)
+            for field in drop:
+                result[index].pop(field, None)
+
+        new_indexes = dict()
+        kept = list()
+        for index, task in enumerate(result):
+            if index not in deleted_indexes:
+                new_indexes[index] = len(kept)
+                kept.append(task)
+        self.indexes = {
+            task_key: new_indexes[positions[task_key]]
+            for op, task_key, _, _ in self._ops
+            if op == 'update' and positions[task_key] in new_indexes
+        }
+        return kept
+
+
+class QuarkAutoDownload:
+    # QAS 运行脚本、AI 分析等请求耗时较长
+    _TIMEOUT = aiohttp.ClientTimeout(
+        total=180,        # 总超时 180 秒
+        connect=30,      # 连接超时 30 秒
+        sock_read=40     # 读取超时 40 秒
+    )
+    # 交给 AI 分析的文件数上限，避免 prompt 过长
+    _AI_PROMPT_MAX_FILES = 50
+
+    def __init__(self, api_token):
+        self.api_token = api_token
+
+    async def _get_session(self, url):
+        """从进程级会话池获取到 url 所在主机的会话"""
+        return http_session_pool.get(url, timeout=self._TIMEOUT)
+
+    def _data_cache_key(self, host):
+        return host, self.api_token
+
+    async def _fetch_data(self, host, etag=None):
+        headers = {'If-None-Match': etag} if etag else None
+        session = await self._get_session(host)
+        async with session.get(f'{host}/data?token={self.api_token}', headers=headers) as resp:
+            if resp.status == 304:
+                return None, etag, True
+            if not resp.ok:
+                logger.error(f'Failed to get data {host}, error: {resp.reason}')
+                return None, None, False
+            data = await resp.json()
+            return data.get('data'), resp.headers.get('ETag'), False
+
+    async def data_snapshot(self, host, use_cache=True):
+        """获取 QAS 配置快照，返回 (data, version)，data 为可自由修改的副本"""
+        if not use_cache:
+            self.invalidate_data(host)
+        snapshot = await qas_data_cache.get(
+            self._data_cache_key(host),
+            lambda etag: self._fetch_data(host, etag)
+        )
+        if snapshot is None:
+            return None, None
+        return copy.deepcopy(snapshot['data']), snapshot['version']
+
+    async def data(self, host, use_cache=True):
+        data, _ = await self.data_snapshot(host, use_cache=use_cache)
+        return data
+
+    def invalidate_data(self, host):
+        qas_data_cache.invalidate(self._data_cache_key(host))
+
+    async def patch_tasklist(self, host, patch: TaskListPatch):
+        """
+        提交 tasklist 补丁：重新读取最新配置，校验并应用补丁后以一次 update 写回
+
+        Returns:
+            写回的完整配置，失败时返回 None；任务冲突时抛出 TaskListConflictError
+        """
+        data = await self.data(host, use_cache=False)
+        if data is None:
+            return None
+        data['tasklist'] = patch.apply(data.get('tasklist', []))
+        if not await self.update(host, data):
+            return None
+        return data
 
     async def add_job(self, host, task_name, share_url, save_path, pattern, replace):
-        async with await self._get_session() as session:
-            async with session.post(
-                    f'{host}/api/add_task?token={self.api_token}',
-                headers={
-                    'Content-Type': 'application/json',
-                },
-                json={
-                    'taskname': task_name,
-                    'shareurl': share_url,
-                    'savepath': save_path,
-                    'pattern': pattern,
-                    'replace': replace
-                }
-            ) as resp:
-                if not resp.ok:
-                    logger.error(f'Failed to add task {task_name}, error: {resp.text}')
-                return await resp.json()
+        session = await self._get_session(host)
+        async with session.post(
+                f'{host}/api/add_task?token={self.api_token}',
+            headers={
+                'Content-Type': 'application/json',
+            },
+            json={
+                'taskname': task_name,
+                'shareurl': share_url,
+                'savepath': save_path,
+                'pattern': pattern,
+                'replace': replace
+            }
+        ) as resp:
+            self.invalidate_data(host)
+            if not resp.ok:
+                logger.error(f'Failed to add task {task_name}, error: {resp.text}')
+            return await resp.json()
 
     async def update(self, host, data):
-        async with await self._get_session() as session:
-            async with session.post(
-                f'{host}/update?token={self.api_token}',
-                headers={
-                    'Content-Type': 'application/json',
-                },
-                json=data
-            ) as resp:
-                if not resp.ok:
-                    logger.error(f'Failed to update data {host}, error: {resp.text}')
-                else:
-                    logger.info(f'Success to update data {host}, data: {data}')
-                    return await resp.json()
+        session = await self._get_session(host)
+        async with session.post(
+            f'{host}/update?token={self.api_token}',
+            headers={
+                'Content-Type': 'application/json',
+            },
+            json=data
+        ) as resp:
+            self.invalidate_data(host)
+            if not resp.ok:
+                logger.error(f'Failed to update data {host}, error: {resp.text}')
+            else:
+                logger.info(f'Success to update data {host}, data: {data}')
+                return await resp.json()
 
     async def get_share_detail(self, host, data):
-        async with await self._get_session() as session:
-            async with session.post(
-                f'{host}/get_share_detail?token={self.api_token}',
-                headers={
-                    'Content-Type': 'application/json',
-                },
-                json=data
-            ) as resp:
-                if not resp.ok:
-                    logger.error(f'Failed to get_share_detail {host}, error: {resp.text}')
-                else:
-                    logger.info(f'Success to get_share_detail {host}, data: {data}')
-                    return await resp.json()
+        session = await self._get_session(host)
+        async with session.post(
+            f'{host}/get_share_detail?token={self.api_token}',
+            headers={
+                'Content-Type': 'application/json',
+            },
+            json=data
+        ) as resp:
+            if not resp.ok:
+                logger.error(f'Failed to get_share_detail {host}, error: {resp.text}')
+            else:
+                logger.info(f'Success to get_share_detail {host}, data: {data}')
+                return await resp.json()
 
     async def extract_quark_share_info(self, url: str):
         match = re.search(r'https://pan\.quark\.cn/s/([a-zA-Z0-9]+)', url)
@@ -166,116 +349,179 @@ class QuarkAutoDownload:
         if pdir_fid == 'share' or pdir_fid == quark_id:
             pdir_fid = 0
 
+        stoken = share_token_cache.get(quark_id, pass_code)
+        if stoken is not None:
+            return quark_id, stoken, pdir_fid
+
         try:
-            async with await self._get_session() as session:
-                async with session.post(
-                    "https://drive-h.quark.cn/1/clouddrive/share/sharepage/token?pr=ucpro&fr=pc",
-                    headers={
-                        'Content-Type': 'application/json',
-                    },
-                    json={
-                        "pwd_id": quark_id,
-                        "passcode": pass_code,
-                        "support_visit_limit_private_share": True
-                    }
-                ) as stoken_resp:
-                    if not stoken_resp.ok:
-                        logger.error(f'Failed to get quark stoken {url}, error: {await stoken_resp.text()}')
-                        return quark_id, None, pdir_fid
-                    data = await stoken_resp.json()
-                    stoken = data['data']['stoken']
-                return quark_id, stoken, pdir_fid
+            session = await self._get_session(SHARE_DETAIL_URL)
+            async with session.post(
+                "https://drive-h.quark.cn/1/clouddrive/share/sharepage/token?pr=ucpro&fr=pc",
+                headers={
+                    'Content-Type': 'application/json',
+                },
+                json={
+                    "pwd_id": quark_id,
+                    "passcode": pass_code,
+                    "support_visit_limit_private_share": True
+                }
+            ) as stoken_resp:
+                if not stoken_resp.ok:
+                    logger.error(f'Failed to get quark stoken {url}, error: {await stoken_resp.text()}')
+                    return quark_id, None, pdir_fid
+                data = await stoken_resp.json()
+                stoken = data['data']['stoken']
+            share_token_cache.set(quark_id, pass_code, stoken)
+            return quark_id, stoken, pdir_fid
         except (aiohttp.ClientError, asyncio.TimeoutError, KeyError) as e:
             logger.error(f'获取夸克分享token失败 {url}, 错误: {e}')
             return quark_id, None, pdir_fid
 
-    async def get_quark_dir_detail(self, quark_id, stoken, pdir_fid, include_dir=True):
-        async with await self._get_session() as session:
-            try:
-                async with session.get(
-                    f'https://drive-h.quark.cn/1/clouddrive/share/sharepage/detail',
-                    params={
-                        'pr': 'ucpro',
-                        'fr': 'pc',
-                        'uc_param_str': '',
-                        '_size': 20,
-                        'pdir_fid': pdir_fid,
-                        'pwd_id': quark_id,
-                        'stoken': stoken,
-                        'ver': 2
-                    }
-                ) as sub_resp:
-                    data = await sub_resp.json()
-                    if not sub_resp.ok:
-                        logger.error(f'Failed to get quark sub {quark_id}/{pdir_fid}, error: {data}')
-                        return []
-                    if include_dir:
-                        return data['data']['list']
-                    else:
-                        return [file for file in data['data']['list'] if not file.get('dir')]
-            except (aiohttp.ClientError, asyncio.TimeoutError, KeyError) as e:
-                logger.error(f'获取夸克目录详情失败 {quark_id}/{pdir_fid}, 错误: {e}')
-                return []
+    async def _fetch_quark_dir_detail(self, session, quark_id, stoken, pdir_fid, include_dir=True, limit=None):
+        """返回 (文件列表, 是否完整)，中途失败时文件列表为已获取的部分"""
+        files = list()
+        try:
+            async for file in iter_share_dir_detail(
+                session, quark_id, stoken, pdir_fid, include_dir=include_dir, limit=limit
+            ):
+                files.append(file)
+        except (QuarkShareListError, aiohttp.ClientError, asyncio.TimeoutError, KeyError) as e:
+            logger.error(f'获取夸克目录详情失败 {quark_id}/{pdir_fid}, 已获取 {len(files)} 项, 错误: {e}')
+            return files, False
+        return files, True
+
+    async def get_quark_dir_detail(self, quark_id, stoken, pdir_fid, include_dir=True, limit=None):
+        """
+        获取分享目录下的文件列表，limit 为最多返回的条数，None 表示获取全部分页
+
+        任意一页获取失败时返回空列表，不返回不完整的列表
+        """
+        session = await self._get_session(SHARE_DETAIL_URL)
+        files, complete = await self._fetch_quark_dir_detail(session, quark_id, stoken, pdir_fid, include_dir, limit)
+        return files if complete else []
+
+    async def crawl_share_dirs(self, quark_id, stoken, pdir_fid, max_depth: int = None,
+                               concurrency: int = None) -> Tuple[dict, set]:
+        """
+        广度优先遍历分享目录，同一层的兄弟目录复用同一个会话并发获取
+
+        Args:
+            quark_id: 分享 ID
+            stoken: 分享 token
+            pdir_fid: 起始目录 fid
+            max_depth: 最大遍历深度，起始目录为第 0 层，默认取 QUARK_SHARE_CRAWL_MAX_DEPTH
+            concurrency: 并发请求数上限，默认取 QUARK_SHARE_CRAWL_CONCURRENCY
+
+        Returns:
+            ({fid: 目录下的文件列表}, 列表不完整的目录 fid 集合)；
+            获取中途失败的目录保留已获取的部分并计入不完整集合，超出深度的目录不在结果中
+        """
+        if max_depth is None:
+            max_depth = QUARK_SHARE_CRAWL_MAX_DEPTH
+        semaphore = asyncio.Semaphore(concurrency or QUARK_SHARE_CRAWL_CONCURRENCY)
+        dir_files = dict()
+        truncated = set()
+
+        async def fetch(session, fid):
+            async with semaphore:
+                return await self._fetch_quark_dir_detail(session, quark_id, stoken, fid)
+
+        session = await self._get_session(SHARE_DETAIL_URL)
+        depth = 0
+        current_level = [pdir_fid]
+        while current_level:
+            results = await asyncio.gather(
+                *(fetch(session, fid) for fid in current_level),
+                return_exceptions=True
+            )
+            next_level = list()
+            for fid, result in zip(current_level, results):
+                # 单个目录失败只影响自身，不中断整层遍历
+                if isinstance(result, Exception):
+                    logger.warning(f'获取子目录失败 {quark_id}/{fid}, 跳过该目录。错误: {result}')
+                    result = [], False
+                files, complete = result
+                if not complete:
+                    truncated.add(fid)
+                dir_files[fid] = files
+                if depth < max_depth:
+                    next_level.extend(
+                        file['fid'] for file in files
+                        if file.get('dir') is True and file['fid'] not in dir_files
+                    )
+            current_level = next_level
+            depth += 1
+
+        logger.info(f"遍历分享 {quark_id} 完成，共 {len(dir_files)} 个目录（{len(truncated)} 个不完整），深度 {depth}")
+        return dir_files, truncated
+
+    @staticmethod
+    def _format_last_update_at(file) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(int(file['last_update_at']) / 1000,
+                                               tz=datetime.UTC
+                                               ).astimezone(pytz.timezone(TIME_ZONE))
 
     async def get_quark_dir_structure(self, quark_id, stoken, pdir_fid):
-        result = list()
-        file_list = await self.get_quark_dir_detail(quark_id=quark_id, stoken=stoken, pdir_fid=pdir_fid)
-        for file in file_list:
-            if file['dir'] is True:
-                include_items = await self.get_quark_dir_structure(quark_id=quark_id, stoken=stoken, pdir_fid=file['fid'])
-            else:
-                include_items = None
-            result.append({
-                "dir": file['dir'],
-                "file_name": file['file_name'],
-                "fid": file['fid'],
-                "include_items_count": file.get('include_items_count', None),
-                "include_items": include_items,
-                "last_update_at": datetime.datetime.fromtimestamp(int(file['last_update_at'])/1000,
-                                                                  tz=datetime.UTC
-                                                                  ).astimezone(pytz.timezone(TIME_ZONE)),
-            })
-        return result
+        dir_files, _ = await self.crawl_share_dirs(quark_id=quark_id, stoken=stoken, pdir_fid=pdir_fid)
+
+        def build_structure(fid):
+            result = list()
+            for file in dir_files.get(fid, []):
+                if file['dir'] is True and file['fid'] in dir_files:
+                    include_items = build_structure(file['fid'])
+                else:
+                    include_items = None
+                result.append({
+                    "dir": file['dir'],
+                    "file_name": file['file_name'],
+                    "fid": file['fid'],
+                    "include_items_count": file.get('include_items_count', None),
+                    "include_items": include_items,
+                    "last_update_at": self._format_last_update_at(file),
+                })
+            return result
+
+        return build_structure(pdir_fid)
 
     async def get_fid_files(self, url: str, include_dir: bool = False):
-        async def recursive_get_fid_files(fid, file_name, quark_id, stoken, fid_files, include_dir):
-            dir_files = list()
-            files = await self.get_quark_dir_detail(quark_id=quark_id, stoken=stoken, pdir_fid=fid)
-            for file in files:
+        """
+        Returns:
+            ({"目录名__fid": 文件列表}, 列表不完整的目录键集合)，无法获取分享 token 时为 (None, 空集合)
+        """
+        def collect_fid_files(fid, file_name, dir_files, fid_files):
+            files = list()
+            for file in dir_files.get(fid, []):
                 if file['dir'] is True:
-                    try:
-                        await recursive_get_fid_files(file['fid'], file['file_name'], quark_id, stoken, fid_files, include_dir)
-                    except Exception as e:
-                        logger.warning(f'递归获取子目录失败 {file["file_name"]}, 跳过该目录。错误: {e}')
-                    if include_dir:
-                        dir_files.append({
-                            "file_name": file['file_name'],
-                            "dir": file['dir'],
-                            "last_update_at": datetime.datetime.fromtimestamp(int(file['last_update_at']) / 1000,
-                                                                              tz=datetime.UTC
-                                                                              ).astimezone(pytz.timezone(TIME_ZONE)),
-                        })
-                else:
-                    dir_files.append({
-                        "file_name": file['file_name'],
-                        "dir": file['dir'],
-                        "last_update_at": datetime.datetime.fromtimestamp(int(file['last_update_at']) / 1000,
-                                                                          tz=datetime.UTC
-                                                                          ).astimezone(pytz.timezone(TIME_ZONE)),
-                    })
-            fid_files[f"{file_name}__{fid}"] = dir_files
-            return dir_files
+                    if file['fid'] in dir_files:
+                        collect_fid_files(file['fid'], file['file_name'], dir_files, fid_files)
+                    if not include_dir:
+                        continue
+                files.append({
+                    "file_name": file['file_name'],
+                    "dir": file['dir'],
+                    "last_update_at": self._format_last_update_at(file),
+                })
+            # 子目录先于父目录写入，与逐层递归时的顺序保持一致
+            fid_files[f"{file_name}__{fid}"] = files
+            if fid in truncated:
+                truncated_keys.add(f"{file_name}__{fid}")
+            return files
 
         logger.info(f"Getting fid files for {url}")
         quark_id, stoken, pdir_fid = await self.get_quark_id_stoken_pdir_fid(url)
         if stoken is None:
-            return None
+            return None, set()
+        dir_files, truncated = await self.crawl_share_dirs(quark_id=quark_id, stoken=stoken, pdir_fid=0)
         fid_files = dict()
-        await recursive_get_fid_files(0, "root", quark_id, stoken, fid_files, include_dir)
-        return fid_files
+        truncated_keys = set()
+        collect_fid_files(0, "root", dir_files, fid_files)
+        return fid_files, truncated_keys
 
-    async def build_unicode_tree_paragraph(self, folder_name: str, files: list) -> str:
+    async def build_unicode_tree_paragraph(self, folder_name: str, files: list, note: str = None) -> str:
+        # 第一行固定为 "目录名__fid"，调用方据此解析
         lines = [f"{folder_name}"]
+        if note:
+            lines.append(note)
         for i, file in enumerate(sorted(files, key=lambda x: x['file_name'])):
             is_last = i == len(files) - 1
             prefix = '└──' if is_last else '├──'
@@ -283,12 +529,17 @@ class QuarkAutoDownload:
             lines.append(f"{prefix} {icon} {file['file_name']}")
         return '\n'.join(lines)
 
-    async def get_tree_paragraphs(self, fid_files: dict) -> list[str]:
+    async def get_tree_paragraphs(self, fid_files: dict, truncated: set = frozenset()) -> list[str]:
+        """
+        truncated 为列表不完整的目录键，在对应段落的第二行标出；
+        根目录不完整时不生成段落，由调用方发送 ROOT_TRUNCATED_NOTICE
+        """
         result = []
         for key, files in fid_files.items():
             if key == 'root__0':
                 continue
-            paragraph = await self.build_unicode_tree_paragraph(key, files)
+            note = "⚠️ 获取不完整，仅显示部分文件" if key in truncated else None
+            paragraph = await self.build_unicode_tree_paragraph(key, files, note)
             result.append(paragraph)
         return result
 
@@ -348,7 +599,8 @@ class QuarkAutoDownload:
 
     async def ai_generate_replace(self, url: str, session, user_id, prompt) -> dict:
         quark_id, stoken, pdir_fid = await self.get_quark_id_stoken_pdir_fid(url=url)
-        dir_details = await self.get_quark_dir_detail(quark_id, stoken, pdir_fid, include_dir=False)
+        dir_details = await self.get_quark_dir_detail(quark_id, stoken, pdir_fid, include_dir=False,
+                                                 limit=self._AI_PROMPT_MAX_FILES)
         files = [
             {
                "file_name": dir_detail['file_name'],
@@ -407,7 +659,8 @@ Replace生成规则：
 
     async def ai_generate_params(self, url: str, session, user_id, prompt) -> dict:
         quark_id, stoken, pdir_fid = await self.get_quark_id_stoken_pdir_fid(url=url)
-        dir_details = await self.get_quark_dir_detail(quark_id, stoken, pdir_fid, include_dir=False)
+        dir_details = await self.get_quark_dir_detail(quark_id, stoken, pdir_fid, include_dir=False,
+                                                 limit=self._AI_PROMPT_MAX_FILES)
         files = [
             {
                "file_name": dir_detail['file_name'],
@@ -463,17 +716,21 @@ Replace生成规则：
         return generate_params
 
     async def run_script_now(self, host, task_list):
-        async with await self._get_session() as session:
-            async with session.post(
-                f'{host}/run_script_now?token={self.api_token}',
-                json={
-                    "tasklist": task_list
-                }
-            ) as resp:
+        session = await self._get_session(host)
+        async with session.post(
+            f'{host}/run_script_now?token={self.api_token}',
+            json={
+                "tasklist": task_list
+            }
+        ) as resp:
+            try:
                 if not resp.ok:
                     logger.error(f'Failed to run script {host}, error: {resp.reason}')
                 else:
                     return await resp.text()
+            finally:
+                # 运行脚本会回写任务状态（如失效标记），结束后需重新读取
+                self.invalidate_data(host)
 
     async def ai_classify_seasons(self, url: str, session, user_id) -> Tuple[dict, dict]:
         quark_id, stoken, pdir_fid = await self.get_quark_id_stoken_pdir_fid(url=url)
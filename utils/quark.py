@@ -1,13 +1,156 @@
 import asyncio
 import logging
+import random
 import re
+from typing import Optional
 from urllib.parse import urlparse, parse_qs
 
 import aiohttp
 
+from config.config import QUARK_LINK_CHECK_CONCURRENCY, QUARK_LINK_CHECK_RATE, QUARK_LINK_CHECK_BURST, \
+    QUARK_LINK_CHECK_RETRIES
+from utils.cache import TTLCache
+from utils.http_pool import http_session_pool, DEFAULT_TIMEOUT, get_rate_limiter
+from utils.link_cache import link_validity_cache
+
 logger = logging.getLogger(__name__)
 
+SHARE_DETAIL_URL = "https://drive-h.quark.cn/1/clouddrive/share/sharepage/detail"
+CLOUDDRIVE_URL = "https://drive-pc.quark.cn/1/clouddrive"
+# 分享目录分页大小
+SHARE_DETAIL_PAGE_SIZE = 50
+# 限流或服务端错误，稍后重试可能成功
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class ShareTokenCache:
+    """分享 stoken 的进程内 TTL 缓存，按 (pwd_id, passcode) 索引，Quark 与 QuarkAutoDownload 共用"""
+
+    def __init__(self, ttl: int = 1800, max_size: int = 2048):
+        """
+        Args:
+            ttl: 缓存有效期（秒）
+            max_size: 最多缓存的分享数，超出后淘汰最久未使用的
+        """
+        self._entries = TTLCache(ttl, max_size)
+
+    def get(self, pwd_id, passcode) -> Optional[str]:
+        return self._entries.get((pwd_id, passcode or ""))
+
+    def set(self, pwd_id, passcode, stoken: str):
+        self._entries.set((pwd_id, passcode or ""), stoken)
+
+    def invalidate(self, pwd_id, stoken: str = None):
+        """使分享的 stoken 失效，传入 stoken 时只移除与之相同的缓存项"""
+        self._entries.remove_if(lambda key, value: key[0] == pwd_id and (stoken is None or value == stoken))
+
+    def stats(self) -> dict:
+        return self._entries.stats()
+
+
+share_token_cache = ShareTokenCache()
+
+
+class QuarkRetryableError(Exception):
+    """夸克接口返回限流或服务端错误"""
+
+    def __init__(self, status: int, message: str = ''):
+        super().__init__(f"[{status}] {message}")
+        self.status = status
+
+
+class QuarkShareListError(Exception):
+    """分享目录某一页获取失败，已产出的文件不完整"""
+
+
+def is_share_token_error(status: int, data) -> bool:
+    """判断分享接口的错误是否由 stoken 过期或无效引起"""
+    if status in (401, 403):
+        return True
+    message = str((data or {}).get('message', '')) if isinstance(data, dict) else ''
+    return 'token' in message.lower()
+
+
+async def iter_share_dir_detail(session: aiohttp.ClientSession, quark_id, stoken, pdir_fid,
+                                include_dir=True, limit=None, page_size=SHARE_DETAIL_PAGE_SIZE, extra_params=None):
+    """
+    分页获取分享目录内容的异步生成器，产出当前页时已在后台预取下一页
+
+    任意一页获取失败时抛出 QuarkShareListError，不会静默截断
+
+    Args:
+        session: 复用的 HTTP 会话
+        quark_id: 分享 ID
+        stoken: 分享 token
+        pdir_fid: 目录 fid
+        include_dir: 是否包含子目录
+        limit: 最多产出的条数，None 表示不限制
+        page_size: 每页条数
+        extra_params: 额外的查询参数（如排序）
+    """
+    async def fetch_page(page):
+        async with session.get(
+            SHARE_DETAIL_URL,
+            params={
+                'pr': 'ucpro',
+                'fr': 'pc',
+                'uc_param_str': '',
+                '_page': page,
+                '_size': page_size,
+                '_fetch_total': 1,
+                'pdir_fid': pdir_fid,
+                'pwd_id': quark_id,
+                'stoken': stoken,
+                'ver': 2,
+                **(extra_params or {}),
+            }
+        ) as resp:
+            data = await resp.json()
+            if not resp.ok:
+                if is_share_token_error(resp.status, data):
+                    share_token_cache.invalidate(quark_id, stoken)
+                raise QuarkShareListError(f"获取分享目录 {quark_id}/{pdir_fid} 第 {page} 页失败: {data}")
+            files = data['data']['list']
+            total = (data.get('metadata') or {}).get('_total')
+            if total is None:
+                # 没有返回总数时，以是否取满一页判断是否还有下一页
+                total = page * page_size + (1 if len(files) >= page_size else 0)
+            return files, total
+
+    page = 1
+    count = 0
+    pending = asyncio.create_task(fetch_page(page))
+    try:
+        while pending is not None:
+            files, total = await pending
+            pending = None
+            if files and page * page_size < total:
+                pending = asyncio.create_task(fetch_page(page + 1))
+            page += 1
+
+            for file in files:
+                if not include_dir and file.get('dir'):
+                    continue
+                yield file
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+    finally:
+        # 提前结束时丢弃尚未消费的预取页
+        if pending is not None:
+            if not pending.done():
+                pending.cancel()
+            elif not pending.cancelled():
+                pending.exception()
+
+
 class Quark:
+    _TIMEOUT = aiohttp.ClientTimeout(
+        total=60,        # 总超时 60 秒
+        connect=15,      # 连接超时 15 秒
+        sock_read=30     # 读取超时 30 秒
+    )
+
     def __init__(self, cookies=None):
         self.user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) quark-cloud-drive/3.14.2 Chrome/112.0.5615.165 Electron/24.1.3.8 Safari/537.36 Channel/pckk_other_ch"
         self.cookies = cookies
@@ -26,7 +169,11 @@ class Quark:
 
         return quark_id, pwd
 
-    async def get_quark_id_stoken_pdir_fid(self, url, session: aiohttp.ClientSession):
+    async def get_quark_id_stoken_pdir_fid(self, url, session: aiohttp.ClientSession, raise_for_retry: bool = False):
+        """
+        Args:
+            raise_for_retry: 获取 stoken 遇到限流或服务端错误时抛出 QuarkRetryableError，而不是返回错误信息
+        """
         quark_id, pass_code = await self.extract_quark_share_info(url)
         match = re.search(r'/([^/]+)-[^/]*$', url)
         if match:
@@ -43,6 +190,10 @@ class Quark:
         if pdir_fid == 'share' or pdir_fid == quark_id:
             pdir_fid = 0
 
+        stoken = share_token_cache.get(quark_id, pass_code)
+        if stoken is not None:
+            return quark_id, stoken, pdir_fid, None
+
         async with session.post(
                 "https://drive-h.quark.cn/1/clouddrive/share/sharepage/token?pr=ucpro&fr=pc",
                 headers={
@@ -54,6 +205,8 @@ class Quark:
                     "support_visit_limit_private_share": True
                 },
         ) as stoken_resp:
+            if raise_for_retry and stoken_resp.status in RETRY_STATUSES:
+                raise QuarkRetryableError(stoken_resp.status, await stoken_resp.text())
             json_data = await stoken_resp.json()
             if not stoken_resp.ok:
                 logger.error(f'Failed to get quark stoken {url}, error: {await stoken_resp.text()}')
@@ -64,109 +217,158 @@ class Quark:
             except Exception as e:
                 logger.error(f'Failed to get quark stoken {url}, error: {e}')
                 return quark_id, None, pdir_fid, '状态未知'
+            share_token_cache.set(quark_id, pass_code, stoken)
             return quark_id, stoken, pdir_fid, None
 
-    async def get_quark_dir_detail(self, quark_id, stoken, pdir_fid, include_dir=True, size=40):
-        timeout = aiohttp.ClientTimeout(
-            total=60,        # 总超时 60 秒
-            connect=15,      # 连接超时 15 秒
-            sock_read=30     # 读取超时 30 秒
+    async def iter_quark_dir_detail(self, quark_id, stoken, pdir_fid, include_dir=True, limit=None):
+        """逐条产出分享目录下的文件，按需分页拉取，调用方可随时停止"""
+        session = http_session_pool.get(SHARE_DETAIL_URL, timeout=self._TIMEOUT)
+        async for file in iter_share_dir_detail(
+            session, quark_id, stoken, pdir_fid,
+            include_dir=include_dir,
+            limit=limit,
+            extra_params={"_sort": "file_type:desc,updated_at:desc"},
+        ):
+            yield file
+
+    async def get_quark_dir_detail(self, quark_id, stoken, pdir_fid, include_dir=True, limit=None):
+        """
+        获取分享目录下的文件列表，limit 为最多返回的条数，None 表示获取全部分页
+
+        任意一页获取失败时返回空列表，不返回不完整的列表
+        """
+        try:
+            return [
+                file async for file in self.iter_quark_dir_detail(
+                    quark_id, stoken, pdir_fid, include_dir=include_dir, limit=limit
+                )
+            ]
+        except QuarkShareListError as e:
+            logger.error(e)
+            return []
+
+    async def _check_link_once(self, session: aiohttp.ClientSession, link: str):
+        quark_id, stoken, pdir_fid, error = await self.get_quark_id_stoken_pdir_fid(
+            url=link, session=session, raise_for_retry=True
         )
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(
-                f'https://drive-h.quark.cn/1/clouddrive/share/sharepage/detail',
-                params={
-                    'pr': 'ucpro',
-                    'fr': 'pc',
-                    'uc_param_str': '',
-                    '_size': size,
-                    'pdir_fid': pdir_fid,
-                    'pwd_id': quark_id,
-                    'stoken': stoken,
-                    'ver': 2,
-                    "_sort": "file_type:desc,updated_at:desc",
-                }
-            ) as sub_resp:
-                data = await sub_resp.json()
-                if not sub_resp.ok:
-                    logger.error(f'Failed to get quark sub {quark_id}/{pdir_fid}, error: {data}')
-                    return []
-                if include_dir:
-                    return data['data']['list']
-                else:
-                    return [file for file in data['data']['list'] if not file.get('dir')]
+        if error is not None:
+            return error
+        async with session.get(
+            SHARE_DETAIL_URL,
+            params={
+                "pr": "ucpro",
+                "fr": "pc",
+                "uc_param_str": "",
+                "_size": 5,
+                "pdir_fid": pdir_fid,
+                "pwd_id": quark_id,
+                "stoken": stoken,
+                "ver": 2,
+            },
+        ) as resp:
+            if resp.ok:
+                return "有效"
+            if resp.status in RETRY_STATUSES:
+                raise QuarkRetryableError(resp.status, await resp.text())
+            logger.error(f"link {link} (quark_id: {quark_id}, stoken: {stoken}, pdir_fid: {pdir_fid}) check fail: {await resp.text()}")
+            data = await resp.json()
+            if is_share_token_error(resp.status, data):
+                share_token_cache.invalidate(quark_id, stoken)
+            return data.get("message", "检查失败")
+
+    async def check_link(self, session: aiohttp.ClientSession, link: str, retries: int = QUARK_LINK_CHECK_RETRIES):
+        """
+        校验单个分享链接，每次请求前从夸克的令牌桶取令牌；
+        遇到限流、服务端错误或超时按指数退避加随机抖动重试
+
+        Returns:
+            (link, 状态)，状态为 "有效"、夸克返回的错误信息或 "检查失败: ..."
+        """
+        limiter = get_rate_limiter(SHARE_DETAIL_URL, rate=QUARK_LINK_CHECK_RATE, capacity=QUARK_LINK_CHECK_BURST)
+        attempt = 0
+        while True:
+            await limiter.acquire()
+            try:
+                return link, await self._check_link_once(session, link)
+            except (QuarkRetryableError, asyncio.TimeoutError) as e:
+                if attempt >= retries:
+                    logger.warning(f"check_link {link} 重试 {retries} 次后仍失败: {e}")
+                    return link, "状态未知"
+                # full jitter：在 [0, 0.5 * 2^attempt] 秒内随机等待，避免并发请求同时重试
+                delay = random.uniform(0, 0.5 * 2 ** attempt)
+                attempt += 1
+                logger.info(f"check_link {link} 失败 ({e})，{delay:.2f} 秒后第 {attempt} 次重试")
+                await asyncio.sleep(delay)
+            except Exception as e:
+                logger.error(f"check_link {link} error: {e}")
+                return link, f"检查失败: {str(e)}"
+
+    async def iter_links_valid(self, links: list, concurrency: int = QUARK_LINK_CHECK_CONCURRENCY, use_cache: bool = True):
+        """
+        以固定数量的 worker 校验链接，按完成顺序逐个产出 (link, 状态)，重复链接只校验一次
+
+        use_cache 为 True 时先产出链接校验缓存中未过期的结果，只校验其余链接，结束后写回缓存；
+        调用方提前停止迭代时，未完成的校验会被取消
+        """
+        links = list(dict.fromkeys(links))
+        if use_cache and links:
+            cached = await link_validity_cache.get_many(links)
+            for link, status in cached.items():
+                yield link, status
+            links = [link for link in links if link not in cached]
+        if not links:
+            return
+        session = http_session_pool.get(SHARE_DETAIL_URL, timeout=self._TIMEOUT)
+        pending = asyncio.Queue()
+        for link in links:
+            pending.put_nowait(link)
+        done = asyncio.Queue()
 
-    async def check_link(self, session: aiohttp.ClientSession, link: str):
+        async def worker():
+            while not pending.empty():
+                link = pending.get_nowait()
+                try:
+                    result = await self.check_link(session, link)
+                except Exception as e:
+                    logger.error(f"check_link task failed with exception: {e}")
+                    result = link, f"检查失败: {str(e)}"
+                done.put_nowait(result)
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(links)))]
+        checked = dict()
         try:
-            quark_id, stoken, pdir_fid, error = await self.get_quark_id_stoken_pdir_fid(url=link, session=session)
-            if error is not None:
-                return link, error
-            async with session.get(
-                "https://drive-h.quark.cn/1/clouddrive/share/sharepage/detail",
-                params={
-                    "pr": "ucpro",
-                    "fr": "pc",
-                    "uc_param_str": "",
-                    "_size": 5,
-                    "pdir_fid": pdir_fid,
-                    "pwd_id": quark_id,
-                    "stoken": stoken,
-                    "ver": 2,
-                },
-            ) as resp:
-                if resp.ok:
-                    return link, "有效"
-                else:
-                    logger.error(f"link {link} (quark_id: {quark_id}, stoken: {stoken}, pdir_fid: {pdir_fid}) check fail: {await resp.text()}")
-                    data = await resp.json()
-                    return link, data.get("message", "检查失败")
-        except Exception as e:
-            logger.error(f"check_link {link} error: {e}")
-            return link, f"检查失败: {str(e)}"
+            for _ in range(len(links)):
+                link, status = await done.get()
+                checked[link] = status
+                yield link, status
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if use_cache:
+                await link_validity_cache.set_many(checked)
 
     async def links_valid(self, links: list):
-        result = dict()
-        timeout = aiohttp.ClientTimeout(
-            total=60,        # 总超时 60 秒
-            connect=15,      # 连接超时 15 秒
-            sock_read=30     # 读取超时 30 秒
-        )
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            tasks = [self.check_link(session, link) for link in links]
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            for r in results:
-                if isinstance(r, Exception):
-                    # 如果是异常对象，记录错误并继续处理其他结果
-                    logger.error(f"check_link task failed with exception: {r}")
-                    continue
-                if isinstance(r, tuple) and len(r) == 2:
-                    link, status = r
-                    result[link] = status
-        return result
+        return {link: status async for link, status in self.iter_links_valid(links)}
 
     async def get_path_file_map(self, paths: list):
         files = []
         file_paths = paths[:50]
-        timeout = aiohttp.ClientTimeout(
-            total=60,        # 总超时 60 秒
-            connect=15,      # 连接超时 15 秒
-            sock_read=30     # 读取超时 30 秒
-        )
         while True:
             url = f"https://drive-pc.quark.cn/1/clouddrive/file/info/path_list"
             querystring = {"pr": "ucpro", "fr": "pc"}
             payload = {"file_path": file_paths, "namespace": "0"}
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with await session.post(url, params=querystring, json=payload, headers=self.headers) as resp:
-                    response = await resp.json()
-                    if response["code"] == 0:
-                        files += response["data"]
-                        file_paths = file_paths[50:]
-                    else:
-                        logger.error(f"获取目录ID：失败, {response['message']}")
-                        break
-                    if len(file_paths) == 0:
-                        break
+            session = http_session_pool.get(url, timeout=self._TIMEOUT)
+            async with await session.post(url, params=querystring, json=payload, headers=self.headers) as resp:
+                response = await resp.json()
+                if response["code"] == 0:
+                    files += response["data"]
+                    file_paths = file_paths[50:]
+                else:
+                    logger.error(f"获取目录ID：失败, {response['message']}")
+                    break
+                if len(file_paths) == 0:
+                    break
         return dict(zip(paths, files))
 
     async def get_path_pdir_fid(self, path):
@@ -195,8 +397,8 @@ class Quark:
             logger.error(f'path {path} is empty')
             return None
 
-    async def get_quark_clouddrive_files(self, pdir_fid, size=30):
-        async def recursive_get_quark_clouddrive_files(pdir_fid, session, size, page=1, files=None):
+    async def get_quark_clouddrive_files(self, pdir_fid, page_size=30):
+        async def recursive_get_quark_clouddrive_files(pdir_fid, session, page_size, page=1, files=None):
             if files is None:
                 files = []
             url = f"https://drive-pc.quark.cn/1/clouddrive/file/sort"
@@ -206,7 +408,7 @@ class Quark:
                 "uc_param_str": "",
                 "pdir_fid": pdir_fid,
                 "_page": page,
-                "_size": size,
+                "_size": page_size,
                 "_fetch_total": "1",
                 "_fetch_sub_dirs": "0",
                 "_sort": "file_type:asc,updated_at:desc",
@@ -224,15 +426,10 @@ class Quark:
                 if len(files) >= response["metadata"]["_total"]:
                     return files
                 else:
-                    return await recursive_get_quark_clouddrive_files(pdir_fid, session, size, page+1, files)
+                    return await recursive_get_quark_clouddrive_files(pdir_fid, session, page_size, page+1, files)
 
-        timeout = aiohttp.ClientTimeout(
-            total=60,        # 总超时 60 秒
-            connect=15,      # 连接超时 15 秒
-            sock_read=30     # 读取超时 30 秒
-        )
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            result = await recursive_get_quark_clouddrive_files(pdir_fid, session, size, 1, [])
+        session = http_session_pool.get(CLOUDDRIVE_URL, timeout=self._TIMEOUT)
+        result = await recursive_get_quark_clouddrive_files(pdir_fid, session, page_size, 1, [])
 
         if isinstance(result, list):
             return result
@@ -241,49 +438,52 @@ class Quark:
 
 
     async def delete_files(self, filelist: list):
-        timeout = aiohttp.ClientTimeout(
-            total=60,        # 总超时 60 秒
-            connect=15,      # 连接超时 15 秒
-            sock_read=30     # 读取超时 30 秒
-        )
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(
-                f'https://drive-pc.quark.cn/1/clouddrive/file/delete?pr=ucpro&fr=pc&uc_param_str=',
-                headers=self.headers,
-                json={
-                    "action_type": 2,
-                    "filelist": filelist,
-                    "exclude_fids": []
-                }
-            ) as sub_resp:
-                data = await sub_resp.json()
-                if not sub_resp.ok:
-                    logger.error(f'Failed to delete files: {filelist}, error: {data}')
-                    return None
-                return data
+        session = http_session_pool.get(CLOUDDRIVE_URL, timeout=self._TIMEOUT)
+        async with session.post(
+            f'https://drive-pc.quark.cn/1/clouddrive/file/delete?pr=ucpro&fr=pc&uc_param_str=',
+            headers=self.headers,
+            json={
+                "action_type": 2,
+                "filelist": filelist,
+                "exclude_fids": []
+            }
+        ) as sub_resp:
+            data = await sub_resp.json()
+            if not sub_resp.ok:
+                logger.error(f'Failed to delete files: {filelist}, error: {data}')
+                return None
+            return data
 
-    async def get_account_info(self):
-        """获取账户信息,用于检查cookies是否有效"""
+    async def get_account_info(self, raise_error: bool = False):
+        """
+        获取账户信息,用于检查cookies是否有效
+
+        Args:
+            raise_error: 为 True 时网络错误、限流等异常直接抛出，便于调用方区分"Cookies 无效"和"检测失败"
+        """
         url = "https://pan.quark.cn/account/info"
         querystring = {"fr": "pc", "platform": "pc"}
-        timeout = aiohttp.ClientTimeout(
-            total=30,        # 总超时 30 秒
-            connect=10,      # 连接超时 10 秒
-            sock_read=20     # 读取超时 20 秒
-        )
         try:
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.get(
-                    url,
-                    headers=self.headers,
-                    params=querystring
-                ) as response:
+            session = http_session_pool.get(url, timeout=DEFAULT_TIMEOUT)
+            async with session.get(
+                url,
+                headers=self.headers,
+                params=querystring
+            ) as response:
+                if raise_error and response.status in RETRY_STATUSES:
+                    raise QuarkRetryableError(response.status, await response.text())
+                try:
                     data = await response.json()
-                    if data.get("data"):
-                        return data["data"]
-                    else:
-                        return False
+                except (aiohttp.ContentTypeError, ValueError):
+                    # 返回的不是 JSON（如跳转到登录页），视为 Cookies 无效
+                    return False
+                if data.get("data"):
+                    return data["data"]
+                else:
+                    return False
         except Exception as e:
+            if raise_error:
+                raise
             logger.error(f'Failed to get account info: {e}')
             return False
 
@@ -300,13 +500,14 @@ async def main():
 
     # 测试分享链接
     print('分享文件')
-    async with aiohttp.ClientSession() as http_session:
-        quark_id, stoken, pdir_fid, _ = await quark.get_quark_id_stoken_pdir_fid(
-            url="",
-            session=http_session
-        )
-        dir_details = await quark.get_quark_dir_detail(quark_id, stoken, pdir_fid, include_dir=False)
-        print(json.dumps(dir_details, indent=4, ensure_ascii=False))
+    http_session = http_session_pool.get(SHARE_DETAIL_URL)
+    quark_id, stoken, pdir_fid, _ = await quark.get_quark_id_stoken_pdir_fid(
+        url="",
+        session=http_session
+    )
+    dir_details = await quark.get_quark_dir_detail(quark_id, stoken, pdir_fid, include_dir=False)
+    print(json.dumps(dir_details, indent=4, ensure_ascii=False))
+    await http_session_pool.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,75 @@
+import logging
+import re
+import unicodedata
+from collections import defaultdict
+
+from config.config import SEARCH_RESULT_CACHE_TTL, SEARCH_RESULT_CACHE_SIZE
+from utils.cache import TTLCache, SingleFlight, hit_rate
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_keyword(keyword: str) -> str:
+    """统一全角/半角、大小写与空白，使同一片名的不同写法命中同一缓存"""
+    keyword = unicodedata.normalize('NFKC', keyword or '')
+    return re.sub(r'\s+', ' ', keyword).strip().lower()
+
+
+class SearchResultCache:
+    """
+    资源搜索结果缓存，按 (搜索源, 规范化关键词) 索引，所有会话共用
+
+    - 有效期内直接返回缓存结果，结果为共享对象，调用方不要修改
+    - 相同关键词的并发搜索只向上游发起一次请求（single-flight）
+    - 失败或空结果不缓存
+    """
+
+    def __init__(self, ttl: int = SEARCH_RESULT_CACHE_TTL, max_size: int = SEARCH_RESULT_CACHE_SIZE):
+        self._entries = TTLCache(ttl, max_size)
+        self._flights = SingleFlight()
+        # source -> {'hits': n, 'misses': n, 'coalesced': n}
+        self._counters = defaultdict(lambda: {'hits': 0, 'misses': 0, 'coalesced': 0})
+
+    async def get(self, source: str, keyword: str, fetcher, cacheable=bool):
+        """
+        Args:
+            source: 搜索源名称，如 cloud_saver、pansou
+            keyword: 搜索关键词
+            fetcher: 无参协程函数，返回搜索结果
+            cacheable: 判断结果是否可以缓存的函数
+        """
+        key = (source, normalize_keyword(keyword))
+        counters = self._counters[source]
+        result = self._entries.get(key)
+        if result is not None:
+            counters['hits'] += 1
+            return result
+
+        counters['coalesced' if key in self._flights else 'misses'] += 1
+        return await self._flights.run(key, lambda: self._fetch(key, fetcher, cacheable))
+
+    async def _fetch(self, key, fetcher, cacheable):
+        result = await fetcher()
+        if cacheable(result):
+            self._entries.set(key, result)
+        return result
+
+    def invalidate(self, source: str = None, keyword: str = None):
+        """清除缓存，不传参数时清空全部"""
+        keyword = None if keyword is None else normalize_keyword(keyword)
+        self._entries.remove_if(
+            lambda key, _: (source is None or key[0] == source) and (keyword is None or key[1] == keyword)
+        )
+
+    def stats(self) -> dict:
+        sources = dict()
+        for source, counters in self._counters.items():
+            total = counters['hits'] + counters['misses'] + counters['coalesced']
+            sources[source] = dict(counters, hit_rate=hit_rate(counters['hits'] + counters['coalesced'], total))
+        return {
+            'size': len(self._entries),
+            'sources': sources,
+        }
+
+
+search_result_cache = SearchResultCache()
@@ -0,0 +1,296 @@
+import asyncio
+import itertools
+import logging
+from collections import deque, OrderedDict
+from typing import Optional
+
+import telegram
+from telegram.error import RetryAfter
+
+from config.config import TG_BOT_TOKEN, TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_SEND_RETRIES
+from utils.http_pool import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Telegram 单条消息的最大长度
+MESSAGE_MAX_LENGTH = 4096
+# 合并相邻短消息时使用的分隔
+_COALESCE_SEPARATOR = "\n\n"
+# 最多保留的单聊天限流器数量
+_CHAT_LIMITER_SIZE = 4096
+
+# 优先级：交互回复先于批量输出发送
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+# 正在运行的 Application 的 bot，由 main.post_init 注册
+_application_bot: Optional[telegram.Bot] = None
+# 不在 Application 中运行时（如单独执行的脚本）使用的共享 bot
+_fallback_bot: Optional[telegram.Bot] = None
+_fallback_lock = asyncio.Lock()
+
+
+def set_application_bot(bot: Optional[telegram.Bot]):
+    global _application_bot
+    _application_bot = bot
+
+
+async def get_bot() -> telegram.Bot:
+    """发送消息使用的 bot：优先复用 Application 的 bot，共用其连接池"""
+    global _fallback_bot
+    if _application_bot is not None:
+        return _application_bot
+    async with _fallback_lock:
+        if _fallback_bot is None:
+            bot = telegram.Bot(token=TG_BOT_TOKEN)
+            await bot.initialize()
+            _fallback_bot = bot
+    return _fallback_bot
+
+
+async def shutdown_fallback_bot():
+    global _fallback_bot
+    if _fallback_bot is not None:
+        await _fallback_bot.shutdown()
+        _fallback_bot = None
+
+
+def split_text(text: str, limit: int = MESSAGE_MAX_LENGTH) -> list[str]:
+    """按行把长文本切成不超过 limit 的若干段，单行超长时硬切"""
+    if len(text) <= limit:
+        return [text]
+    parts = []
+    current = ""
+    for line in text.split('\n'):
+        while len(line) > limit:
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            parts.append(current)
+            current = line
+        else:
+            current = candidate
+    if current:
+        parts.append(current)
+    return parts
+
+
+class _Outgoing:
+    __slots__ = ('chat_id', 'method', 'kwargs', 'priority', 'coalesce', 'futures')
+
+    def __init__(self, chat_id, method: str, kwargs: dict, priority: int, coalesce: bool):
+        self.chat_id = chat_id
+        self.method = method
+        self.kwargs = kwargs
+        self.priority = priority
+        self.coalesce = coalesce
+        self.futures = [asyncio.get_running_loop().create_future()]
+
+    def can_merge(self, other: '_Outgoing') -> bool:
+        if not (self.coalesce and other.coalesce and self.method == other.method == 'send_message'):
+            return False
+        if 'reply_markup' in self.kwargs or 'reply_markup' in other.kwargs:
+            return False
+        if {k: v for k, v in self.kwargs.items() if k != 'text'} != {k: v for k, v in other.kwargs.items() if k != 'text'}:
+            return False
+        return len(self.kwargs['text']) + len(_COALESCE_SEPARATOR) + len(other.kwargs['text']) <= MESSAGE_MAX_LENGTH
+
+    def merge(self, other: '_Outgoing'):
+        self.kwargs['text'] = f"{self.kwargs['text']}{_COALESCE_SEPARATOR}{other.kwargs['text']}"
+        self.futures.extend(other.futures)
+
+
+class _ChatLanes:
+    __slots__ = ('lanes', 'limiter', 'task')
+
+    def __init__(self, chat_rate: float):
+        self.lanes = (deque(), deque())
+        self.limiter = TokenBucket(rate=chat_rate, capacity=1)
+        self.task: Optional[asyncio.Task] = None
+
+    def pop(self) -> Optional[_Outgoing]:
+        for lane in self.lanes:
+            if lane:
+                item = lane.popleft()
+                # 同一车道中紧接着的可合并消息一起发出
+                while lane and item.can_merge(lane[0]):
+                    item.merge(lane.popleft())
+                return item
+        return None
+
+
+class TelegramSendQueue:
+    """
+    出站消息队列
+
+    每个聊天一个发送协程，保证同一聊天内的消息按入队顺序（先交互车道、后批量车道）发出，
+    并按 chat_rate 节流；所有聊天共用全局预算 global_rate，预算按优先级分配，
+    交互回复不会被批量输出阻塞。被 Telegram 限流（RetryAfter）时按要求等待后重试
+    """
+
+    def __init__(self, global_rate: float = TELEGRAM_GLOBAL_RATE, chat_rate: float = TELEGRAM_CHAT_RATE,
+                 retries: int = TELEGRAM_SEND_RETRIES):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.retries = retries
+        # chat_id -> _ChatLanes
+        self._chats = OrderedDict()
+        self._global = None
+        self._grants = None
+        self._granter = None
+        self._sequence = itertools.count()
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+
+    def _ensure_granter(self):
+        if self._granter is None or self._granter.done():
+            self._global = TokenBucket(rate=self.global_rate, capacity=max(1, int(self.global_rate)))
+            self._grants = asyncio.PriorityQueue()
+            self._granter = asyncio.create_task(self._grant_loop())
+
+    async def _grant_loop(self):
+        """按优先级逐个发放全局令牌"""
+        while True:
+            _, _, future = await self._grants.get()
+            if future.done():
+                continue
+            await self._global.acquire()
+            if not future.done():
+                future.set_result(None)
+
+    async def _acquire_global(self, priority: int):
+        self._ensure_granter()
+        future = asyncio.get_running_loop().create_future()
+        self._grants.put_nowait((priority, next(self._sequence), future))
+        await future
+
+    def _chat(self, chat_id) -> _ChatLanes:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            # 淘汰最早的空闲聊天状态
+            overflow = len(self._chats) + 1 - _CHAT_LIMITER_SIZE
+            if overflow > 0:
+                for idle_id in [k for k, v in self._chats.items() if v.task is None][:overflow]:
+                    del self._chats[idle_id]
+            chat = self._chats[chat_id] = _ChatLanes(self.chat_rate)
+        return chat
+
+    def submit(self, chat_id, method: str = 'send_message', priority: int = PRIORITY_INTERACTIVE,
+               coalesce: bool = False, **kwargs) -> asyncio.Future:
+        """
+        入队一次 bot 调用，返回完成时得到调用结果的 Future
+
+        Args:
+            chat_id: 目标聊天
+            method: bot 方法名，如 send_message、send_photo、edit_message_text
+            priority: PRIORITY_INTERACTIVE 或 PRIORITY_BULK
+            coalesce: 允许与同车道相邻的短文本消息合并为一条发送（不带按钮的 send_message）
+        """
+        item = _Outgoing(chat_id, method, kwargs, priority, coalesce)
+        chat = self._chat(chat_id)
+        chat.lanes[priority].append(item)
+        if chat.task is None:
+            chat.task = asyncio.create_task(self._drain(chat_id, chat))
+        return item.futures[0]
+
+    async def send(self, chat_id, method: str = 'send_message', priority: int = PRIORITY_INTERACTIVE,
+                   coalesce: bool = False, **kwargs):
+        return await self.submit(chat_id, method=method, priority=priority, coalesce=coalesce, **kwargs)
+
+    async def send_text(self, chat_id, text: str, priority: int = PRIORITY_INTERACTIVE, coalesce: bool = False,
+                        **kwargs) -> list:
+        """发送可能超长的文本，自动按行拆成多条，按钮只附在最后一条上"""
+        reply_markup = kwargs.pop('reply_markup', None)
+        parts = split_text(text)
+        futures = list()
+        for index, part in enumerate(parts):
+            if reply_markup is not None and index == len(parts) - 1:
+                kwargs['reply_markup'] = reply_markup
+            futures.append(self.submit(chat_id, priority=priority, coalesce=coalesce, text=part, **kwargs))
+        return list(await asyncio.gather(*futures))
+
+    async def _call(self, item: _Outgoing):
+        bot = await get_bot()
+        for attempt in range(self.retries + 1):
+            await self._acquire_global(item.priority)
+            try:
+                return await getattr(bot, item.method)(chat_id=item.chat_id, **item.kwargs)
+            except RetryAfter as e:
+                if attempt == self.retries:
+                    raise
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                self.retried += 1
+                logger.warning(f"发送消息到 {item.chat_id} 被限流，{retry_after} 秒后重试")
+                await asyncio.sleep(retry_after)
+
+    async def _drain(self, chat_id, chat: _ChatLanes):
+        try:
+            while True:
+                item = chat.pop()
+                if item is None:
+                    return
+                await chat.limiter.acquire()
+                try:
+                    result = await self._call(item)
+                except asyncio.CancelledError:
+                    for future in item.futures:
+                        future.cancel()
+                    raise
+                except Exception as e:
+                    for future in item.futures:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                self.sent += 1
+                self.coalesced += len(item.futures) - 1
+                for future in item.futures:
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            chat.task = None
+
+    async def close(self, timeout: float = 5):
+        """等待已入队的消息发完（最多 timeout 秒），然后停止；未发出的消息的 Future 被取消"""
+        tasks = [chat.task for chat in self._chats.values() if chat.task is not None]
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        # 取消仍在排队的消息，避免等待它们的调用方一直挂起
+        for chat in self._chats.values():
+            for lane in chat.lanes:
+                while lane:
+                    for future in lane.popleft().futures:
+                        future.cancel()
+        if self._granter is not None:
+            self._granter.cancel()
+            self._granter = None
+        self._chats.clear()
+
+    def stats(self) -> dict:
+        return {
+            'chats': len(self._chats),
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'retried': self.retried,
+        }
+
+
+send_queue = TelegramSendQueue()
+
+
+async def send_message(chat_id, text: str, priority: int = PRIORITY_BULK, **kwargs) -> telegram.Message:
+    """
+    定时任务等后台发送：走批量车道，超长文本按行拆分，返回最后一条消息
+
+    不带按钮时允许与同一聊天中相邻的消息合并发送，合并后返回的是合并后的消息
+    """
+    messages = await send_queue.send_text(chat_id, text, priority=priority, coalesce=True, **kwargs)
+    return messages[-1]
+
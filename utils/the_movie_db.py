@@ -1,64 +1,168 @@
 import asyncio
 import logging
+from typing import Optional
 
-from tmdbv3api import TMDb, TV, Genre, Movie
+import aiohttp
 
-from config.config import TMDB_API_KEY, TMDB_POSTER_BASE_URL
+from config.config import TMDB_API_KEY, TMDB_POSTER_BASE_URL, TMDB_RATE, TMDB_RETRIES, TMDB_GENRE_CACHE_TTL, \
+    TMDB_DETAIL_CACHE_TTL, TMDB_DETAIL_CACHE_SIZE, TMDB_SEARCH_CACHE_TTL
+from utils.cache import TTLCache, SingleFlight
+from utils.http_pool import http_session_pool, get_rate_limiter, DEFAULT_TIMEOUT
+from utils.search_cache import normalize_keyword
 
 logger = logging.getLogger(__name__)
 
-class TheMovieDB:
-    def __init__(self):
-        self.tmdb = TMDb()
-        self.tmdb.api_key = TMDB_API_KEY
+TMDB_API_BASE = "https://api.themoviedb.org/3"
+TMDB_LANGUAGE = 'zh'
+
+MEDIA_TV = 'tv'
+MEDIA_MOVIE = 'movie'
+# 详情请求一并返回的附加数据，避免再单独请求图片和外部 id
+DETAIL_APPEND_TO_RESPONSE = 'images,external_ids'
+# 搜索结果缓存的页数上限
+_SEARCH_CACHE_SIZE = 256
+
+
+class TMDBError(Exception):
+    """TMDB 接口返回错误"""
+
+    def __init__(self, status: int, message: str = ''):
+        self.status = status
+        super().__init__(f"TMDB 请求失败 ({status}): {message}")
+
+
+class TMDBService:
+    """
+    TMDB 异步客户端，所有会话共用
+
+    请求走进程级 aiohttp 会话池并共用 TMDB 的令牌桶，被限流时按 Retry-After 重试；
+    流派列表、条目详情与搜索结果分别缓存，过期后带 If-None-Match 重新验证，
+    未修改（304）时直接续期；相同请求的并发调用只请求一次。
+    返回的都是 TMDB 原始 JSON（dict），为共享对象，调用方不要修改
+    """
+
+    def __init__(self, api_key: str = TMDB_API_KEY, rate: float = TMDB_RATE, retries: int = TMDB_RETRIES):
+        self.api_key = api_key
+        self.rate = rate
+        self.retries = retries
         self.poster_base_url = TMDB_POSTER_BASE_URL
-        self.tmdb.language = 'zh'
-        self.tmdb.debug = True
-
-    async def search_tv(self, tv_name, count=10):
-        tv = TV()
-        search = await asyncio.to_thread(tv.search, tv_name, 1)
-
-        if search.get("total_results") == 0:
-            return []
-
-        logger.info(f"TMDB search tv: {tv_name}")
-
-        results = []
-
-        for index, res in enumerate(search):
-            if len(results) >= count:
-                break
-            detail = await asyncio.to_thread(tv.details, res.get('id'))
-            poster_path = detail.get('poster_path')
-            photo_url = f"{self.poster_base_url}{poster_path}"
-            results.append({
-                'name': detail.get('name'),
-                'first_air_date': detail.get('first_air_date'),
-                'photo_url': photo_url,
-            })
-        return results
-
-    async def search_movie(self, movie_name, count=10):
-        movie = Movie()
-        search = await asyncio.to_thread(movie.search, movie_name, 1)
-
-        if search.get("total_results") == 0:
-            return []
-
-        logger.info(f"TMDB search movie: {movie_name}")
-
-        results = []
-
-        for index, res in enumerate(search):
-            if len(results) >= count:
-                break
-            detail = await asyncio.to_thread(movie.details, res.get('id'))
-            poster_path = detail.get('poster_path')
-            photo_url = f"{self.poster_base_url}{poster_path}"
-            results.append({
-                'name': detail.get('title'),
-                'first_air_date': detail.get('release_date'),
-                'photo_url': photo_url,
-            })
-        return results
\ No newline at end of file
+        # 过期条目保留 ETag 用于重新验证
+        self._genres = TTLCache(TMDB_GENRE_CACHE_TTL, 2, keep_stale=True)
+        self._details = TTLCache(TMDB_DETAIL_CACHE_TTL, TMDB_DETAIL_CACHE_SIZE, keep_stale=True)
+        self._searches = TTLCache(TMDB_SEARCH_CACHE_TTL, _SEARCH_CACHE_SIZE, keep_stale=True)
+        self._flights = SingleFlight()
+        self.requests = 0
+        self.not_modified = 0
+
+    async def _request(self, path: str, params: dict = None, etag: str = None):
+        """
+        GET 一个 TMDB 接口
+
+        Returns:
+            (data, etag)；服务端返回 304 时 data 为 None
+        """
+        query = {'api_key': self.api_key, 'language': TMDB_LANGUAGE, **(params or {})}
+        headers = {'If-None-Match': etag} if etag else None
+        session = http_session_pool.get(TMDB_API_BASE, timeout=DEFAULT_TIMEOUT)
+        limiter = get_rate_limiter(TMDB_API_BASE, self.rate, max(1, int(self.rate)))
+        for attempt in range(self.retries + 1):
+            await limiter.acquire()
+            self.requests += 1
+            async with session.get(f"{TMDB_API_BASE}{path}", params=query, headers=headers) as resp:
+                if resp.status == 304:
+                    self.not_modified += 1
+                    return None, etag
+                if resp.status == 429 and attempt < self.retries:
+                    retry_after = float(resp.headers.get('Retry-After') or 1)
+                    logger.warning(f"TMDB 请求被限流，{retry_after} 秒后重试: {path}")
+                    await asyncio.sleep(retry_after)
+                    continue
+                if not resp.ok:
+                    raise TMDBError(resp.status, await resp.text())
+                return await resp.json(), resp.headers.get('ETag')
+
+    async def _cached(self, cache: TTLCache, key, path: str, params: dict = None):
+        """带缓存的 GET，缓存过期时重新验证；未命中的并发调用共用一次请求"""
+        value = cache.get(key)
+        if value is not None:
+            return value[0]
+        return await self._flights.run(key, lambda: self._refresh(cache, key, path, params))
+
+    async def _refresh(self, cache: TTLCache, key, path: str, params: Optional[dict]):
+        stale = cache.peek(key)
+        data, etag = await self._request(path, params, etag=stale[1] if stale else None)
+        if data is None:
+            data = stale[0]
+        cache.set(key, (data, etag))
+        return data
+
+    async def genre_mapping(self, media_type: str) -> dict:
+        """{流派 id: 流派名}"""
+        data = await self._cached(self._genres, ('genre', media_type), f"/genre/{media_type}/list")
+        return {item['id']: item['name'] for item in data.get('genres', [])}
+
+    async def search(self, media_type: str, query: str, page: int = 1) -> dict:
+        """搜索一页，返回 TMDB 原始响应（results、total_pages 等）"""
+        key = ('search', media_type, normalize_keyword(query), int(page))
+        return await self._cached(self._searches, key, f"/search/{media_type}", {'query': query, 'page': int(page)})
+
+    async def detail(self, media_type: str, tmdb_id: int) -> dict:
+        """条目详情，附带 images 与 external_ids"""
+        return await self._cached(
+            self._details, ('detail', media_type, tmdb_id), f"/{media_type}/{tmdb_id}",
+            {
+                'append_to_response': DETAIL_APPEND_TO_RESPONSE,
+                # 不限制语言时 images 只返回与 language 相同的图片，中文海报往往为空
+                'include_image_language': f"{TMDB_LANGUAGE},null,en",
+            }
+        )
+
+    async def details(self, media_type: str, tmdb_ids: list) -> dict:
+        """并发获取多个条目的详情，返回 {tmdb id: 详情}；获取失败的条目不在结果中"""
+        tmdb_ids = list(dict.fromkeys(tmdb_ids))
+        results = await asyncio.gather(
+            *(self.detail(media_type, tmdb_id) for tmdb_id in tmdb_ids),
+            return_exceptions=True
+        )
+        details = dict()
+        for tmdb_id, result in zip(tmdb_ids, results):
+            if isinstance(result, Exception):
+                logger.error(f"获取 TMDB {media_type} {tmdb_id} 详情失败: {result}")
+                continue
+            details[tmdb_id] = result
+        return details
+
+    async def search_with_details(self, media_type: str, query: str, page: int = 1, count: int = None):
+        """
+        搜索一页并并发获取每个结果的详情
+
+        Returns:
+            (搜索响应, [(搜索结果, 详情)])，详情获取失败的结果会被跳过
+        """
+        search = await self.search(media_type, query, page)
+        hits = search.get('results', [])[:count]
+        details = await self.details(media_type, [hit['id'] for hit in hits])
+        return search, [(hit, details[hit['id']]) for hit in hits if hit['id'] in details]
+
+    def poster_url(self, *items: dict) -> str:
+        """依次从搜索结果、详情中取海报，详情中没有 poster_path 时退回附带的 images"""
+        for item in items:
+            if item.get('poster_path'):
+                return f"{self.poster_base_url}{item['poster_path']}"
+        for item in items:
+            posters = (item.get('images') or {}).get('posters') or []
+            if posters:
+                return f"{self.poster_base_url}{posters[0]['file_path']}"
+        return f"{self.poster_base_url}None"
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.requests,
+            'not_modified': self.not_modified,
+            'genres': self._genres.stats(),
+            'details': self._details.stats(),
+            'searches': self._searches.stats(),
+        }
+
+
+tmdb_service = TMDBService()